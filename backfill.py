@@ -0,0 +1,327 @@
+"""Backfill of materialized views from their source tables, partition by partition.
+
+MV в init.sql создаются после INSERT ... FROM file(), поэтому исторических
+данных в них нет, а POPULATE на миллиардах строк raw_events не подходит
+(одна огромная вставка, и строки, пришедшие во время POPULATE, теряются).
+
+    python backfill.py                                # все MV базы ecom
+    python backfill.py --mv offer_events_mv --workers 4 --max-memory 8000000000
+    python backfill.py --mv offer_events_mv --split-by ContentUnitID --splits 8
+
+Как работает:
+  1. SELECT представления (system.tables.as_select) выполняется отдельно для
+     каждой активной партиции исходной таблицы (_partition_id), при
+     --split-by - ещё и по --splits срезам cityHash64(...) % N, и пишется в
+     таблицу этапа backfill_<mv>_<partition_id> той же структуры, что целевая.
+     Партиции обрабатываются параллельно (--workers), память одного INSERT
+     ограничена --max-memory и --threads.
+  2. Партиции целевой таблицы подменяются атомарно: ALTER TABLE ... REPLACE
+     PARTITION FROM. Если каждая целевая партиция получается из одной
+     исходной (offer_events_mv: event_date = toDate(Hour)), подмена идёт сразу
+     после этапа; иначе (current_offers_mv: одна партиция из всех месяцев)
+     все этапы сначала собираются в backfill_<mv>, затем подменяются разом.
+
+Прогресс пишется в ecom.backfill_checkpoints (см. clickhouse/init.sql):
+повторный запуск пропускает готовые партиции и досчитывает только
+незавершённые. --restart начинает заново. Вместе с состоянием запоминаются
+целевые партиции каждой исходной: если целевая партиция новой или
+незавершённой исходной (новый день в месячной партиции) уже заполнена
+готовыми, они заполняются заново - REPLACE иначе стёр бы их строки.
+Отметки без целевых партиций (прежний формат таблицы) считаются незавершёнными.
+С --partitions сверяются только партиции, уже проходившие backfill: о
+целевых партициях остальных ничего не известно.
+
+Подменяемая партиция не должна получать вставки во время backfill: строки,
+которые MV запишет туда между этапом и REPLACE, пропадут. Текущую партицию
+raw_events стоит исключить через --partitions.
+"""
+import argparse
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from clickhouse_driver import Client
+
+CLICKHOUSE_HOST = "localhost"
+CLICKHOUSE_PORT = 9000
+CLICKHOUSE_DB = "ecom"
+CHECKPOINT_TABLE = "backfill_checkpoints"
+STAGE_PREFIX = "backfill_"
+WORKERS = 2
+SOURCE_TOKEN = "__backfill_source__"   # место исходной таблицы в запросе MV
+
+MV_SQL = """
+SELECT name, uuid, create_table_query, as_select
+FROM system.tables
+WHERE database = %(db)s AND engine = 'MaterializedView'
+ORDER BY name
+"""
+
+SOURCE_SQL = """
+SELECT database, name
+FROM system.tables
+WHERE has(dependencies_database, %(db)s) AND has(dependencies_table, %(mv)s)
+"""
+
+PARTITIONS_SQL = """
+SELECT partition_id, any(partition), sum(rows)
+FROM system.parts
+WHERE database = %(db)s AND table = %(table)s AND active
+GROUP BY partition_id
+ORDER BY partition_id
+"""
+
+CHECKPOINTS_SQL = f"""
+SELECT partition_id, state, rows, targets
+FROM {CHECKPOINT_TABLE} FINAL
+WHERE mv = %(mv)s
+"""
+
+
+class BackfillError(Exception):
+    pass
+
+
+def quote(name: str) -> str:
+    return "`" + name.replace("`", "\\`") + "`"
+
+
+def stage_table(mv: str, partition_id: str = None) -> str:
+    suffix = "" if partition_id is None else "_" + re.sub(r"\W", "_", partition_id)
+    return f"{STAGE_PREFIX}{mv}{suffix}"
+
+
+def mv_target(mv: dict) -> str:
+    """Целевая таблица MV: из TO, иначе внутренняя .inner_id.<uuid> (Atomic) или .inner.<имя>."""
+    m = re.match(r"CREATE MATERIALIZED VIEW\s+\S+\s+TO\s+(\S+)", mv["create_table_query"])
+    if m:
+        return m.group(1).split(".")[-1].strip("`")
+    if str(mv["uuid"]).strip("0-"):
+        return f".inner_id.{mv['uuid']}"
+    return f".inner.{mv['name']}"
+
+
+def replace_source(as_select: str, db: str, source: str, replacement: str, mv: str) -> str:
+    """Запрос MV, в котором FROM <source> заменён на FROM <replacement>."""
+    pattern = rf"\bFROM\s+(?:`?{re.escape(db)}`?\.)?`?{re.escape(source)}`?(?![\w.])"
+    if not re.search(pattern, as_select):
+        raise BackfillError(f"{mv}: source table {source} not found in the view query")
+    return re.sub(pattern, lambda _: f"FROM {replacement}", as_select, count=1)
+
+
+class Backfill:
+    """Backfill одного MV; состояние партиций - в backfill_checkpoints."""
+
+    def __init__(self, connect, db: str, mv: dict, args):
+        self.connect = connect
+        self.client = connect()
+        self.db = db
+        self.mv = mv["name"]
+        self.args = args
+        self._local = threading.local()
+        self.target = mv_target(mv)
+        self.source = self._source()
+        self.select = self._select(mv["as_select"])
+        self.columns = [row[0] for row in self.client.execute(f"DESCRIBE ({self.partition_select('all')})")]
+
+    def _source(self) -> str:
+        rows = self.client.execute(SOURCE_SQL, {"db": self.db, "mv": self.mv})
+        if len(rows) != 1 or rows[0][0] != self.db:
+            raise BackfillError(f"{self.mv}: expected one source table in {self.db}, found {rows}")
+        return rows[0][1]
+
+    def _select(self, as_select: str) -> str:
+        return replace_source(as_select, self.db, self.source, f"({SOURCE_TOKEN})", self.mv)
+
+    def partition_select(self, partition_id: str, split: int = None) -> str:
+        condition = f"_partition_id = '{partition_id}'" if partition_id != "all" else "1"
+        if split is not None:
+            condition += f" AND cityHash64({self.args.split_by}) % {self.args.splits} = {split}"
+        source = f"SELECT * FROM {quote(self.db)}.{quote(self.source)} WHERE {condition}"
+        return self.select.replace(SOURCE_TOKEN, source)
+
+    def settings(self) -> dict:
+        settings = {"max_threads": self.args.threads, "max_insert_threads": self.args.threads}
+        if self.args.max_memory:
+            settings["max_memory_usage"] = self.args.max_memory
+            # GROUP BY в запросе MV сбрасывается на диск, а не падает по памяти
+            settings["max_bytes_before_external_group_by"] = self.args.max_memory // 2
+        return settings
+
+    def checkpoints(self) -> dict:
+        return {p: (state, rows, targets)
+                for p, state, rows, targets in self.client.execute(CHECKPOINTS_SQL, {"mv": self.mv})}
+
+    def checkpoint(self, client, partition_id: str, state: str, rows: int = 0, targets: list = ()) -> None:
+        client.execute(f"INSERT INTO {CHECKPOINT_TABLE} (mv, partition_id, state, rows, targets) VALUES",
+                       [(self.mv, partition_id, state, rows, list(targets))])
+
+    def partitions(self, table: str, client=None) -> list:
+        return [row[0] for row in (client or self.client).execute(PARTITIONS_SQL, {"db": self.db, "table": table})]
+
+    def _thread_client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.connect()   # Client не потокобезопасен
+        return self._local.client
+
+    def stage(self, partition_id: str) -> int:
+        """Этап 1: SELECT MV по одной исходной партиции в свою таблицу этапа (идемпотентно)."""
+        client = self._thread_client()
+        table = quote(self.db) + "." + quote(stage_table(self.mv, partition_id))
+        client.execute(f"DROP TABLE IF EXISTS {table}")
+        client.execute(f"CREATE TABLE {table} AS {quote(self.db)}.{quote(self.target)}")
+        columns = ", ".join(quote(c) for c in self.columns)
+        for split in (range(self.args.splits) if self.args.split_by else [None]):
+            client.execute(f"INSERT INTO {table} ({columns}) {self.partition_select(partition_id, split)}",
+                           settings=self.settings())
+        rows = client.execute(f"SELECT count() FROM {table}")[0][0]
+        targets = self.partitions(stage_table(self.mv, partition_id), client)
+        self.checkpoint(client, partition_id, "staged", rows, targets)
+        return rows
+
+    def replace_from(self, table: str) -> int:
+        """REPLACE PARTITION каждой партиции table в целевую таблицу MV."""
+        partitions = self.partitions(table)
+        for partition_id in partitions:
+            self.client.execute(f"ALTER TABLE {quote(self.db)}.{quote(self.target)} "
+                                f"REPLACE PARTITION ID '{partition_id}' FROM {quote(self.db)}.{quote(table)}")
+        return len(partitions)
+
+    def run(self) -> None:
+        if self.args.restart:
+            self.client.execute(f"ALTER TABLE {CHECKPOINT_TABLE} DELETE WHERE mv = %(mv)s", {"mv": self.mv},
+                                settings={"mutations_sync": 1})
+        all_partitions = {p: rows for p, _, rows in
+                          self.client.execute(PARTITIONS_SQL, {"db": self.db, "table": self.source})}
+        source_partitions = dict(all_partitions)
+        if self.args.partitions:
+            source_partitions = {p: rows for p, rows in source_partitions.items() if p in self.args.partitions}
+        done = self.checkpoints()
+        for p, (state, _, targets) in list(done.items()):
+            if state == "staged" and not self.client.execute(f"EXISTS TABLE {quote(self.db)}.{quote(stage_table(self.mv, p))}")[0][0]:
+                del done[p]   # таблицу этапа удалили вручную - заполняем заново
+            elif state == "done" and not targets:
+                del done[p]   # отметка прежнего формата: неизвестно, какие целевые партиции она заполнила
+        todo = [p for p in source_partitions if done.get(p, ("",))[0] not in ("staged", "done")]
+        print(f"{self.mv}: {self.db}.{self.source} -> {self.target}, {len(source_partitions)} partitions, "
+              f"{sum(1 for p in source_partitions if done.get(p, ('',))[0] == 'done')} done, "
+              f"{sum(1 for p in source_partitions if done.get(p, ('',))[0] == 'staged')} staged, {len(todo)} to stage")
+
+        t0 = time.perf_counter()
+        self.stage_all(todo, all_partitions, t0)
+        restaged = set()
+        while True:
+            checkpoints = self.checkpoints()
+            staged = [p for p in all_partitions if checkpoints.get(p, ("",))[0] == "staged"
+                      and (p in source_partitions or p in restaged)]
+            owners = self.owners(checkpoints, all_partitions)
+            # Готовые партиции, чьи целевые партиции подменяются вместе с этапами: REPLACE стёр бы их строки
+            shared = sorted({q for p in staged for t in checkpoints[p][2] for q in owners[t]} - set(staged))
+            if not shared:
+                break
+            print(f"  restaging {len(shared)} partitions sharing target partitions: {', '.join(shared)}")
+            self.stage_all(shared, all_partitions, t0)
+            restaged.update(shared)
+        if not staged:
+            print(f"{self.mv}: nothing to switch")
+            return
+        # Подмена по одной исходной партиции безопасна, только если их целевые партиции не пересекаются
+        aligned = all(len(owners[t]) == 1 for p in staged for t in checkpoints[p][2])
+        if aligned:
+            for p in staged:
+                n = self.replace_from(stage_table(self.mv, p))
+                self.finish(p)
+                print(f"  switched {p}: {n} target partitions")
+        else:
+            # Исходные партиции вне --partitions, чьи целевые партиции неизвестны
+            unknown = [p for p in all_partitions
+                       if p not in staged and not (checkpoints.get(p, ("",))[0] == "done" and checkpoints[p][2])]
+            if unknown:
+                raise BackfillError(f"{self.mv}: target partitions span several source partitions and "
+                                    f"{len(unknown)} source partitions were never backfilled, REPLACE would drop "
+                                    f"their rows; run without --partitions")
+            combined = quote(self.db) + "." + quote(stage_table(self.mv))
+            self.client.execute(f"DROP TABLE IF EXISTS {combined}")
+            self.client.execute(f"CREATE TABLE {combined} AS {quote(self.db)}.{quote(self.target)}")
+            for p in staged:
+                for target_partition in self.partitions(stage_table(self.mv, p)):
+                    self.client.execute(f"ALTER TABLE {combined} ATTACH PARTITION ID '{target_partition}' "
+                                        f"FROM {quote(self.db)}.{quote(stage_table(self.mv, p))}")
+            n = self.replace_from(stage_table(self.mv))
+            for p in staged:
+                self.finish(p)
+            self.client.execute(f"DROP TABLE IF EXISTS {combined}")
+            print(f"  switched {len(staged)} source partitions at once: {n} target partitions")
+        print(f"{self.mv}: done in {time.perf_counter() - t0:.1f} s")
+
+    def stage_all(self, partitions: list, source_partitions: dict, t0: float) -> None:
+        with ThreadPoolExecutor(max_workers=self.args.workers) as pool:
+            for partition_id, rows in zip(partitions, pool.map(self.stage, partitions)):
+                print(f"  staged {partition_id}: {source_partitions[partition_id]} source rows -> {rows} rows "
+                      f"({time.perf_counter() - t0:.1f} s)")
+
+    @staticmethod
+    def owners(checkpoints: dict, source_partitions: dict) -> dict:
+        """Целевая партиция -> исходные партиции (этапы и готовые), строки которых в ней лежат."""
+        owners = {}
+        for p, (state, _, targets) in checkpoints.items():
+            if p in source_partitions and state in ("staged", "done"):
+                for target_partition in targets:
+                    owners.setdefault(target_partition, set()).add(p)
+        return owners
+
+    def finish(self, partition_id: str) -> None:
+        _, rows, targets = self.checkpoints().get(partition_id, ("", 0, []))
+        self.checkpoint(self.client, partition_id, "done", rows, targets)
+        self.client.execute(f"DROP TABLE IF EXISTS {quote(self.db)}.{quote(stage_table(self.mv, partition_id))}")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Resumable partition-wise backfill of materialized views")
+    ap.add_argument("--host", default=CLICKHOUSE_HOST)
+    ap.add_argument("--port", type=int, default=CLICKHOUSE_PORT)
+    ap.add_argument("--user", default="default")
+    ap.add_argument("--password", default="")
+    ap.add_argument("--database", default=CLICKHOUSE_DB)
+    ap.add_argument("--mv", nargs="*", default=None, help="имена MV; по умолчанию все MV базы")
+    ap.add_argument("--partitions", nargs="*", default=None,
+                    help="partition_id исходной таблицы, например 20250901 20250902; по умолчанию все")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="партиций, заполняемых параллельно")
+    ap.add_argument("--threads", type=int, default=4, help="max_threads / max_insert_threads одного INSERT")
+    ap.add_argument("--max-memory", type=int, default=0, help="max_memory_usage одного INSERT, байт (0 - без лимита)")
+    ap.add_argument("--split-by", default=None,
+                    help="выражение над исходной таблицей для деления партиции на срезы, например ContentUnitID")
+    ap.add_argument("--splits", type=int, default=1, help="срезов на партицию при --split-by")
+    ap.add_argument("--restart", action="store_true", help="забыть сохранённый прогресс и начать заново")
+    args = ap.parse_args()
+    if args.split_by and args.splits < 2:
+        ap.error("--split-by requires --splits >= 2")
+    if args.split_by and not args.mv:
+        ap.error("--split-by is an expression over one source table, use it with --mv")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    def connect():
+        return Client(host=args.host, port=args.port, user=args.user, password=args.password, database=args.database)
+
+    client = connect()
+    views = [dict(zip(["name", "uuid", "create_table_query", "as_select"], row))
+             for row in client.execute(MV_SQL, {"db": args.database})]
+    if args.mv:
+        missing = set(args.mv) - {v["name"] for v in views}
+        if missing:
+            raise SystemExit(f"No such materialized views in {args.database}: {', '.join(sorted(missing))}")
+        views = [v for v in views if v["name"] in args.mv]
+    for view in views:
+        try:
+            Backfill(connect, args.database, view, args).run()
+        except BackfillError as e:
+            raise SystemExit(f"Backfill error: {e}")
+
+
+if __name__ == "__main__":
+    main()
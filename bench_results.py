@@ -0,0 +1,147 @@
+"""Benchmark samples stored in ClickHouse and compared against a baseline run.
+
+Каждый замер прогона (одна строка на выполнение запроса) пишется в таблицу
+ecom.bench_results вместе с ревизией git, версией сервера и хэшем настроек,
+поэтому прогоны до и после изменения clickhouse/init.sql можно сравнить
+статистическим критерием, а не на глаз по двум .txt.
+
+Таблица создаётся в clickhouse/init.sql, пользователю benchmark нужны права:
+    GRANT INSERT, SELECT ON ecom.bench_results TO benchmark;
+"""
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+
+from stats import bootstrap_ratio_ci, mann_whitney_greater, quantile
+
+INSERT_BATCH = 100000
+
+RESULT_COLUMNS = [
+    "run_id", "run_time", "git_revision", "server_version", "settings_hash",
+    "mode", "key", "seq", "latency_us",
+]
+
+RUNS_SQL = """
+SELECT run_id, min(run_time) AS run_time, any(git_revision), any(server_version),
+       any(settings_hash), any(mode), count()
+FROM bench_results
+WHERE run_id IN %(run_ids)s
+GROUP BY run_id
+"""
+
+LATEST_BASELINE_SQL = """
+SELECT run_id
+FROM bench_results
+WHERE run_id != %(candidate)s AND mode = %(mode)s AND run_time <= %(before)s
+GROUP BY run_id
+ORDER BY max(run_time) DESC
+LIMIT 1
+"""
+
+SAMPLES_SQL = "SELECT key, latency_us FROM bench_results WHERE run_id = %(run_id)s"
+
+
+def git_revision() -> str:
+    """Короткий хэш HEAD рядом со скриптом, "-dirty" при незакоммиченных изменениях."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=here).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return rev + ("-dirty" if dirty else "")
+
+
+def server_version(client) -> str:
+    return client.execute("SELECT version()")[0][0]
+
+
+def settings_hash(client, scenarios: dict, options: dict) -> str:
+    """Хэш всего, что меняет условия замера, кроме схемы: изменённые настройки
+    сервера для пользователя, SQL и настройки сценариев, параметры режима."""
+    changed = client.execute("SELECT name, value FROM system.settings WHERE changed ORDER BY name")
+    payload = {
+        "server": changed,
+        "scenarios": {name: [s.sql, s.settings, {p: g.spec for p, g in s.params.items()}]
+                      for name, s in sorted(scenarios.items())},
+        "options": options,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+
+def save_samples(client, run: dict, histograms: dict) -> int:
+    """Пишет сырые замеры гистограмм; run - run_id, run_time, git_revision, ... без key/seq/latency."""
+    columns = ", ".join(RESULT_COLUMNS)
+    prefix = [run[c] for c in RESULT_COLUMNS[:6]]
+    batch = []
+    written = 0
+    for key, hist in histograms.items():
+        for seq, value in enumerate(hist.samples, hist.samples_dropped):   # seq - номер замера в прогоне
+            batch.append(prefix + [key, seq, value])
+            if len(batch) >= INSERT_BATCH:
+                written += client.execute(f"INSERT INTO bench_results ({columns}) VALUES", batch)
+                batch = []
+    if batch:
+        written += client.execute(f"INSERT INTO bench_results ({columns}) VALUES", batch)
+    return written
+
+
+def run_info(client, run_ids) -> dict:
+    rows = client.execute(RUNS_SQL, {"run_ids": tuple(run_ids)})
+    return {r[0]: dict(zip(["run_id", "run_time", "git_revision", "server_version",
+                            "settings_hash", "mode", "samples"], r)) for r in rows}
+
+
+def latest_baseline(client, candidate: str, mode: str, before: datetime.datetime) -> str:
+    """Последний прогон того же режима до candidate."""
+    rows = client.execute(LATEST_BASELINE_SQL, {"candidate": candidate, "mode": mode, "before": before})
+    return rows[0][0] if rows else None
+
+
+def load_samples(client, run_id: str) -> dict:
+    """key -> задержки прогона в секундах."""
+    samples = {}
+    for key, value in client.execute(SAMPLES_SQL, {"run_id": run_id}):
+        samples.setdefault(key, []).append(value / 1e6)
+    return samples
+
+
+def compare_samples(baseline: dict, candidate: dict, method: str, alpha: float, threshold: float,
+                    q: float = 0.5) -> list:
+    """Вердикт по каждому ключу: регрессия - статистически значимо И медленнее больше чем на threshold.
+
+    mannwhitney: p-value одностороннего критерия < alpha;
+    bootstrap: тоже односторонняя проверка уровня alpha - нижняя граница двустороннего
+    интервала (1 - 2 * alpha) отношения квантиля q, то есть его alpha-квантиль, > 1.
+    """
+    rows = []
+    for key in sorted(set(baseline) | set(candidate)):
+        a, b = baseline.get(key, []), candidate.get(key, [])
+        row = {"key": key, "n_base": len(a), "n_cand": len(b)}
+        if not a or not b:
+            row["verdict"] = "missing in " + ("baseline" if not a else "candidate")
+            rows.append(row)
+            continue
+        base_q, cand_q = quantile(a, q), quantile(b, q)
+        ratio = cand_q / base_q if base_q > 0 else float("inf")
+        row.update(base=base_q, cand=cand_q, change=ratio - 1)
+        if method == "bootstrap":
+            lo, _, hi = bootstrap_ratio_ci(a, b, q, 1 - 2 * alpha)
+            row["evidence"] = f"CI [{lo:.3f}, {hi:.3f}]"
+            slower, faster = lo > 1.0, hi < 1.0
+        else:
+            _, p_slower = mann_whitney_greater(a, b)
+            _, p_faster = mann_whitney_greater(b, a)
+            row["evidence"] = f"p = {p_slower:.4f}"
+            slower, faster = p_slower < alpha, p_faster < alpha
+        if slower and ratio > 1 + threshold:
+            row["verdict"] = "REGRESSION"
+        elif faster and ratio < 1 - threshold:
+            row["verdict"] = "improved"
+        else:
+            row["verdict"] = "ok"
+        rows.append(row)
+    return rows
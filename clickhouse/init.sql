@@ -27,6 +27,44 @@ CREATE TABLE IF NOT EXISTS raw_events
 ENGINE = MergeTree
 PARTITION BY toDate(Hour)
 ORDER BY (Hour, ContentUnitID);
+-- Дедупликация вставок не включена намеренно: при non_replicated_deduplication_window > 0
+-- сервер отбрасывает и блок без insert_deduplication_token, совпавший по содержимому с одним
+-- из последних N блоков, то есть молча теряет законно повторившиеся события. Повторы
+-- load_parquet.py без дублей требуют её только на время загрузки:
+--   ALTER TABLE raw_events MODIFY SETTING non_replicated_deduplication_window = 10000;
+--   ... load_parquet.py ...
+--   ALTER TABLE raw_events MODIFY SETTING non_replicated_deduplication_window = 0;
+
+-- Замеры нагрузочного теста (test.py), по строке на выполнение запроса
+CREATE TABLE IF NOT EXISTS bench_results
+(
+    run_id         LowCardinality(String),
+    run_time       DateTime,
+    git_revision   LowCardinality(String),
+    server_version LowCardinality(String),
+    settings_hash  LowCardinality(String),
+    mode           LowCardinality(String),
+    key            LowCardinality(String),             -- <режим>/<вариант>/<сценарий>
+    seq            UInt32,
+    latency_us     UInt64
+)
+ENGINE = MergeTree
+PARTITION BY toYYYYMM(run_time)
+ORDER BY (run_id, key, seq);
+
+-- Прогресс backfill.py: по строке на исходную партицию MV, последняя по updated_at;
+-- targets - партиции целевой таблицы, в которые попали строки исходной партиции
+CREATE TABLE IF NOT EXISTS backfill_checkpoints
+(
+    mv           LowCardinality(String),
+    partition_id String,
+    state        Enum8('staged' = 1, 'done' = 2),
+    rows         UInt64,
+    targets      Array(String),
+    updated_at   DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = ReplacingMergeTree(updated_at)
+ORDER BY (mv, partition_id);
 
 -- Каталог товаров
 INSERT INTO ecom_offers (offer_id, price, seller_id, category_id, vendor)
@@ -49,49 +87,178 @@ SELECT
     ContentUnitID
 FROM file('/data/RawEvent.parquet', 'Parquet');
 
+-- Агрегаты каталога по снимкам: множество offer_id (groupBitmap) на дату снимка.
+-- Повторная загрузка того же снимка не удваивает счётчики, новые снимки не
+-- складываются с прежними: актуальные значения - строки последнего snapshot_date
 CREATE MATERIALIZED VIEW IF NOT EXISTS catalog_by_category_mv
-ENGINE = SummingMergeTree
-PARTITION BY category_id
-ORDER BY category_id
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(snapshot_date)
+ORDER BY (snapshot_date, category_id)
 AS
 SELECT
+    snapshot_date,
     category_id,
-    count() AS offers_cnt
+    groupBitmapState(offer_id) AS offers
 FROM ecom_offers
-GROUP BY category_id;
+GROUP BY snapshot_date, category_id;
 
 CREATE MATERIALIZED VIEW IF NOT EXISTS catalog_by_brand_mv
-ENGINE = SummingMergeTree
-PARTITION BY vendor
-ORDER BY (vendor, category_id)
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(snapshot_date)
+ORDER BY (snapshot_date, vendor, category_id)
 AS
 SELECT
+    snapshot_date,
     vendor,
     category_id,
-    count() AS offers_cnt
+    groupBitmapState(offer_id) AS offers
 FROM ecom_offers
-GROUP BY vendor, category_id;
+GROUP BY snapshot_date, vendor, category_id;
+
+-- Актуальное состояние товара без FINAL: после слияний одна строка на offer_id,
+-- значения из последнего снимка, где товар был (argMax по snapshot_date).
+-- ecom_offers FINAL этого не даёт: версии схлопываются по ключу сортировки
+-- (category_id, offer_id) и только внутри партиции-месяца, поэтому товар,
+-- сменивший категорию, или снимки разных месяцев остаются дублями
+CREATE TABLE IF NOT EXISTS current_offers
+(
+    offer_id          UInt64,
+    last_snapshot     SimpleAggregateFunction(max, Date),
+    price_state       AggregateFunction(argMax, Float64, Date),
+    seller_id_state   AggregateFunction(argMax, UInt64, Date),
+    category_id_state AggregateFunction(argMax, UInt32, Date),
+    vendor_state      AggregateFunction(argMax, String, Date)
+)
+ENGINE = AggregatingMergeTree
+ORDER BY offer_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS current_offers_mv TO current_offers
+AS
+SELECT
+    offer_id,
+    max(snapshot_date)                      AS last_snapshot,
+    argMaxState(price, snapshot_date)       AS price_state,
+    argMaxState(seller_id, snapshot_date)   AS seller_id_state,
+    argMaxState(category_id, snapshot_date) AS category_id_state,
+    argMaxState(vendor, snapshot_date)      AS vendor_state
+FROM ecom_offers
+GROUP BY offer_id;
+
+-- Актуальный каталог = товары последнего снимка
+CREATE VIEW IF NOT EXISTS current_catalog
+AS
+SELECT
+    offer_id,
+    max(last_snapshot)             AS last_seen,
+    argMaxMerge(price_state)       AS price,
+    argMaxMerge(seller_id_state)   AS seller_id,
+    argMaxMerge(category_id_state) AS category_id,
+    argMaxMerge(vendor_state)      AS vendor
+FROM current_offers
+GROUP BY offer_id
+HAVING last_seen = (SELECT max(last_snapshot) FROM current_offers);
+
+-- Каталог в памяти для обогащения событий: вместо INNER JOIN, который строит
+-- хэш-таблицу всего ecom_offers на каждый вставленный блок raw_events.
+-- Из снимков ReplacingMergeTree берётся последний; offer_id большие и
+-- разреженные, поэтому HASHED (FLAT - только для ключей < 500000).
+-- Изменения каталога видны MV после перезагрузки: раз в 5-6 минут или
+-- SYSTEM RELOAD DICTIONARY ecom.ecom_offers_dict.
+CREATE DICTIONARY IF NOT EXISTS ecom_offers_dict
+(
+    offer_id    UInt64,
+    category_id UInt32,
+    vendor      String
+)
+PRIMARY KEY offer_id
+SOURCE(CLICKHOUSE(
+    DB 'ecom'
+    QUERY 'SELECT offer_id, argMax(category_id, snapshot_date) AS category_id, argMax(vendor, snapshot_date) AS vendor FROM ecom.ecom_offers GROUP BY offer_id'
+))
+LAYOUT(HASHED())
+LIFETIME(MIN 300 MAX 360);
 
 CREATE MATERIALIZED VIEW IF NOT EXISTS offer_events_mv
 ENGINE = SummingMergeTree
-PARTITION BY toDate(Hour)
+PARTITION BY event_date
 ORDER BY (offer_id)
 AS
 SELECT
-    toDate(r.Hour) AS event_date,
-    e.offer_id     AS offer_id,
-    e.category_id  AS category_id,
-    e.vendor       AS vendor,
-    count()        AS events_cnt
-FROM raw_events AS r
-INNER JOIN ecom_offers AS e
-    ON r.ContentUnitID = e.offer_id
+    toDate(Hour)                                                   AS event_date,
+    ContentUnitID                                                  AS offer_id,
+    dictGet('ecom.ecom_offers_dict', 'category_id', ContentUnitID) AS category_id,
+    dictGet('ecom.ecom_offers_dict', 'vendor', ContentUnitID)      AS vendor,
+    count()                                                        AS events_cnt
+FROM raw_events
+WHERE dictHas('ecom.ecom_offers_dict', ContentUnitID)   -- как INNER JOIN: события вне каталога не попадают
 GROUP BY event_date, offer_id, category_id, vendor;
 
+-- Куб событий для дашбордов: час x устройство x приложение x ОС x регион.
+-- Разбивки по любым из этих измерений читают его вместо сырых строк raw_events
+-- (ключ raw_events - только (Hour, ContentUnitID)); число товаров - uniqState
+CREATE TABLE IF NOT EXISTS events_hourly
+(
+    hour            DateTime,
+    DeviceTypeName  LowCardinality(String),
+    ApplicationName LowCardinality(String),
+    OSName          LowCardinality(String),
+    ProvinceName    LowCardinality(String),
+    events_cnt      SimpleAggregateFunction(sum, UInt64),
+    offers_state    AggregateFunction(uniq, UInt64)
+)
+ENGINE = AggregatingMergeTree
+PARTITION BY toDate(hour)
+ORDER BY (hour, DeviceTypeName, ApplicationName, OSName, ProvinceName);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS events_hourly_mv TO events_hourly
+AS
+SELECT
+    toStartOfHour(Hour)      AS hour,
+    DeviceTypeName,
+    ApplicationName,
+    OSName,
+    ProvinceName,
+    count()                  AS events_cnt,
+    uniqState(ContentUnitID) AS offers_state
+FROM raw_events
+GROUP BY hour, DeviceTypeName, ApplicationName, OSName, ProvinceName;
+
+-- Товары с событиями: множество ContentUnitID (groupBitmap) за день. Покрытие
+-- каталога и товары без событий считаются операциями над битмапами
+-- (bitmapAndnot, bitmapAndCardinality) вместо LEFT JOIN с DISTINCT по raw_events.
+-- Партиция - день, как у raw_events, поэтому backfill.py подменяет её целиком
+CREATE MATERIALIZED VIEW IF NOT EXISTS offers_with_events_mv
+ENGINE = AggregatingMergeTree
+PARTITION BY event_date
+ORDER BY event_date
+AS
+SELECT
+    toDate(Hour)                    AS event_date,
+    groupBitmapState(ContentUnitID) AS offers
+FROM raw_events
+GROUP BY event_date;
+
+-- Свёртка за всё время и битмап актуального каталога (последний снимок)
+CREATE VIEW IF NOT EXISTS offers_with_events_all
+AS
+SELECT groupBitmapMergeState(offers) AS offers
+FROM offers_with_events_mv;
+
+CREATE VIEW IF NOT EXISTS catalog_offers_bitmap
+AS
+SELECT groupBitmapMergeState(offers) AS offers
+FROM catalog_by_category_mv
+WHERE snapshot_date = (SELECT max(snapshot_date) FROM catalog_by_category_mv);
+
+-- Данные загружены до создания MV, поэтому в MV пока только новые вставки;
+-- историю заполняет python backfill.py (по партициям, с возобновлением)
+
 SELECT
     category_id,
-    offers_cnt
+    groupBitmapMerge(offers) AS offers_cnt
 FROM catalog_by_category_mv
+WHERE snapshot_date = (SELECT max(snapshot_date) FROM catalog_by_category_mv)
+GROUP BY category_id
 ORDER BY offers_cnt DESC
 LIMIT 20;
 
@@ -99,14 +266,16 @@ SELECT
     category_id,
     count() AS offers_cnt
 FROM ecom_offers
+WHERE snapshot_date = (SELECT max(snapshot_date) FROM ecom_offers)
 GROUP BY category_id
 ORDER BY offers_cnt DESC
 LIMIT 20;
 
 SELECT
     vendor,
-    sum(offers_cnt) AS offers_cnt
+    groupBitmapMerge(offers) AS offers_cnt
 FROM catalog_by_brand_mv
+WHERE snapshot_date = (SELECT max(snapshot_date) FROM catalog_by_brand_mv)
 GROUP BY vendor
 ORDER BY offers_cnt DESC
 LIMIT 30;
@@ -121,6 +290,7 @@ FROM
         vendor,
         count() AS offers_cnt
     FROM ecom_offers
+    WHERE snapshot_date = (SELECT max(snapshot_date) FROM ecom_offers)
     GROUP BY category_id, vendor
 )
 GROUP BY category_id
@@ -129,7 +299,16 @@ ORDER BY avg_offers_per_brand DESC;
 SELECT
     category_id,
     avg(offers_cnt) AS avg_offers_per_brand
-FROM catalog_by_brand_mv
+FROM
+(
+    SELECT
+        category_id,
+        vendor,
+        groupBitmapMerge(offers) AS offers_cnt
+    FROM catalog_by_brand_mv
+    WHERE snapshot_date = (SELECT max(snapshot_date) FROM catalog_by_brand_mv)
+    GROUP BY category_id, vendor
+)
 GROUP BY category_id
 ORDER BY avg_offers_per_brand DESC;
 
@@ -158,3 +337,30 @@ LEFT JOIN
     FROM offer_events_mv
 ) AS ev USING (offer_id)
 WHERE ev.offer_id IS NULL;
+
+SELECT
+    bitmapAndCardinality(c.offers, e.offers) AS offers_with_events,
+    bitmapCardinality(c.offers)              AS total_offers,
+    offers_with_events / total_offers        AS coverage_ratio
+FROM catalog_offers_bitmap AS c, offers_with_events_all AS e;
+
+SELECT
+    offer_id,
+    category_id,
+    vendor,
+    price
+FROM ecom_offers
+WHERE snapshot_date = (SELECT max(snapshot_date) FROM ecom_offers)
+  AND offer_id IN
+(
+    SELECT arrayJoin(bitmapToArray(bitmapAndnot(c.offers, e.offers)))
+    FROM catalog_offers_bitmap AS c, offers_with_events_all AS e
+);
+
+SELECT
+    DeviceTypeName,
+    sum(events_cnt)         AS events_cnt,
+    uniqMerge(offers_state) AS offers_cnt
+FROM events_hourly
+GROUP BY DeviceTypeName
+ORDER BY events_cnt DESC;
@@ -0,0 +1,384 @@
+"""Synthetic data with the schema of the lab files at scale factors SF1..SF1000.
+
+Пишет Parquet той же схемы, что EcomOffer.parquet, RawEvent.parquet и файл
+офферов Ozon (ozon_inference_*.pq), а также 10ozon.csv:
+
+    python datagen.py --sf 10 --out data --workers 8
+
+Объём на SF1: OFFERS_PER_SF товаров, EVENTS_PER_SF событий, OZON_OFFERS_PER_SF
+офферов Ozon; число категорий, брендов и продавцов растёт как sqrt(SF).
+Распределения: Zipf товаров по категориям, брендам и продавцам, Zipf
+популярности товаров в событиях (хвост каталога без событий), суточный
+профиль Hour, LowCardinality-измерения событий, дерево категорий Ozon глубиной
+до 8 с путём через "\\".
+
+Данные генерируются блоками по --chunk-rows строк в процессах-воркерах, у
+каждого блока свой seed (seed, таблица, номер блока), поэтому при тех же
+--seed и --chunk-rows результат не зависит от --workers. Основной
+процесс пишет блоки по порядку как row group'ы одного файла и держит в памяти
+не больше 2 * --workers блоков.
+"""
+import argparse
+import collections
+import datetime
+import functools
+import json
+import math
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+OFFERS_PER_SF = 100000
+EVENTS_PER_SF = 1000000
+OZON_OFFERS_PER_SF = 100000
+CHUNK_ROWS = 1000000
+MAX_SF = 1000
+
+CATEGORIES_PER_SF = 2000      # * sqrt(SF)
+VENDORS_PER_SF = 5000
+SELLERS_PER_SF = 10000
+OZON_CATEGORY_NODES = 5000
+MAX_CATEGORY_DEPTH = 8
+
+OFFER_ID_BASE = 100000000
+OZON_OFFER_ID_BASE = 500000000
+CATEGORY_ID_BASE = 1000
+EVENTS_START = "2025-09-01"
+EVENTS_DAYS = 30
+UNKNOWN_OFFER_SHARE = 0.02    # события по товарам, которых нет в каталоге
+EMPTY_VENDOR_SHARE = 0.02
+SHARED_OZON_OFFER_SHARE = 0.03  # Offer_ID, который есть у нескольких партнёров
+
+ZIPF_CATEGORY = 1.1
+ZIPF_VENDOR = 1.05
+ZIPF_SELLER = 0.9
+ZIPF_POPULARITY = 0.95
+
+# Доля событий по часам суток: ночной минимум, дневной и вечерний пики
+DIURNAL = np.array([1.2, 0.8, 0.5, 0.4, 0.4, 0.6, 1.2, 2.4, 3.6, 4.4, 4.9, 5.2,
+                    5.5, 5.4, 5.2, 5.0, 5.0, 5.3, 5.9, 6.6, 7.0, 6.4, 4.6, 2.5])
+DIURNAL = DIURNAL / DIURNAL.sum()
+
+DEVICES = ["Smartphone", "Desktop", "Tablet", "TV"]
+DEVICE_WEIGHTS = [0.64, 0.28, 0.07, 0.01]
+OS_BY_DEVICE = {
+    "Smartphone": (["Android", "iOS", "HarmonyOS"], [0.68, 0.3, 0.02]),
+    "Desktop": (["Windows", "macOS", "Linux"], [0.8, 0.15, 0.05]),
+    "Tablet": (["Android", "iOS"], [0.45, 0.55]),
+    "TV": (["Android", "Tizen", "webOS"], [0.6, 0.25, 0.15]),
+}
+APPLICATIONS = ["Ozon App", "Browser", "Mini App", "Partner Widget", "Ozon Seller"]
+APPLICATION_WEIGHTS = [0.58, 0.3, 0.06, 0.04, 0.02]
+PROVINCES = [
+    "Москва", "Санкт-Петербург", "Московская область", "Краснодарский край", "Свердловская область",
+    "Республика Татарстан", "Новосибирская область", "Ростовская область", "Республика Башкортостан",
+    "Нижегородская область", "Челябинская область", "Самарская область", "Красноярский край",
+    "Ленинградская область", "Пермский край", "Воронежская область", "Волгоградская область",
+    "Саратовская область", "Тюменская область", "Иркутская область", "Омская область",
+    "Приморский край", "Хабаровский край", "Калининградская область", "Ярославская область",
+]
+PARTNERS = ["ozon", "ozon fresh", "ozon global", "ozon express", "partner market", "ozon travel"]
+PARTNER_WEIGHTS = [0.7, 0.1, 0.08, 0.06, 0.05, 0.01]
+OFFER_TYPES = ["product", "service", "digital", "bundle", "gift card"]
+OFFER_TYPE_WEIGHTS = [0.86, 0.05, 0.05, 0.03, 0.01]
+ROOT_CATEGORIES = [
+    "Электроника", "Одежда", "Обувь", "Дом и сад", "Детские товары", "Красота и здоровье",
+    "Бытовая техника", "Спорт и отдых", "Строительство и ремонт", "Продукты питания", "Аптека",
+    "Товары для животных", "Книги", "Хобби и творчество", "Автотовары", "Мебель",
+]
+
+TABLES = ["offers", "offers-csv", "events", "ozon"]
+OUTPUT_FILES = {
+    "offers": "EcomOffer.parquet",
+    "offers-csv": "10ozon.csv",
+    "events": "RawEvent.parquet",
+    "ozon": "ozon_inference_synthetic_offers.pq",
+}
+
+OFFERS_SCHEMA = pa.schema([
+    ("offer_id", pa.uint64()), ("price", pa.float64()), ("seller_id", pa.uint64()),
+    ("category_id", pa.uint32()), ("vendor", pa.string()),
+])
+LC_STRING = pa.dictionary(pa.int32(), pa.string())   # LowCardinality(String)
+EVENTS_SCHEMA = pa.schema([
+    ("Hour", pa.timestamp("s")), ("DeviceTypeName", LC_STRING), ("ApplicationName", LC_STRING),
+    ("OSName", LC_STRING), ("ProvinceName", LC_STRING), ("ContentUnitID", pa.uint64()),
+])
+OZON_SCHEMA = pa.schema([
+    ("Partner_Name", pa.string()), ("Category_ID", pa.int64()), ("Category_FullPathName", pa.string()),
+    ("Offer_ID", pa.int64()), ("Offer_Name", pa.string()), ("Offer_Type", pa.string()),
+])
+
+
+class Scale:
+    """Размеры таблиц и справочников для заданного SF."""
+
+    def __init__(self, sf: float):
+        self.sf = sf
+        root = math.sqrt(sf)
+        self.offers = max(1, int(OFFERS_PER_SF * sf))
+        self.events = max(1, int(EVENTS_PER_SF * sf))
+        self.ozon_offers = max(1, int(OZON_OFFERS_PER_SF * sf))
+        self.categories = max(10, int(CATEGORIES_PER_SF * root))
+        self.vendors = max(10, int(VENDORS_PER_SF * root))
+        self.sellers = max(10, int(SELLERS_PER_SF * root))
+        self.ozon_category_nodes = max(len(ROOT_CATEGORIES), int(OZON_CATEGORY_NODES * root))
+
+    def rows(self, table: str) -> int:
+        return {"offers": self.offers, "offers-csv": self.offers, "events": self.events,
+                "ozon": self.ozon_offers}[table]
+
+
+def zipf_ranks(rng: np.random.Generator, n: int, s: float, size: int) -> np.ndarray:
+    """Ранги 0..n-1 с P(k) ~ 1/(k+1)^s: обратная функция непрерывного степенного закона.
+
+    Без таблицы весов, поэтому память не зависит от n (до сотен миллионов товаров).
+    """
+    u = rng.random(size)
+    if abs(s - 1.0) < 1e-9:
+        ranks = np.exp(u * math.log(n + 1.0))
+    else:
+        ranks = (u * ((n + 1.0) ** (1.0 - s) - 1.0) + 1.0) ** (1.0 / (1.0 - s))
+    return np.minimum(ranks.astype(np.int64) - 1, n - 1)
+
+
+def permute(ranks: np.ndarray, n: int) -> np.ndarray:
+    """Биекция 0..n-1 -> 0..n-1, чтобы популярные значения не были первыми ID."""
+    step = 1000003
+    while math.gcd(step, n) != 1:
+        step += 2
+    return (ranks * step + 7919) % n
+
+
+def chunk_rng(seed: int, table: str, chunk: int) -> np.random.Generator:
+    return np.random.default_rng([seed, TABLES.index(table), chunk])
+
+
+def lc_column(rng: np.random.Generator, values, weights, size: int) -> pa.DictionaryArray:
+    indices = rng.choice(len(values), size=size, p=np.asarray(weights) / np.sum(weights)).astype(np.int32)
+    return pa.DictionaryArray.from_arrays(pa.array(indices), pa.array(values))
+
+
+def vendor_names(n: int) -> list:
+    return [f"Brand {i:05d}" for i in range(n)]
+
+
+@functools.lru_cache(maxsize=1)
+def category_tree(seed: int, max_nodes: int) -> list:
+    """Узлы дерева категорий Ozon: (Category_ID, путь через "\\", лист ли).
+
+    Строится по уровням, вероятность раскрыть узел падает с глубиной; одинаково
+    в каждом воркере при одном seed.
+    """
+    rng = np.random.default_rng([seed, 99])
+    expand = [1.0, 0.9, 0.75, 0.6, 0.45, 0.3, 0.2, 0.1]
+    fanout = [5.0, 3.0, 2.0, 1.0, 0.6, 0.4, 0.3, 0.2]
+    # Ширина верхних уровней растёт с размером, глубина остаётся до 8
+    width = math.sqrt(max(1.0, max_nodes / 600))
+    fanout[1] *= width
+    fanout[2] *= width
+    level = [[name] for name in ROOT_CATEGORIES]
+    nodes = [list(path) for path in level]
+    children_of = collections.Counter()
+    for depth in range(1, MAX_CATEGORY_DEPTH):
+        next_level = []
+        for path in level:
+            if len(nodes) + len(next_level) >= max_nodes or rng.random() > expand[depth]:
+                continue
+            for k in range(1 + rng.poisson(fanout[depth])):
+                next_level.append(path + [f"{path[0]} L{depth + 1}.{len(next_level) + 1}"])
+                children_of["\\".join(path)] += 1
+        if not next_level:
+            break
+        nodes.extend(next_level)
+        level = next_level
+    return [(CATEGORY_ID_BASE + i, "\\".join(path), children_of["\\".join(path)] == 0)
+            for i, path in enumerate(nodes)]
+
+
+def generate_offers(scale: Scale, seed: int, chunk: int, start: int, rows: int) -> pa.Table:
+    rng = chunk_rng(seed, "offers", chunk)
+    category = permute(zipf_ranks(rng, scale.categories, ZIPF_CATEGORY, rows), scale.categories)
+    vendor_idx = permute(zipf_ranks(rng, scale.vendors, ZIPF_VENDOR, rows), scale.vendors)
+    vendors = np.asarray(vendor_names(scale.vendors), dtype=object)[vendor_idx]
+    vendors[rng.random(rows) < EMPTY_VENDOR_SHARE] = ""
+    seller = permute(zipf_ranks(rng, scale.sellers, ZIPF_SELLER, rows), scale.sellers)
+    price = np.round(rng.lognormal(mean=7.0, sigma=1.3, size=rows), 2)
+    return pa.table({
+        "offer_id": pa.array(OFFER_ID_BASE + np.arange(start, start + rows, dtype=np.uint64)),
+        "price": pa.array(price),
+        "seller_id": pa.array((seller + 1).astype(np.uint64)),
+        "category_id": pa.array((CATEGORY_ID_BASE + category).astype(np.uint32)),
+        "vendor": pa.array(vendors, type=pa.string()),
+    }, schema=OFFERS_SCHEMA)
+
+
+def generate_offers_csv(scale: Scale, seed: int, chunk: int, start: int, rows: int) -> pa.Table:
+    # Та же выборка, что и в EcomOffer.parquet, плюс служебная первая колонка (индекс)
+    table = generate_offers(scale, seed, chunk, start, rows)
+    return table.add_column(0, "", pa.array(np.arange(start, start + rows, dtype=np.int64)))
+
+
+def generate_events(scale: Scale, seed: int, chunk: int, start: int, rows: int) -> pa.Table:
+    rng = chunk_rng(seed, "events", chunk)
+    day = rng.integers(0, EVENTS_DAYS, rows)
+    hour = rng.choice(24, size=rows, p=DIURNAL)
+    base = int(datetime.datetime.fromisoformat(EVENTS_START).replace(tzinfo=datetime.timezone.utc).timestamp())
+    ts = base + day * 86400 + hour * 3600
+
+    offer = permute(zipf_ranks(rng, scale.offers, ZIPF_POPULARITY, rows), scale.offers)
+    content_unit = OFFER_ID_BASE + offer.astype(np.uint64)
+    unknown = rng.random(rows) < UNKNOWN_OFFER_SHARE
+    content_unit[unknown] = OFFER_ID_BASE + scale.offers + rng.integers(0, scale.offers, int(unknown.sum()))
+
+    device = rng.choice(len(DEVICES), size=rows, p=DEVICE_WEIGHTS)
+    os_values = sorted({name for names, _ in OS_BY_DEVICE.values() for name in names})
+    os_idx = np.empty(rows, dtype=np.int32)
+    for d, name in enumerate(DEVICES):
+        mask = device == d
+        names, weights = OS_BY_DEVICE[name]
+        picked = rng.choice(len(names), size=int(mask.sum()), p=weights)
+        os_idx[mask] = np.asarray([os_values.index(n) for n in names], dtype=np.int32)[picked]
+
+    province = zipf_ranks(rng, len(PROVINCES), 0.9, rows).astype(np.int32)
+    return pa.table({
+        "Hour": pa.array(ts, type=pa.timestamp("s")),
+        "DeviceTypeName": pa.DictionaryArray.from_arrays(pa.array(device.astype(np.int32)), pa.array(DEVICES)),
+        "ApplicationName": lc_column(rng, APPLICATIONS, APPLICATION_WEIGHTS, rows),
+        "OSName": pa.DictionaryArray.from_arrays(pa.array(os_idx), pa.array(os_values)),
+        "ProvinceName": pa.DictionaryArray.from_arrays(pa.array(province), pa.array(PROVINCES)),
+        "ContentUnitID": pa.array(content_unit),
+    }, schema=EVENTS_SCHEMA)
+
+
+def generate_ozon(scale: Scale, seed: int, chunk: int, start: int, rows: int) -> pa.Table:
+    rng = chunk_rng(seed, "ozon", chunk)
+    tree = category_tree(seed, scale.ozon_category_nodes)
+    leaves = [node for node in tree if node[2]]
+    leaf = permute(zipf_ranks(rng, len(leaves), ZIPF_CATEGORY, rows), len(leaves))
+    category_ids = np.asarray([node[0] for node in leaves], dtype=np.int64)[leaf]
+    paths = np.asarray([node[1] for node in leaves], dtype=object)[leaf]
+
+    offer_ids = OZON_OFFER_ID_BASE + np.arange(start, start + rows, dtype=np.int64)
+    # Повтор Offer_ID одной из предыдущих строк, но у другого партнёра
+    shared = rng.random(rows) < SHARED_OZON_OFFER_SHARE
+    shared[0] &= start > 0
+    before = start + np.nonzero(shared)[0]
+    offer_ids[shared] = OZON_OFFER_ID_BASE + (rng.random(len(before)) * before).astype(np.int64)
+    partner = rng.choice(len(PARTNERS), size=rows, p=PARTNER_WEIGHTS)
+    partner[shared] = (partner[shared] + 1 + rng.integers(0, len(PARTNERS) - 1, int(shared.sum()))) % len(PARTNERS)
+
+    vendor_idx = zipf_ranks(rng, scale.vendors, ZIPF_VENDOR, rows)
+    names = [f"{path.rsplit(chr(92), 1)[-1]} Brand {v:05d} модель {o % 100000}"
+             for path, v, o in zip(paths, vendor_idx, offer_ids)]
+    return pa.table({
+        "Partner_Name": pa.array(np.asarray(PARTNERS, dtype=object)[partner], type=pa.string()),
+        "Category_ID": pa.array(category_ids),
+        "Category_FullPathName": pa.array(paths, type=pa.string()),
+        "Offer_ID": pa.array(offer_ids),
+        "Offer_Name": pa.array(names, type=pa.string()),
+        "Offer_Type": pa.array(np.asarray(OFFER_TYPES, dtype=object)[
+            rng.choice(len(OFFER_TYPES), size=rows, p=OFFER_TYPE_WEIGHTS)], type=pa.string()),
+    }, schema=OZON_SCHEMA)
+
+
+GENERATORS = {
+    "offers": generate_offers,
+    "offers-csv": generate_offers_csv,
+    "events": generate_events,
+    "ozon": generate_ozon,
+}
+
+
+def generate_chunk(table: str, sf: float, seed: int, chunk: int, start: int, rows: int) -> pa.Table:
+    """Выполняется в воркере; результат возвращается в основной процесс для записи."""
+    return GENERATORS[table](Scale(sf), seed, chunk, start, rows)
+
+
+def write_table(pool, table: str, scale: Scale, seed: int, chunk_rows: int, path: str,
+                max_in_flight: int, compression: str) -> int:
+    total = scale.rows(table)
+    starts = list(range(0, total, chunk_rows))
+    pending = collections.deque()
+    writer = None
+    written = 0
+    t0 = time.perf_counter()
+    try:
+        for chunk, start in enumerate(starts):
+            pending.append(pool.apply_async(generate_chunk,
+                                            (table, scale.sf, seed, chunk, start, min(chunk_rows, total - start))))
+            # Пишем по порядку и не даём очереди готовых блоков расти
+            while len(pending) >= max_in_flight or (start == starts[-1] and pending):
+                chunk = pending.popleft().get()
+                if writer is None:
+                    if table == "offers-csv":
+                        writer = pa_csv.CSVWriter(path, chunk.schema)
+                    else:
+                        writer = pq.ParquetWriter(path, chunk.schema, compression=compression)
+                if table == "offers-csv":
+                    writer.write_table(chunk)
+                else:
+                    writer.write_table(chunk, row_group_size=chunk_rows)
+                written += chunk.num_rows
+                elapsed = time.perf_counter() - t0
+                print(f"  {table}: {written}/{total} rows ({written / elapsed if elapsed > 0 else 0:,.0f} rows/s)",
+                      end="\r", flush=True)
+    finally:
+        if writer is not None:
+            writer.close()
+    print()
+    return written
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Synthetic ecom_offers / raw_events / Ozon offers data")
+    ap.add_argument("--sf", type=float, default=1.0, help=f"scale factor, 1..{MAX_SF} (дробный - для отладки)")
+    ap.add_argument("--out", default="data", help="каталог для файлов")
+    ap.add_argument("--tables", type=lambda s: s.split(","), default=list(TABLES),
+                    help=f"что генерировать, из {','.join(TABLES)}")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                    help="строк в блоке (= row group); память ~ 2 * workers блоков")
+    ap.add_argument("--compression", default="zstd", help="кодек Parquet: zstd, snappy, lz4, none")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+    if not 0 < args.sf <= MAX_SF:
+        ap.error(f"--sf must be in (0, {MAX_SF}]")
+    unknown = set(args.tables) - set(TABLES)
+    if unknown:
+        ap.error(f"unknown tables: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+    scale = Scale(args.sf)
+    os.makedirs(args.out, exist_ok=True)
+    print(f"SF{args.sf:g}: {scale.offers} offers, {scale.events} events, {scale.ozon_offers} Ozon offers; "
+          f"{scale.categories} categories, {scale.vendors} vendors, {scale.sellers} sellers; "
+          f"{args.workers} workers, {args.chunk_rows} rows per chunk")
+
+    manifest = {"sf": args.sf, "seed": args.seed, "chunk_rows": args.chunk_rows, "files": {}}
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(args.workers) as pool:
+        for table in args.tables:
+            path = os.path.join(args.out, OUTPUT_FILES[table])
+            t0 = time.perf_counter()
+            rows = write_table(pool, table, scale, args.seed, args.chunk_rows, path,
+                               max_in_flight=2 * args.workers, compression=args.compression)
+            elapsed = time.perf_counter() - t0
+            size = os.path.getsize(path)
+            print(f"  {path}: {rows} rows, {size / 2 ** 20:.1f} MB in {elapsed:.1f} s")
+            manifest["files"][OUTPUT_FILES[table]] = {"rows": rows, "bytes": size}
+
+    with open(os.path.join(args.out, f"datagen_sf{args.sf:g}.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
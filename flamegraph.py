@@ -0,0 +1,79 @@
+"""SVG flame graph from collapsed stacks.
+
+Упрощённый аналог flamegraph.pl без внешних зависимостей: корень внизу,
+ширина кадра пропорциональна числу сэмплов, полное имя функции и доля -
+во всплывающей подсказке (<title>), которую показывает любой браузер.
+"""
+import hashlib
+from html import escape
+
+WIDTH = 1200
+FRAME_HEIGHT = 16
+FONT_SIZE = 11
+MIN_WIDTH = 0.1      # пикселей; более узкие кадры не рисуются
+CHAR_WIDTH = 0.59    # средняя ширина символа относительно FONT_SIZE
+
+
+def build_tree(stacks: dict) -> dict:
+    root = {"name": "all", "value": 0, "children": {}}
+    for stack, samples in stacks.items():
+        root["value"] += samples
+        node = root
+        for frame in stack.split(";"):
+            node = node["children"].setdefault(frame, {"name": frame, "value": 0, "children": {}})
+            node["value"] += samples
+    return root
+
+
+def _depth(node: dict) -> int:
+    return 1 + max((_depth(child) for child in node["children"].values()), default=0)
+
+
+def _color(name: str) -> str:
+    # Тёплая палитра flamegraph.pl, цвет стабилен для одной функции между графиками
+    h = int(hashlib.md5(name.encode("utf-8")).hexdigest()[:6], 16)
+    return f"rgb({205 + h % 50},{(h >> 8) % 230},{(h >> 16) % 55})"
+
+
+def render_svg(stacks: dict, title: str) -> str:
+    root = build_tree(stacks)
+    total = root["value"] or 1
+    depth = _depth(root)
+    height = (depth + 2) * FRAME_HEIGHT + 2 * FONT_SIZE
+    scale = (WIDTH - 20) / total
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{height}" '
+        f'font-family="Verdana, sans-serif" font-size="{FONT_SIZE}">',
+        f'<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{WIDTH / 2}" y="{FONT_SIZE + 6}" text-anchor="middle" font-size="{FONT_SIZE + 4}">'
+        f'{escape(title)}</text>',
+    ]
+
+    def draw(node: dict, x: float, level: int) -> None:
+        w = node["value"] * scale
+        if w < MIN_WIDTH:
+            return
+        y = height - (level + 1) * FRAME_HEIGHT - FONT_SIZE
+        share = 100.0 * node["value"] / total
+        name = escape(node["name"])
+        parts.append(f'<g><title>{name} ({node["value"]} samples, {share:.2f}%)</title>'
+                     f'<rect x="{x + 10:.2f}" y="{y}" width="{w:.2f}" height="{FRAME_HEIGHT - 1}" '
+                     f'fill="{_color(node["name"])}" rx="2"/>')
+        max_chars = int(w / (FONT_SIZE * CHAR_WIDTH))
+        if max_chars >= 3:
+            label = node["name"] if len(node["name"]) <= max_chars else node["name"][:max_chars - 2] + ".."
+            parts.append(f'<text x="{x + 13:.2f}" y="{y + FRAME_HEIGHT - 4}">{escape(label)}</text>')
+        parts.append("</g>")
+        child_x = x
+        for child in sorted(node["children"].values(), key=lambda c: c["name"]):
+            draw(child, child_x, level + 1)
+            child_x += child["value"] * scale
+
+    draw(root, 0.0, 0)
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def write_svg(path: str, stacks: dict, title: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(render_svg(stacks, title))
@@ -0,0 +1,259 @@
+"""Latency histogram with the HdrHistogram bucket layout.
+
+Значения хранятся в микросекундах с заданным числом значащих цифр, поэтому
+гистограммы из разных процессов и разных прогонов складываются без потери
+точности. Экспорт: JSON (для последующего слияния) и HdrHistogram log
+(V2 compressed), который читают HistogramLogProcessor и HdrHistogram_py.
+Сырые замеры для bench_results и статистических сравнений хранятся, только
+если их запросили (max_samples): последние max_samples значений в кольцевом
+буфере, более ранние отбрасываются и учитываются в samples_dropped. Из JSON
+они не восстанавливаются.
+"""
+import base64
+import datetime
+import json
+import math
+import struct
+import zlib
+from collections import deque
+
+V2_ENCODING_COOKIE = 0x1c849303 | 0x10
+V2_COMPRESSED_ENCODING_COOKIE = 0x1c849304 | 0x10
+
+LOWEST_VALUE_US = 1
+HIGHEST_VALUE_US = 3600 * 1000 * 1000   # 1 час
+SIGNIFICANT_DIGITS = 3
+
+
+class LatencyHistogram:
+    def __init__(self, highest_value: int = HIGHEST_VALUE_US, significant_digits: int = SIGNIFICANT_DIGITS,
+                 max_samples: int = 0):
+        self.lowest_value = LOWEST_VALUE_US
+        self.highest_value = highest_value
+        self.significant_digits = significant_digits
+
+        largest_single_unit = 2 * 10 ** significant_digits
+        self.unit_magnitude = int(math.floor(math.log2(self.lowest_value)))
+        sub_bucket_count_magnitude = int(math.ceil(math.log2(largest_single_unit)))
+        self.sub_bucket_half_count_magnitude = max(sub_bucket_count_magnitude, 1) - 1
+        self.sub_bucket_count = 1 << (self.sub_bucket_half_count_magnitude + 1)
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.sub_bucket_mask = (self.sub_bucket_count - 1) << self.unit_magnitude
+        self.leading_zero_count_base = 64 - self.unit_magnitude - self.sub_bucket_half_count_magnitude - 1
+
+        smallest_untrackable = self.sub_bucket_count << self.unit_magnitude
+        bucket_count = 1
+        while smallest_untrackable <= highest_value:
+            smallest_untrackable <<= 1
+            bucket_count += 1
+        self.bucket_count = bucket_count
+        self.counts_len = (bucket_count + 1) * self.sub_bucket_half_count
+
+        self.counts = [0] * self.counts_len
+        self.total_count = 0
+        self.min_value = None
+        self.max_value = 0
+        self.total_value = 0
+        self.max_samples = max_samples
+        self.samples = deque(maxlen=max_samples)   # последние сырые значения в мкс, в порядке записи
+        self.samples_seen = 0
+
+    @property
+    def samples_dropped(self) -> int:
+        """Сколько сырых значений вытеснено из буфера (или не хранилось при max_samples=0)."""
+        return self.samples_seen - len(self.samples)
+
+    # --- индексация (как в AbstractHistogram) ---
+
+    def _bucket_index(self, value: int) -> int:
+        return self.leading_zero_count_base - (64 - (value | self.sub_bucket_mask).bit_length())
+
+    def _index_for(self, value: int) -> int:
+        bucket_index = self._bucket_index(value)
+        sub_bucket_index = value >> (bucket_index + self.unit_magnitude)
+        bucket_base = (bucket_index + 1) << self.sub_bucket_half_count_magnitude
+        return bucket_base + sub_bucket_index - self.sub_bucket_half_count
+
+    def _value_from_index(self, index: int) -> int:
+        bucket_index = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket_index < 0:
+            sub_bucket_index -= self.sub_bucket_half_count
+            bucket_index = 0
+        return sub_bucket_index << (bucket_index + self.unit_magnitude)
+
+    def _highest_equivalent(self, value: int) -> int:
+        bucket_index = self._bucket_index(value)
+        sub_bucket_index = value >> (bucket_index + self.unit_magnitude)
+        adjusted = bucket_index + (1 if sub_bucket_index >= self.sub_bucket_count else 0)
+        lowest = sub_bucket_index << (bucket_index + self.unit_magnitude)
+        return lowest + (1 << (self.unit_magnitude + adjusted)) - 1
+
+    # --- запись и слияние ---
+
+    def record_us(self, value: int, count: int = 1) -> None:
+        value = min(max(int(value), 0), self.highest_value)
+        self.counts[self._index_for(value)] += count
+        if count == 1:   # count > 1 - уже свёрнутые значения, это не сырые замеры
+            self.samples.append(value)
+            self.samples_seen += 1
+        self.total_count += count
+        self.total_value += value * count
+        self.min_value = value if self.min_value is None else min(self.min_value, value)
+        self.max_value = max(self.max_value, value)
+
+    def record(self, seconds: float) -> None:
+        self.record_us(round(seconds * 1e6))
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        if (other.highest_value, other.significant_digits) != (self.highest_value, self.significant_digits):
+            raise ValueError("Cannot merge histograms with different ranges or precision")
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.samples.extend(other.samples)
+        self.samples_seen += other.samples_seen
+        self.total_count += other.total_count
+        self.total_value += other.total_value
+        if other.min_value is not None:
+            self.min_value = other.min_value if self.min_value is None else min(self.min_value, other.min_value)
+        self.max_value = max(self.max_value, other.max_value)
+        return self
+
+    # --- статистика (в секундах) ---
+
+    def value_at_percentile(self, pct: float) -> float:
+        if self.total_count == 0:
+            return 0.0
+        # nextafter вниз, как в Java-реализации: 99.9% от 20000 не должно стать 19981
+        pct = min(max(math.nextafter(pct, -math.inf), 0.0), 100.0)
+        count_at_pct = max(1, int(math.ceil(pct / 100.0 * self.total_count)))
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= count_at_pct:
+                value = self._value_from_index(i)
+                if pct > 0:
+                    value = self._highest_equivalent(value)
+                return min(value, self.max_value) / 1e6
+        return self.max_value / 1e6
+
+    @property
+    def min(self) -> float:
+        return (self.min_value or 0) / 1e6
+
+    @property
+    def max(self) -> float:
+        return self.max_value / 1e6
+
+    @property
+    def mean(self) -> float:
+        return self.total_value / self.total_count / 1e6 if self.total_count else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "count": self.total_count,
+            "min": self.min,
+            "mean": self.mean,
+            "p50": self.value_at_percentile(50),
+            "p90": self.value_at_percentile(90),
+            "p99": self.value_at_percentile(99),
+            "p99.9": self.value_at_percentile(99.9),
+            "max": self.max,
+        }
+
+    # --- сериализация ---
+
+    def to_dict(self) -> dict:
+        return {
+            "unit": "us",
+            "highest_value": self.highest_value,
+            "significant_digits": self.significant_digits,
+            "total_count": self.total_count,
+            "total_value": self.total_value,
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "counts": {str(i): c for i, c in enumerate(self.counts) if c},
+            "summary_s": self.summary(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        hist = cls(data["highest_value"], data["significant_digits"])
+        for i, c in data["counts"].items():
+            hist.counts[int(i)] = c
+        hist.total_count = data["total_count"]
+        hist.total_value = data["total_value"]
+        hist.min_value = data["min_value"]
+        hist.max_value = data["max_value"]
+        return hist
+
+    def encode(self) -> str:
+        """Base64 V2 compressed encoding, как HistogramLogWriter."""
+        payload = bytearray()
+        limit = self._index_for(self.max_value) + 1 if self.total_count else 0
+        i = 0
+        while i < limit:
+            count = self.counts[i]
+            i += 1
+            if count == 0:
+                zeros = 1
+                while i < limit and self.counts[i] == 0:
+                    zeros += 1
+                    i += 1
+                _put_zigzag(payload, -zeros if zeros > 1 else 0)
+            else:
+                _put_zigzag(payload, count)
+
+        header = struct.pack(">iiiiqqd", V2_ENCODING_COOKIE, len(payload), 0, self.significant_digits,
+                             self.lowest_value, self.highest_value, 1.0)
+        compressed = zlib.compress(header + bytes(payload))
+        blob = struct.pack(">ii", V2_COMPRESSED_ENCODING_COOKIE, len(compressed)) + compressed
+        return base64.b64encode(blob).decode("ascii")
+
+
+def _put_zigzag(buf: bytearray, value: int) -> None:
+    # ZigZag + LEB128 в варианте HdrHistogram: не больше 9 байт, девятый байт целиком
+    value = ((value << 1) ^ (value >> 63)) & 0xFFFFFFFFFFFFFFFF
+    for _ in range(8):
+        if value >> 7 == 0:
+            buf.append(value)
+            return
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value & 0xFF)
+
+
+def merge_into(target: dict, key: str, hist: LatencyHistogram) -> None:
+    if key in target:
+        target[key].merge(hist)
+    else:
+        target[key] = LatencyHistogram(hist.highest_value, hist.significant_digits, hist.max_samples).merge(hist)
+
+
+def write_json(path: str, histograms: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({name: h.to_dict() for name, h in histograms.items()}, f, indent=2)
+
+
+def read_json(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return {name: LatencyHistogram.from_dict(d) for name, d in json.load(f).items()}
+
+
+def write_hdr_log(path: str, histograms: dict, start_time: float, end_time: float) -> None:
+    """Один интервал на гистограмму, имя запроса в Tag=.
+
+    Interval_Max - в микросекундах, как и значения закодированной гистограммы
+    (отношение единиц в заголовке 1.0), иначе читатели лога разошлись бы с ней в 1000 раз.
+    """
+    started = datetime.datetime.fromtimestamp(start_time)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("#[Histogram log format version 1.3]\n")
+        f.write(f"#[StartTime: {start_time:.3f} (seconds since epoch), {started.isoformat()}]\n")
+        f.write("#[BaseTime: 0.000 (seconds since epoch)]\n")
+        f.write('"StartTimestamp","Interval_Length","Interval_Max","Interval_Compressed_Histogram"\n')
+        for name, hist in histograms.items():
+            tag = name.replace(",", "_").replace(" ", "_")
+            f.write(f"Tag={tag},{start_time:.3f},{end_time - start_time:.3f},"
+                    f"{hist.max_value:.3f},{hist.encode()}\n")
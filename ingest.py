@@ -0,0 +1,309 @@
+"""Scratch tables for ingestion benchmarks of raw_events and its materialized views.
+
+Вставки идут не в рабочие raw_events/ecom_offers, а в копии с префиксом
+bench_ingest_ в той же базе: каталог нужного размера заполняется на сервере
+из numbers(), события генерируются на клиенте и вставляются пачками, как при
+реальной загрузке, - тогда MV срабатывает на каждую пачку.
+
+Варианты offer_events_mv:
+    none - без MV, базовая скорость вставки;
+    join - INNER JOIN с каталогом (прежняя версия init.sql);
+    dict - dictGet/dictHas по словарю каталога (текущая версия init.sql).
+
+Для матрицы вставок (test.py --mode insert-sweep) к копии событий подключаются
+MV над raw_events из init.sql - по одному, все или ни одного. Их запросы
+берутся из system.tables, как в backfill.py, с заменой raw_events на
+bench_ingest_events; каждое пишет в свою копию целевой таблицы
+bench_ingest_<mv>_target. Пачки для HTTP кодируются заранее (encode_rows), чтобы
+в замер попадали передача и разбор на сервере, а не кодирование в Python.
+
+Пользователю benchmark нужны права на объекты bench_ingest_*:
+    GRANT CREATE TABLE, CREATE VIEW, CREATE DICTIONARY, DROP TABLE, DROP VIEW, DROP DICTIONARY,
+          INSERT, SELECT, dictGet ON ecom.* TO benchmark;
+    GRANT ALTER MODIFY SETTING ON ecom.* TO benchmark;
+    GRANT SYSTEM RELOAD DICTIONARY, SYSTEM FLUSH ASYNC INSERT QUEUE ON *.* TO benchmark;
+"""
+import calendar
+import datetime
+import gzip
+import io
+import json
+import struct
+
+from backfill import MV_SQL as LIVE_MV_SQL
+from backfill import mv_target, quote, replace_source
+
+SCRATCH_PREFIX = "bench_ingest"
+OFFERS_TABLE = f"{SCRATCH_PREFIX}_offers"
+EVENTS_TABLE = f"{SCRATCH_PREFIX}_events"
+OFFERS_DICT = f"{SCRATCH_PREFIX}_offers_dict"
+EVENTS_MV = f"{SCRATCH_PREFIX}_offer_events_mv"
+
+MV_VARIANTS = ["none", "join", "dict"]
+CATALOG_SIZES = [10000, 100000, 1000000]
+INGEST_EVENTS = 500000
+INGEST_BATCH = 10000
+
+OFFER_ID_BASE = 100000000    # как в datagen.py
+MISSING_OFFER_SHARE = 0.02   # доля событий по товарам вне каталога
+EVENTS_START = datetime.datetime(2025, 9, 1)
+EVENTS_DAYS = 7
+
+DEVICES = ["Smartphone", "Desktop", "Tablet", "TV"]
+APPLICATIONS = ["Ozon App", "Browser", "Mini App", "Partner Widget"]
+OS_NAMES = ["Android", "iOS", "Windows", "macOS", "Linux"]
+PROVINCES = ["Москва", "Санкт-Петербург", "Московская область", "Краснодарский край",
+             "Свердловская область", "Республика Татарстан", "Новосибирская область"]
+EVENT_COLUMNS = ["Hour", "DeviceTypeName", "ApplicationName", "OSName", "ProvinceName", "ContentUnitID"]
+
+RAW_EVENTS_MVS = ["offer_events_mv", "events_hourly_mv", "offers_with_events_mv"]   # MV над raw_events в init.sql
+INSERT_FORMATS = ["Native", "RowBinary", "Parquet", "Arrow", "JSONEachRow"]
+INSERT_CODECS = ["none", "lz4", "zstd"]
+
+CATALOG_SQL = """
+INSERT INTO {offers} (offer_id, price, seller_id, category_id, vendor)
+SELECT
+    {base} + number,
+    round(10 + (intHash64(number) % 1000000) / 10, 2),
+    1 + intHash64(number, 1) % 10000,
+    1000 + intHash32(number) % 2000,
+    concat('Brand ', toString(intHash32(number, 2) % 5000))
+FROM numbers({size})
+"""
+
+# Те же определения, что в clickhouse/init.sql, но над таблицами bench_ingest_*
+DICTIONARY_SQL = """
+CREATE DICTIONARY {dict}
+(
+    offer_id    UInt64,
+    category_id UInt32,
+    vendor      String
+)
+PRIMARY KEY offer_id
+SOURCE(CLICKHOUSE(
+    DB '{db}' USER '{user}' PASSWORD '{password}'
+    QUERY 'SELECT offer_id, argMax(category_id, snapshot_date) AS category_id, argMax(vendor, snapshot_date) AS vendor FROM {db}.{offers} GROUP BY offer_id'
+))
+LAYOUT(HASHED())
+LIFETIME(0)
+"""
+
+MV_SQL = {
+    "join": """
+CREATE MATERIALIZED VIEW {mv}
+ENGINE = SummingMergeTree
+PARTITION BY event_date
+ORDER BY (offer_id)
+AS
+SELECT
+    toDate(r.Hour) AS event_date,
+    e.offer_id     AS offer_id,
+    e.category_id  AS category_id,
+    e.vendor       AS vendor,
+    count()        AS events_cnt
+FROM {events} AS r
+INNER JOIN {offers} AS e
+    ON r.ContentUnitID = e.offer_id
+GROUP BY event_date, offer_id, category_id, vendor
+""",
+    "dict": """
+CREATE MATERIALIZED VIEW {mv}
+ENGINE = SummingMergeTree
+PARTITION BY event_date
+ORDER BY (offer_id)
+AS
+SELECT
+    toDate(Hour)                                      AS event_date,
+    ContentUnitID                                     AS offer_id,
+    dictGet('{db}.{dict}', 'category_id', ContentUnitID) AS category_id,
+    dictGet('{db}.{dict}', 'vendor', ContentUnitID)      AS vendor,
+    count()                                           AS events_cnt
+FROM {events}
+WHERE dictHas('{db}.{dict}', ContentUnitID)
+GROUP BY event_date, offer_id, category_id, vendor
+""",
+}
+
+DICTIONARY_INFO_SQL = """
+SELECT element_count, bytes_allocated, loading_duration
+FROM system.dictionaries
+WHERE database = %(db)s AND name = %(name)s
+"""
+
+
+def sweep_view(mv: str) -> str:
+    return f"{SCRATCH_PREFIX}_{mv}"
+
+
+def drop_scratch(client) -> None:
+    for mv in RAW_EVENTS_MVS:
+        client.execute(f"DROP VIEW IF EXISTS {sweep_view(mv)}")
+        client.execute(f"DROP TABLE IF EXISTS {sweep_view(mv)}_target")
+    client.execute(f"DROP VIEW IF EXISTS {EVENTS_MV}")
+    client.execute(f"DROP DICTIONARY IF EXISTS {OFFERS_DICT}")
+    client.execute(f"DROP TABLE IF EXISTS {EVENTS_TABLE}")
+    client.execute(f"DROP TABLE IF EXISTS {OFFERS_TABLE}")
+
+
+def create_catalog(client, size: int) -> None:
+    """bench_ingest_offers со структурой ecom_offers и size товарами."""
+    client.execute(f"DROP TABLE IF EXISTS {OFFERS_TABLE}")
+    client.execute(f"CREATE TABLE {OFFERS_TABLE} AS ecom_offers")
+    client.execute(CATALOG_SQL.format(offers=OFFERS_TABLE, base=OFFER_ID_BASE, size=int(size)))
+
+
+def create_events(client) -> None:
+    """Пустая bench_ingest_events со структурой raw_events."""
+    client.execute(f"DROP TABLE IF EXISTS {EVENTS_TABLE}")
+    client.execute(f"CREATE TABLE {EVENTS_TABLE} AS raw_events")
+    # окно дедупликации, если оно включено на raw_events, отбросило бы повторы
+    # одинаковых пачек замера
+    client.execute(f"ALTER TABLE {EVENTS_TABLE} MODIFY SETTING non_replicated_deduplication_window = 0")
+
+
+def create_variant(client, variant: str, db: str, user: str, password: str) -> dict:
+    """Пустая bench_ingest_events и MV варианта; для dict словарь загружается заранее,
+    чтобы время загрузки не попало в первую вставку. Возвращает сведения о словаре."""
+    client.execute(f"DROP VIEW IF EXISTS {EVENTS_MV}")
+    client.execute(f"DROP DICTIONARY IF EXISTS {OFFERS_DICT}")
+    create_events(client)
+    names = {"mv": EVENTS_MV, "events": EVENTS_TABLE, "offers": OFFERS_TABLE, "dict": OFFERS_DICT, "db": db}
+    info = {}
+    if variant == "dict":
+        client.execute(DICTIONARY_SQL.format(user=user, password=password, **names))
+        client.execute(f"SYSTEM RELOAD DICTIONARY {db}.{OFFERS_DICT}")
+        rows = client.execute(DICTIONARY_INFO_SQL, {"db": db, "name": OFFERS_DICT})
+        if rows:
+            info = dict(zip(["elements", "bytes", "load_seconds"], rows[0]))
+    if variant in MV_SQL:
+        client.execute(MV_SQL[variant].format(**names))
+    return info
+
+
+def mv_events(client) -> int:
+    """Событий, дошедших до MV (для сверки вариантов между собой)."""
+    return client.execute(f"SELECT sum(events_cnt) FROM {EVENTS_MV}")[0][0] or 0
+
+
+def event_batches(rng, total: int, batch: int, catalog_size: int) -> list:
+    """Пачки событий по столбцам (для insert с columnar=True); ContentUnitID - из каталога
+    bench_ingest_offers, MISSING_OFFER_SHARE - вне его."""
+    batches = []
+    for start in range(0, total, batch):
+        n = min(batch, total - start)
+        hours = [EVENTS_START + datetime.timedelta(hours=rng.randrange(24 * EVENTS_DAYS)) for _ in range(n)]
+        ids = [OFFER_ID_BASE + (rng.randrange(catalog_size) if rng.random() >= MISSING_OFFER_SHARE
+                                else catalog_size + rng.randrange(catalog_size)) for _ in range(n)]
+        batches.append([
+            hours,
+            [rng.choice(DEVICES) for _ in range(n)],
+            [rng.choice(APPLICATIONS) for _ in range(n)],
+            [rng.choice(OS_NAMES) for _ in range(n)],
+            [rng.choice(PROVINCES) for _ in range(n)],
+            ids,
+        ])
+    return batches
+
+
+def attach_live_mvs(client, db: str, names) -> None:
+    """Пустая bench_ingest_events и копии MV names из init.sql над ней."""
+    drop_scratch(client)
+    create_events(client)
+    live = {row[0]: dict(zip(["name", "uuid", "create_table_query", "as_select"], row))
+            for row in client.execute(LIVE_MV_SQL, {"db": db})}
+    for mv in names:
+        if mv not in live:
+            raise ValueError(f"materialized view {db}.{mv} not found, run clickhouse/init.sql first")
+        view = sweep_view(mv)
+        client.execute(f"CREATE TABLE {view}_target AS {quote(db)}.{quote(mv_target(live[mv]))}")
+        select = replace_source(live[mv]["as_select"], db, "raw_events", EVENTS_TABLE, mv)
+        client.execute(f"CREATE MATERIALIZED VIEW {view} TO {view}_target AS {select}")
+
+
+INGEST_STATE_SQL = f"""
+SELECT
+    countIf(level = 0 AND table = '{EVENTS_TABLE}'),
+    countIf(level = 0),
+    countIf(active AND table = '{EVENTS_TABLE}'),
+    countIf(active)
+FROM system.parts
+WHERE database = currentDatabase() AND startsWith(table, '{SCRATCH_PREFIX}_')
+"""
+
+MERGES_SQL = f"""
+SELECT count(), sum(num_parts)
+FROM system.merges
+WHERE database = currentDatabase() AND startsWith(table, '{SCRATCH_PREFIX}_')
+"""
+
+
+def ingest_state(client) -> dict:
+    """Парты и слияния копий после прогона. Вставленные парты - level 0, включая
+    уже слитые (неактивные парты живут old_parts_lifetime, 8 минут)."""
+    parts = client.execute(INGEST_STATE_SQL)[0]
+    merges = client.execute(MERGES_SQL)[0]
+    return dict(zip(["events_parts", "all_parts", "events_active", "all_active", "merges", "merge_parts"],
+                    [v or 0 for v in parts + merges]))
+
+
+def _row_binary_string(value: str) -> bytes:
+    data = value.encode("utf-8")
+    n = len(data)
+    prefix = bytearray()
+    while True:   # длина - LEB128
+        byte = n & 0x7F
+        n >>= 7
+        prefix.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(prefix) + data
+
+
+def encode_rows(fmt: str, columns: list) -> bytes:
+    """Пачка событий (столбцы EVENT_COLUMNS) в тело INSERT ... FORMAT fmt."""
+    hours, devices, apps, oses, provinces, ids = columns
+    if fmt == "RowBinary":
+        out = bytearray()
+        for row in zip(hours, devices, apps, oses, provinces, ids):
+            out += struct.pack("<I", calendar.timegm(row[0].timetuple()))
+            for value in row[1:5]:
+                out += _row_binary_string(value)
+            out += struct.pack("<Q", row[5])
+        return bytes(out)
+    if fmt == "JSONEachRow":
+        return "".join(json.dumps(dict(zip(EVENT_COLUMNS, (h.strftime("%Y-%m-%d %H:%M:%S"), d, a, o, p, i))),
+                                  ensure_ascii=False) + "\n"
+                       for h, d, a, o, p, i in zip(*columns)).encode("utf-8")
+    if fmt in ("Parquet", "Arrow"):
+        import pyarrow as pa
+        table = pa.table({
+            "Hour": pa.array(hours, type=pa.timestamp("s")),
+            "DeviceTypeName": pa.array(devices).dictionary_encode(),
+            "ApplicationName": pa.array(apps).dictionary_encode(),
+            "OSName": pa.array(oses).dictionary_encode(),
+            "ProvinceName": pa.array(provinces).dictionary_encode(),
+            "ContentUnitID": pa.array(ids, type=pa.uint64()),
+        })
+        sink = io.BytesIO()
+        if fmt == "Parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, sink, compression="none")
+        else:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return sink.getvalue()
+    raise ValueError(f"no encoder for format {fmt!r}")
+
+
+def compress_body(body: bytes, codec: str) -> tuple:
+    """Тело HTTP-запроса и Content-Encoding для кодека."""
+    if codec == "none":
+        return body, None
+    if codec == "gzip":
+        return gzip.compress(body, compresslevel=1), "gzip"
+    if codec == "lz4":
+        import lz4.frame
+        return lz4.frame.compress(body), "lz4"
+    if codec == "zstd":
+        import zstd
+        return zstd.compress(body), "zstd"
+    raise ValueError(f"unknown codec {codec!r}")
@@ -0,0 +1,219 @@
+"""Streaming load of the 10ozon.csv catalog into ecom_offers.
+
+Каталог в CSV занимает гигабайты: целиком в pandas он не помещается в память,
+а INSERT ... FROM file() из README требует положить файл на сервер. Здесь файл
+читается потоково блоками по --chunk-mb (pyarrow.csv), столбцы сразу
+приводятся к типам ecom_offers, к каждой пачке добавляется snapshot_date, и
+пачки вставляются параллельно (--workers соединений). В памяти одновременно
+не больше 2 * workers пачек, сколько бы ни весил файл.
+
+    python load_csv.py data/10ozon.csv                              # снимок за сегодня
+    python load_csv.py data/10ozon.csv --snapshot-date 2025-09-01 --workers 4
+    python load_csv.py data/10ozon.csv --compare \\
+        --client-cmd "docker exec -i clickhouse clickhouse-client"
+
+--compare грузит файл дважды, этим загрузчиком и clickhouse-client (разбор CSV
+на сервере, input()), в копии bench_load_csv_* и сравнивает строки/с.
+
+Формат - как в README: c1 служебный и пропускается, c2..c6 - offer_id, price,
+seller_id, category_id, vendor; первая строка - заголовок.
+"""
+import argparse
+import datetime
+import os
+import shlex
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from clickhouse_driver import Client
+
+from load_parquet import arrow_column
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CLICKHOUSE_HOST = "localhost"
+CLICKHOUSE_PORT = 9000
+CLICKHOUSE_DB = "ecom"
+TABLE = "ecom_offers"
+CHUNK_MB = 16
+WORKERS = 4
+CLIENT_CMD = "clickhouse-client"
+SCRATCH_PREFIX = "bench_load_csv"
+
+CSV_COLUMNS = ["c1", "c2", "c3", "c4", "c5", "c6"]
+# Столбец CSV -> столбец и тип ecom_offers
+COLUMN_MAP = {
+    "c2": ("offer_id", pa.uint64()),
+    "c3": ("price", pa.float64()),
+    "c4": ("seller_id", pa.uint64()),
+    "c5": ("category_id", pa.uint32()),
+    "c6": ("vendor", pa.string()),
+}
+CH_TYPES = {"c1": "String", "c2": "UInt64", "c3": "Float64", "c4": "UInt64", "c5": "UInt32", "c6": "String"}
+INSERT_COLUMNS = ["snapshot_date"] + [name for name, _ in COLUMN_MAP.values()]
+
+CLIENT_INSERT_SQL = """
+INSERT INTO {table} ({columns})
+SELECT toDate('{snapshot}'), c2, c3, c4, c5, c6
+FROM input('{structure}')
+FORMAT CSVWithNames
+"""
+
+
+def open_reader(path: str, chunk_mb: int):
+    """Потоковый читатель CSV: блоки по chunk_mb, типы ecom_offers, без c1."""
+    return pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(column_names=CSV_COLUMNS, skip_rows=1, block_size=chunk_mb << 20),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={c: t for c, (_, t) in COLUMN_MAP.items()},
+            include_columns=list(COLUMN_MAP),
+            strings_can_be_null=False,
+        ),
+    )
+
+
+def batch_columns(batch, snapshot: datetime.date) -> list:
+    """Пачка Arrow в массивы NumPy столбцов INSERT_COLUMNS для columnar INSERT с use_numpy."""
+    snapshots = np.full(batch.num_rows, np.datetime64(snapshot, "D"))
+    return [snapshots] + [arrow_column(batch.column(c)) for c in COLUMN_MAP]
+
+
+def peak_rss() -> str:
+    """Пиковый RSS процесса из getrusage (Linux, KiB); на Windows его нет."""
+    if resource is None:
+        return "n/a"
+    return f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+
+
+class StreamLoader:
+    """Чтение в основном потоке, вставки в пуле потоков со своими соединениями."""
+
+    def __init__(self, connect, table: str, workers: int):
+        self.connect = connect
+        self.table = table
+        self.workers = workers
+        self.local = threading.local()
+
+    def client(self):
+        if not hasattr(self.local, "client"):
+            self.local.client = self.connect()
+        return self.local.client
+
+    def insert(self, batch, snapshot: datetime.date) -> int:
+        self.client().execute(f"INSERT INTO {self.table} ({', '.join(INSERT_COLUMNS)}) VALUES",
+                              batch_columns(batch, snapshot), columnar=True, settings={"use_numpy": True})
+        return batch.num_rows
+
+    def run(self, path: str, snapshot: datetime.date, chunk_mb: int) -> int:
+        loaded = 0
+        pending = deque()
+        t0 = time.perf_counter()
+        reader = open_reader(path, chunk_mb)
+        with ThreadPoolExecutor(self.workers) as pool:
+            for batch in reader:
+                pending.append(pool.submit(self.insert, batch, snapshot))
+                while len(pending) >= 2 * self.workers:
+                    loaded += pending.popleft().result()
+                    elapsed = time.perf_counter() - t0
+                    print(f"  {loaded} rows, {loaded / elapsed if elapsed > 0 else 0:,.0f} rows/s",
+                          end="\r", flush=True)
+            while pending:
+                loaded += pending.popleft().result()
+        print()
+        return loaded
+
+
+def client_load(args, table: str, snapshot: datetime.date) -> None:
+    """Тот же файл через clickhouse-client: CSV разбирает сервер."""
+    query = CLIENT_INSERT_SQL.format(
+        table=table, columns=", ".join(INSERT_COLUMNS), snapshot=snapshot.isoformat(),
+        structure=", ".join(f"{c} {CH_TYPES[c]}" for c in CSV_COLUMNS)).strip()
+    cmd = shlex.split(args.client_cmd) + [
+        "--host", args.host, "--port", str(args.port), "--user", args.user, "--password", args.password,
+        "--database", args.database, "--input_format_with_names_use_header=0", "--query", query]
+    with open(args.path, "rb") as f:
+        subprocess.run(cmd, stdin=f, check=True)
+
+
+def compare(args, connect, snapshot: datetime.date) -> None:
+    client = connect()
+    size = os.path.getsize(args.path)
+    results = []
+    for method in ("stream", "client"):
+        table = f"{SCRATCH_PREFIX}_{method}"
+        client.execute(f"DROP TABLE IF EXISTS {table}")
+        client.execute(f"CREATE TABLE {table} AS {args.table}")
+        try:
+            t0 = time.perf_counter()
+            if method == "stream":
+                StreamLoader(connect, table, args.workers).run(args.path, snapshot, args.chunk_mb)
+            else:
+                client_load(args, table, snapshot)
+            elapsed = time.perf_counter() - t0
+            rows = client.execute(f"SELECT count() FROM {table}")[0][0]
+            results.append((method, rows, elapsed))
+        except (OSError, subprocess.CalledProcessError, pa.ArrowInvalid) as e:
+            print(f"  {method}: failed, {e}")
+        finally:
+            client.execute(f"DROP TABLE IF EXISTS {table}")
+
+    print(f"\n  {'method':<8}{'rows':>12}{'seconds':>10}{'rows/s':>12}{'MB/s':>8}")
+    for method, rows, elapsed in results:
+        print(f"  {method:<8}{rows:>12}{elapsed:>10.1f}{rows / elapsed:>12,.0f}{size / 2 ** 20 / elapsed:>8.1f}")
+    if len({rows for _, rows, _ in results}) > 1:
+        print("  WARNING: row counts differ")
+    print(f"  peak RSS of this process: {peak_rss()}")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Streaming CSV catalog loader for ecom_offers")
+    ap.add_argument("path", help="CSV каталога (10ozon.csv)")
+    ap.add_argument("--host", default=CLICKHOUSE_HOST)
+    ap.add_argument("--port", type=int, default=CLICKHOUSE_PORT)
+    ap.add_argument("--user", default="default")
+    ap.add_argument("--password", default="")
+    ap.add_argument("--database", default=CLICKHOUSE_DB)
+    ap.add_argument("--table", default=TABLE)
+    ap.add_argument("--snapshot-date", type=datetime.date.fromisoformat, default=datetime.date.today(),
+                    help="дата снимка, YYYY-MM-DD; по умолчанию сегодня")
+    ap.add_argument("--chunk-mb", type=int, default=CHUNK_MB, help="размер блока разбора CSV, МБ")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="параллельных вставок")
+    ap.add_argument("--compare", action="store_true",
+                    help="сравнить со вставкой через clickhouse-client в копиях таблицы")
+    ap.add_argument("--client-cmd", default=CLIENT_CMD, help="команда clickhouse-client для --compare")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    def connect():
+        return Client(host=args.host, port=args.port, user=args.user, password=args.password, database=args.database)
+
+    print(f"{args.path} -> {args.database}.{args.table}, snapshot {args.snapshot_date}, "
+          f"{args.chunk_mb} MB chunks, {args.workers} workers")
+    if args.compare:
+        compare(args, connect, args.snapshot_date)
+        return
+    t0 = time.perf_counter()
+    try:
+        rows = StreamLoader(connect, args.table, args.workers).run(args.path, args.snapshot_date, args.chunk_mb)
+    except pa.ArrowInvalid as e:
+        raise SystemExit(f"CSV error: {e}")
+    elapsed = time.perf_counter() - t0
+    print(f"Loaded {rows} rows in {elapsed:.1f} s: {rows / elapsed:,.0f} rows/s, "
+          f"peak RSS {peak_rss()}")
+
+
+if __name__ == "__main__":
+    main()
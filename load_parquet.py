@@ -0,0 +1,287 @@
+"""Parallel loading of Parquet files into ClickHouse, row group by row group.
+
+INSERT ... FROM file() в init.sql - одна серверная вставка: без прогресса,
+без управления параллелизмом и без безопасного повтора после обрыва.
+
+    python load_parquet.py data/RawEvent.parquet                        # в raw_events
+    python load_parquet.py dumps/events_*.parquet --workers 8 --batch-rows 200000
+    python load_parquet.py data/EcomOffer.parquet --table ecom_offers
+
+Как работает:
+  1. Row group'ы всех файлов раздаются процессам (--workers) по одному, по мере
+     освобождения: крупные и мелкие группы выравниваются сами.
+  2. Процесс читает свою группу пачками Arrow по --batch-rows строк (только
+     столбцы, которые есть в таблице) и отправляет каждую пачку отдельным
+     INSERT по нативному протоколу; --block-rows - размер блока, на который
+     драйвер режет пачку (insert_block_size). Столбцы передаются массивами
+     NumPy (use_numpy): числа и время - без копирования из Arrow, строки -
+     массивом объектов, без списков Python на каждое значение. Память
+     процесса ограничена пачкой, а не row group.
+  3. У каждой пачки постоянный insert_deduplication_token: <файл>:<row group>:<пачка>,
+     где <файл> - имя и отпечаток метаданных Parquet. Повтор после сетевой
+     ошибки или перезапуск всей загрузки с тем же --batch-rows не дублирует
+     строки: сервер пропускает уже вставленные блоки, а вместе с ними и вставку
+     в MV. Для нереплицированных таблиц дедупликация работает только при
+     non_replicated_deduplication_window > 0; у raw_events окно выключено (оно
+     отбрасывает и повторные блоки без токена), его включают на время загрузки:
+         ALTER TABLE raw_events MODIFY SETTING non_replicated_deduplication_window = 10000;
+     Если окно выключено, загрузчик предупреждает: повтор может задвоить пачку.
+
+Итог - строки/с, а по system.query_log и system.query_views_log (log_query_views) -
+доля времени пачки, ушедшая на MV, по пачкам и по представлениям. Нужны права:
+    GRANT INSERT ON ecom.* TO loader;
+    GRANT SELECT ON system.query_log, SELECT ON system.query_views_log TO loader;
+    GRANT SYSTEM FLUSH LOGS ON *.* TO loader;
+"""
+import argparse
+import hashlib
+import multiprocessing as mp
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from clickhouse_driver import Client, errors
+
+from query_log import flush_logs, make_query_id, new_run_id
+
+CLICKHOUSE_HOST = "localhost"
+CLICKHOUSE_PORT = 9000
+CLICKHOUSE_DB = "ecom"
+TABLE = "raw_events"
+BATCH_ROWS = 100000
+RETRIES = 5
+RETRY_BACKOFF = 1.0    # секунд перед первым повтором, дальше вдвое больше
+
+# Ошибки сервера, после которых пачку имеет смысл повторить с тем же токеном
+RETRYABLE_CODES = {
+    159,   # TIMEOUT_EXCEEDED
+    202,   # TOO_MANY_SIMULTANEOUS_QUERIES
+    209,   # SOCKET_TIMEOUT
+    210,   # NETWORK_ERROR
+    252,   # TOO_MANY_PARTS
+}
+
+COLUMNS_SQL = """
+SELECT name
+FROM system.columns
+WHERE database = %(db)s AND table = %(table)s AND default_kind NOT IN ('MATERIALIZED', 'ALIAS')
+ORDER BY position
+"""
+
+DEDUP_WINDOW_SQL = """
+SELECT engine,
+       extract(engine_full, 'non_replicated_deduplication_window = (\\\\d+)'),
+       (SELECT value FROM system.merge_tree_settings WHERE name = 'non_replicated_deduplication_window')
+FROM system.tables
+WHERE database = %(db)s AND name = %(table)s
+"""
+
+BATCH_COSTS_SQL = """
+SELECT query_id, query_duration_ms, written_rows, ProfileEvents['DuplicatedInsertedBlocks']
+FROM system.query_log
+WHERE event_date >= today() - 1 AND startsWith(query_id, %(prefix)s) AND type = 'QueryFinish'
+"""
+
+VIEW_COSTS_SQL = """
+SELECT initial_query_id, view_name, view_duration_ms, written_rows
+FROM system.query_views_log
+WHERE event_date >= today() - 1 AND startsWith(initial_query_id, %(prefix)s)
+"""
+
+_client = None
+_settings = None
+_run_id = None
+
+
+def file_token(path: str, metadata) -> str:
+    """Имя файла и отпечаток метаданных: тот же файл - тот же токен на любой машине."""
+    digest = hashlib.sha1()
+    digest.update(os.path.basename(path).encode())
+    digest.update(str(metadata.num_rows).encode())
+    for i in range(metadata.num_row_groups):
+        rg = metadata.row_group(i)
+        digest.update(f"{rg.num_rows}:{rg.total_byte_size}".encode())
+    return f"{os.path.basename(path)}-{digest.hexdigest()[:12]}"
+
+
+def arrow_column(array):
+    """Столбец пачки Arrow в массив NumPy для columnar INSERT с use_numpy."""
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    return array.to_numpy(zero_copy_only=False)
+
+
+def dedup_window(client, db: str, table: str):
+    """Окно дедупликации нереплицированной таблицы; None - таблица реплицируемая (токены работают всегда)."""
+    rows = client.execute(DEDUP_WINDOW_SQL, {"db": db, "table": table})
+    if not rows:
+        return 0
+    engine, window, default = rows[0]
+    if engine.startswith("Replicated"):
+        return None
+    return int(window or default or 0)
+
+
+def init_worker(connection: dict, settings: dict, run_id: str) -> None:
+    global _client, _settings, _run_id
+    _client = Client(**connection)
+    _settings = settings
+    _run_id = run_id
+
+
+def insert_batch(insert_sql: str, columns: list, token: str, retries: int, backoff: float) -> int:
+    """Вставка с повторами; возвращает число попыток."""
+    for attempt in range(1, retries + 2):
+        try:
+            _client.execute(insert_sql, columns, columnar=True,
+                            settings={**_settings, "insert_deduplication_token": token},
+                            query_id=make_query_id(_run_id, "load"))
+            return attempt
+        except (errors.NetworkError, errors.SocketTimeoutError, EOFError, OSError, errors.ServerException) as e:
+            if isinstance(e, errors.ServerException) and e.code not in RETRYABLE_CODES:
+                raise
+            if attempt > retries:
+                raise
+            print(f"  {token}: attempt {attempt} failed ({str(e).splitlines()[0]}), retrying", flush=True)
+            _client.disconnect()
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def load_row_group(task: tuple) -> dict:
+    """Выполняется в воркере: одна row group пачками по batch_rows строк."""
+    path, token, row_group, table, columns, batch_rows, retries, backoff = task
+    insert_sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES"
+    pf = pq.ParquetFile(path)
+    rows = batches = attempts = 0
+    t0 = time.perf_counter()
+    for i, batch in enumerate(pf.iter_batches(batch_size=batch_rows, row_groups=[row_group],
+                                              columns=columns, use_threads=False)):
+        data = [arrow_column(batch.column(j)) for j in range(batch.num_columns)]
+        attempts += insert_batch(insert_sql, data, f"{token}:{row_group}:{i}", retries, backoff)
+        rows += batch.num_rows
+        batches += 1
+    return {"path": path, "row_group": row_group, "rows": rows, "batches": batches,
+            "retries": attempts - batches, "seconds": time.perf_counter() - t0}
+
+
+def plan(paths: list, table_columns: list) -> tuple:
+    """Задачи по row group и общий для всех файлов список столбцов."""
+    tasks = []
+    columns = None
+    for path in paths:
+        pf = pq.ParquetFile(path)
+        names = [c for c in table_columns if c in pf.schema_arrow.names]
+        if columns is None:
+            columns = names
+        elif names != columns:
+            raise SystemExit(f"{path}: columns {names} differ from {columns} of the first file")
+        token = file_token(path, pf.metadata)
+        tasks += [(path, token, rg, pf.metadata.row_group(rg).num_rows) for rg in range(pf.metadata.num_row_groups)]
+    if not columns:
+        raise SystemExit(f"No columns of the table found in {', '.join(paths)}")
+    return tasks, columns
+
+
+def report_mv_overhead(client, run_id: str) -> None:
+    """Время MV в каждой пачке по query_views_log относительно длительности INSERT."""
+    prefix = run_id + ":"
+    flush_logs(client)
+    batches = {qid: (ms, written, dup) for qid, ms, written, dup in client.execute(BATCH_COSTS_SQL, {"prefix": prefix})}
+    if not batches:
+        print("  no rows in system.query_log for this run (log_queries disabled or no grant)")
+        return
+    duplicated = sum(dup for _, _, dup in batches.values())
+    print(f"  {len(batches)} INSERTs in query_log, {duplicated} blocks skipped as duplicates")
+    try:
+        views = client.execute(VIEW_COSTS_SQL, {"prefix": prefix})
+    except errors.ServerException as e:
+        print(f"  system.query_views_log unavailable: {str(e).splitlines()[0]}")
+        return
+    per_batch = {}
+    per_view = {}
+    for qid, view, ms, written in views:
+        per_batch[qid] = per_batch.get(qid, 0) + ms
+        stats = per_view.setdefault(view, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += ms
+        stats[2] += written
+    shares = sorted(per_batch.get(qid, 0) / ms for qid, (ms, _, _) in batches.items() if ms)
+    if shares:
+        print(f"  MV share of INSERT time per batch: p50 {shares[len(shares) // 2]:.0%}, "
+              f"p90 {shares[int(0.9 * (len(shares) - 1))]:.0%}, max {shares[-1]:.0%}")
+    print(f"  {'view':<40}{'batches':>9}{'ms/batch':>10}{'rows':>12}")
+    for view, (n, ms, written) in sorted(per_view.items(), key=lambda kv: -kv[1][1]):
+        print(f"  {view:<40}{n:>9}{ms / n:>10.1f}{written:>12}")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Parallel row-group-sharded Parquet ingestion into ClickHouse")
+    ap.add_argument("paths", nargs="+", help="файлы Parquet")
+    ap.add_argument("--host", default=CLICKHOUSE_HOST)
+    ap.add_argument("--port", type=int, default=CLICKHOUSE_PORT)
+    ap.add_argument("--user", default="default")
+    ap.add_argument("--password", default="")
+    ap.add_argument("--database", default=CLICKHOUSE_DB)
+    ap.add_argument("--table", default=TABLE)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов, row group на процесс")
+    ap.add_argument("--batch-rows", type=int, default=BATCH_ROWS,
+                    help="строк в пачке Arrow = в одном INSERT; меняет токены дедупликации")
+    ap.add_argument("--block-rows", type=int, default=0,
+                    help="insert_block_size: строк в блоке нативного протокола (0 - равно --batch-rows)")
+    ap.add_argument("--compression", default=None, help="сжатие нативного протокола: lz4, zstd")
+    ap.add_argument("--retries", type=int, default=RETRIES, help="повторов пачки после сетевой ошибки")
+    ap.add_argument("--no-views-log", action="store_true", help="не включать log_query_views и не считать долю MV")
+    args = ap.parse_args()
+    missing = [p for p in args.paths if not os.path.exists(p)]
+    if missing:
+        ap.error(f"no such files: {', '.join(missing)}")
+    return args
+
+
+def main():
+    args = parse_args()
+    connection = {"host": args.host, "port": args.port, "user": args.user, "password": args.password,
+                  "database": args.database}
+    if args.compression:
+        connection["compression"] = args.compression
+    client = Client(**connection)
+    table_columns = [name for (name,) in client.execute(COLUMNS_SQL, {"db": args.database, "table": args.table})]
+    if not table_columns:
+        raise SystemExit(f"No such table {args.database}.{args.table}")
+    tasks, columns = plan(args.paths, table_columns)
+    if dedup_window(client, args.database, args.table) == 0:
+        print(f"WARNING: non_replicated_deduplication_window = 0 for {args.database}.{args.table}: "
+              f"retried batches may be inserted twice; enable it for the load with\n"
+              f"  ALTER TABLE {args.table} MODIFY SETTING non_replicated_deduplication_window = 10000")
+    total = sum(n for *_, n in tasks)
+    run_id = new_run_id()
+    settings = {"insert_block_size": args.block_rows or args.batch_rows, "use_numpy": True}
+    if not args.no_views_log:
+        settings["log_query_views"] = 1
+    print(f"{total} rows in {len(tasks)} row groups of {len(args.paths)} files -> {args.database}.{args.table} "
+          f"({', '.join(columns)}); {args.workers} workers, {args.batch_rows} rows per batch, run id {run_id}")
+
+    loaded = batches = retries = 0
+    t0 = time.perf_counter()
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(args.workers, initializer=init_worker, initargs=(connection, settings, run_id)) as pool:
+        work = [(path, token, rg, args.table, columns, args.batch_rows, args.retries, RETRY_BACKOFF)
+                for path, token, rg, _ in tasks]
+        for done, result in enumerate(pool.imap_unordered(load_row_group, work), 1):
+            loaded += result["rows"]
+            batches += result["batches"]
+            retries += result["retries"]
+            elapsed = time.perf_counter() - t0
+            print(f"  {done}/{len(tasks)} row groups, {loaded}/{total} rows, "
+                  f"{loaded / elapsed if elapsed > 0 else 0:,.0f} rows/s", end="\r", flush=True)
+    elapsed = time.perf_counter() - t0
+    print()
+    print(f"Loaded {loaded} rows in {batches} batches in {elapsed:.1f} s: {loaded / elapsed:,.0f} rows/s, "
+          f"{retries} retries")
+    if not args.no_views_log:
+        report_mv_overhead(client, run_id)
+
+
+if __name__ == "__main__":
+    main()
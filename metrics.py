@@ -0,0 +1,174 @@
+"""Prometheus /metrics endpoint with client-side query latencies.
+
+Сервер ClickHouse (clickhouse:9363) отдаёт только свои счётчики; здесь -
+задержка, которую видит клиент нагрузочного теста, по каждому запросу:
+
+    bench_query_duration_seconds{mode, query}   histogram
+    bench_query_errors_total{mode, query}       counter
+    bench_queries_in_flight{mode, query}        gauge
+    bench_run_info{run_id, mode}                1
+
+Без prometheus_client: формат text exposition 0.0.4 и http.server в фоновом
+потоке. Процессы closed-loop считают метрики у себя и периодически
+отправляют снимок в основной процесс (update_remote), наружу отдаётся сумма.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = 9464
+SNAPSHOT_INTERVAL = 1.0   # секунд между снимками из процессов closed-loop
+
+# Границы корзин в секундах: от точечных запросов до тяжёлых JOIN
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class QueryMetrics:
+    def __init__(self):
+        self.enabled = False
+        self.run_info = {}
+        self._lock = threading.Lock()
+        self._local = _empty()
+        self._remote = {}   # источник (процесс) -> последний снимок
+
+    def begin(self, mode: str, query: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (mode, query)
+            self._local["in_flight"][key] = self._local["in_flight"].get(key, 0) + 1
+
+    def end(self, mode: str, query: str, seconds: float, error: bool = False) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (mode, query)
+            self._local["in_flight"][key] = self._local["in_flight"].get(key, 0) - 1
+            if error:
+                self._local["errors"][key] = self._local["errors"].get(key, 0) + 1
+                return
+            buckets, total, count = self._local["hist"].get(key, ([0] * len(BUCKETS), 0.0, 0))
+            buckets = list(buckets)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            self._local["hist"][key] = (buckets, total + seconds, count + 1)
+
+    def snapshot(self) -> dict:
+        """Копия счётчиков процесса - передаётся через multiprocessing.Queue."""
+        with self._lock:
+            return {name: dict(values) for name, values in self._local.items()}
+
+    def update_remote(self, source: str, snapshot: dict) -> None:
+        with self._lock:
+            self._remote[source] = snapshot
+
+    def render(self) -> str:
+        with self._lock:
+            total = _empty()
+            for snap in [self._local] + list(self._remote.values()):
+                for key, (buckets, s, c) in snap["hist"].items():
+                    b0, s0, c0 = total["hist"].get(key, ([0] * len(BUCKETS), 0.0, 0))
+                    total["hist"][key] = ([x + y for x, y in zip(b0, buckets)], s0 + s, c0 + c)
+                for name in ("errors", "in_flight"):
+                    for key, value in snap[name].items():
+                        total[name][key] = total[name].get(key, 0) + value
+            run_info = dict(self.run_info)
+
+        lines = []
+        if run_info:
+            lines += ["# HELP bench_run_info Benchmark run currently exporting metrics.",
+                      "# TYPE bench_run_info gauge",
+                      f"bench_run_info{_labels(run_info)} 1"]
+        lines += ["# HELP bench_query_duration_seconds Client-observed query latency.",
+                  "# TYPE bench_query_duration_seconds histogram"]
+        for (mode, query), (buckets, s, c) in sorted(total["hist"].items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                lines.append(f"bench_query_duration_seconds_bucket"
+                             f"{_labels({'mode': mode, 'query': query, 'le': repr(bound)})} {cumulative}")
+            labels = _labels({"mode": mode, "query": query})
+            lines.append(f'bench_query_duration_seconds_bucket{_labels({"mode": mode, "query": query, "le": "+Inf"})} {c}')
+            lines.append(f"bench_query_duration_seconds_sum{labels} {s}")
+            lines.append(f"bench_query_duration_seconds_count{labels} {c}")
+        lines += ["# HELP bench_query_errors_total Benchmark queries that raised an error.",
+                  "# TYPE bench_query_errors_total counter"]
+        for (mode, query), n in sorted(total["errors"].items()):
+            lines.append(f"bench_query_errors_total{_labels({'mode': mode, 'query': query})} {n}")
+        lines += ["# HELP bench_queries_in_flight Benchmark queries sent and not yet answered.",
+                  "# TYPE bench_queries_in_flight gauge"]
+        for (mode, query), n in sorted(total["in_flight"].items()):
+            lines.append(f"bench_queries_in_flight{_labels({'mode': mode, 'query': query})} {n}")
+        return "\n".join(lines) + "\n"
+
+
+def _empty() -> dict:
+    return {"hist": {}, "errors": {}, "in_flight": {}}
+
+
+def _labels(labels: dict) -> str:
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def split_label(label: str) -> tuple:
+    """'closed-loop/c4/mv_top_brands' -> ('closed-loop/c4', 'mv_top_brands')"""
+    mode, _, query = label.rpartition("/")
+    return mode or "sequential", query
+
+
+METRICS = QueryMetrics()
+
+
+def start_server(port: int, metrics: QueryMetrics = METRICS) -> ThreadingHTTPServer:
+    """Отдаёт /metrics из фонового потока до завершения процесса."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass   # не засоряем вывод бенчмарка строками доступа
+
+    metrics.enabled = True
+    server = ThreadingHTTPServer(("", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def forward_snapshots(metrics: QueryMetrics, queue, source: str, stop: threading.Event) -> threading.Thread:
+    """В процессе closed-loop: снимок счётчиков в очередь основного процесса раз в SNAPSHOT_INTERVAL."""
+    metrics.enabled = True
+
+    def loop():
+        while not stop.wait(SNAPSHOT_INTERVAL):
+            queue.put((source, metrics.snapshot()))
+        queue.put((source, metrics.snapshot()))
+
+    thread = threading.Thread(target=loop, name="metrics-forward", daemon=True)
+    thread.start()
+    return thread
+
+
+def collect_snapshots(metrics: QueryMetrics, queue) -> threading.Thread:
+    """В основном процессе: принимает снимки от процессов closed-loop."""
+
+    def loop():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            metrics.update_remote(*item)
+
+    thread = threading.Thread(target=loop, name="metrics-collect", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,112 @@
+"""Stack samples of benchmark queries from system.trace_log.
+
+Запросы выполняются с query_profiler_real_time_period_ns /
+query_profiler_cpu_time_period_ns, после прогона сэмплы стеков собираются по
+префиксу query_id (как в query_log.py) и символизируются на сервере через
+addressToSymbol/demangle. Результат - collapsed stacks ("f1;f2;f3 count"),
+которые читают flamegraph.pl, speedscope и flamegraph.py.
+
+Пользователю benchmark нужны права:
+    GRANT SELECT ON system.trace_log TO benchmark;
+    GRANT INTROSPECTION ON *.* TO benchmark;
+"""
+import datetime
+import re
+import time
+
+from query_log import QUERY_LOG_WAIT, flush_logs
+
+PROFILE_PERIOD_NS = 10000000   # 10 мс между сэмплами
+TRACE_TYPES = {"real": "Real", "cpu": "CPU"}
+
+# Стадия запроса по процессору конвейера: первый совпавший кадр от корня стека
+PHASES = [
+    ("read", re.compile(r"MergeTree(Select|Thread|Read|Source|Prefetched)|IMergeTreeReader")),
+    ("join", re.compile(r"JoiningTransform|FillingRightJoinSide|HashJoin|MergeJoin|GraceHashJoin")),
+    ("aggregate", re.compile(r"AggregatingTransform|Aggregator::|MergingAggregated")),
+    ("sort", re.compile(r"Sort(ing)?Transform|MergeSorter")),
+    ("filter/expressions", re.compile(r"FilterTransform|ExpressionTransform|ExpressionActions")),
+]
+
+# Сначала группируем по массиву адресов, символизируем уже уникальные стеки
+TRACE_LOG_SQL = """
+SELECT
+    label,
+    trace_type,
+    arrayStringConcat(
+        arrayMap(addr -> replaceAll(if(empty(demangle(addressToSymbol(addr))), '??',
+                                       demangle(addressToSymbol(addr))), ';', ':'),
+                 arrayReverse(trace)),
+        ';') AS stack,
+    sum(samples) AS samples
+FROM
+(
+    SELECT
+        splitByChar(':', query_id)[2] AS label,
+        toString(trace_type) AS trace_type,
+        trace,
+        count() AS samples
+    FROM system.trace_log
+    WHERE event_date >= %(since_date)s
+      AND startsWith(query_id, %(prefix)s)
+      AND trace_type IN %(trace_types)s
+    GROUP BY label, trace_type, trace
+)
+GROUP BY label, trace_type, stack
+"""
+
+
+def profiler_settings(trace_types, period_ns: int) -> dict:
+    return {
+        "query_profiler_real_time_period_ns": period_ns if "real" in trace_types else 0,
+        "query_profiler_cpu_time_period_ns": period_ns if "cpu" in trace_types else 0,
+    }
+
+
+def fetch_stacks(client, run_id: str, since: datetime.datetime, trace_types) -> dict:
+    """(label, trace_type) -> {collapsed stack: samples}; trace_type в нижнем регистре."""
+    params = {
+        "since_date": (since - datetime.timedelta(days=1)).date(),
+        "prefix": run_id + ":",
+        "trace_types": tuple(TRACE_TYPES[t] for t in trace_types),
+    }
+    if not flush_logs(client):
+        time.sleep(QUERY_LOG_WAIT)   # trace_log сбрасывается на диск раз в 7.5 с по умолчанию
+    rows = client.execute(TRACE_LOG_SQL, params, settings={"allow_introspection_functions": 1})
+    stacks = {}
+    for label, trace_type, stack, samples in rows:
+        stacks.setdefault((label, trace_type.lower()), {})[stack] = samples
+    return stacks
+
+
+def write_folded(path: str, stacks: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, samples in sorted(stacks.items()):
+            f.write(f"{stack} {samples}\n")
+
+
+def top_frames(stacks: dict, limit: int = 10, leaf: bool = True) -> list:
+    """[(функция, доля сэмплов)]: leaf=True - собственное время, False - время с потомками."""
+    total = sum(stacks.values())
+    counts = {}
+    for stack, samples in stacks.items():
+        frames = stack.split(";")
+        for frame in ([frames[-1]] if leaf else set(frames)):
+            counts[frame] = counts.get(frame, 0) + samples
+    ranked = sorted(counts.items(), key=lambda item: -item[1])[:limit]
+    return [(frame, samples / total) for frame, samples in ranked] if total else []
+
+
+def phase_breakdown(stacks: dict) -> list:
+    """[(стадия, доля сэмплов)]: чтение, JOIN, агрегация (хэширование), сортировка, прочее."""
+    total = sum(stacks.values())
+    counts = {}
+    for stack, samples in stacks.items():
+        phase = "other"
+        for frame in stack.split(";"):
+            matched = next((name for name, pattern in PHASES if pattern.search(frame)), None)
+            if matched:
+                phase = matched
+                break
+        counts[phase] = counts.get(phase, 0) + samples
+    return sorted(((phase, n / total) for phase, n in counts.items()), key=lambda item: -item[1]) if total else []
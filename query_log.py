@@ -0,0 +1,101 @@
+"""Server-side cost of benchmark queries from system.query_log.
+
+Каждый запрос бенчмарка отправляется с query_id вида "<run_id>:<label>:<n>",
+после прогона строки query_log собираются по префиксу run_id и группируются
+по label (тот же ключ, что и у гистограмм задержек).
+
+Пользователю benchmark нужны права:
+    GRANT SELECT ON system.query_log TO benchmark;
+    GRANT SYSTEM FLUSH LOGS ON *.* TO benchmark;
+"""
+import datetime
+import itertools
+import time
+import uuid
+
+QUERY_LOG_WAIT = 15.0   # секунд ждать строки, если SYSTEM FLUSH LOGS недоступен
+
+_sequence = itertools.count()
+
+QUERY_LOG_SQL = """
+SELECT
+    query_id,
+    type,
+    query_duration_ms,
+    read_rows,
+    read_bytes,
+    result_rows,
+    result_bytes,
+    memory_usage,
+    ProfileEvents['SelectedParts']          AS selected_parts,
+    ProfileEvents['SelectedMarks']          AS selected_marks,
+    ProfileEvents['RealTimeMicroseconds']   AS real_time_us,
+    ProfileEvents['UserTimeMicroseconds']   AS user_time_us,
+    ProfileEvents['SystemTimeMicroseconds'] AS system_time_us,
+    ProfileEvents['NetworkSendBytes']       AS network_send_bytes,
+    ProfileEvents['NetworkReceiveBytes']    AS network_receive_bytes
+FROM system.query_log
+WHERE event_date >= %(since_date)s
+  AND startsWith(query_id, %(prefix)s)
+  AND type IN ('QueryFinish', 'ExceptionWhileProcessing')
+"""
+
+COST_COLUMNS = [
+    "query_id", "type", "query_duration_ms", "read_rows", "read_bytes", "result_rows",
+    "result_bytes", "memory_usage", "selected_parts", "selected_marks", "real_time_us",
+    "user_time_us", "system_time_us", "network_send_bytes", "network_receive_bytes",
+]
+
+# Метрики, которые усредняются по итерациям
+COST_METRICS = COST_COLUMNS[2:]
+
+
+def new_run_id() -> str:
+    return f"bench-{datetime.datetime.now():%Y%m%d_%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+def make_query_id(run_id: str, label: str) -> str:
+    # случайная часть + счётчик: уникально и между процессами closed-loop, и между потоками open-loop
+    return f"{run_id}:{label}:{uuid.uuid4().hex[:8]}-{next(_sequence)}"
+
+
+def label_of(query_id: str) -> str:
+    return query_id.split(":", 2)[1]
+
+
+def flush_logs(client) -> bool:
+    try:
+        client.execute("SYSTEM FLUSH LOGS")
+        return True
+    except Exception:
+        return False
+
+
+def fetch_query_costs(client, run_id: str, since: datetime.datetime, expected: int = 0) -> list:
+    """Строки query_log прогона; без FLUSH LOGS ждём, пока наберётся expected строк."""
+    # Часы клиента и сервера (контейнер в UTC) могут расходиться, поэтому отсекаем
+    # только по дате с запасом в сутки, а сам прогон находим по префиксу query_id
+    params = {"since_date": (since - datetime.timedelta(days=1)).date(), "prefix": run_id + ":"}
+    flushed = flush_logs(client)
+    deadline = time.monotonic() + (0 if flushed else QUERY_LOG_WAIT)
+    while True:
+        rows = client.execute(QUERY_LOG_SQL, params)
+        if flushed or len(rows) >= expected or time.monotonic() >= deadline:
+            return [dict(zip(COST_COLUMNS, row)) for row in rows]
+        time.sleep(1.0)
+
+
+def summarize_costs(rows: list) -> dict:
+    """label -> средние значения метрик, число строк и число ошибок."""
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(label_of(row["query_id"]), []).append(row)
+
+    summary = {}
+    for label, items in grouped.items():
+        ok = [r for r in items if r["type"] == "QueryFinish"]
+        stats = {"count": len(ok), "errors": len(items) - len(ok)}
+        for metric in COST_METRICS:
+            stats[metric] = sum(r[metric] for r in ok) / len(ok) if ok else 0.0
+        summary[label] = stats
+    return summary
@@ -0,0 +1,234 @@
+"""Declarative benchmark scenarios.
+
+Сценарии описываются в TOML (или YAML при установленном PyYAML) файлах каталога
+scenarios/. Каждый файл содержит список [[scenario]]:
+
+    [[scenario]]
+    name = "offer_point_lookup"
+    weight = 5                       # доля в смеси closed-loop / open-loop
+    settings = { max_threads = 1 }   # настройки ClickHouse для запроса
+    fingerprint = "12:3f2a..."       # ожидаемый результат: "<строк>:<хэш>" (необязательно)
+    sql = '''
+    SELECT * FROM ecom_offers
+    WHERE category_id = {category:UInt32} AND offer_id = {offer:UInt64}
+    '''
+
+    [scenario.params.category]
+    generator = "sample"             # uniform | zipf | choice | sample | column | offset | constant
+    query = "SELECT category_id, offer_id FROM ecom_offers"
+    distribution = "zipf"
+
+    [scenario.params.offer]
+    generator = "column"             # второй столбец той же выбранной строки
+    of = "category"
+    index = 1
+
+Параметры {name:Type} подставляются на клиенте как CAST(<литерал> AS Type) на
+каждое выполнение, поэтому query cache не отвечает на весь прогон одним ответом.
+"""
+import bisect
+import glob
+import hashlib
+import itertools
+import os
+import random
+import re
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+PARAM_RE = re.compile(r"\{(\w+):([^{}]+)\}")
+GENERATORS = ("uniform", "zipf", "choice", "sample", "column", "offset", "constant")
+SAMPLE_LIMIT = 100000       # значений для generator = "sample"
+ZIPF_MAX_VALUES = 1000000   # ограничение на размер таблицы весов Zipf
+ZIPF_EXPONENT = 1.1
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+class ParamGenerator:
+    """Генератор значений одного параметра запроса."""
+
+    def __init__(self, name: str, spec: dict):
+        self.name = name
+        self.kind = spec.get("generator", "constant")
+        if self.kind not in GENERATORS:
+            raise ScenarioError(f"param {name!r}: unknown generator {self.kind!r}, expected one of {GENERATORS}")
+        self.spec = spec
+        self.values = list(spec.get("values", []))
+        self.cum_weights = None
+        if self.kind == "choice":
+            if not self.values:
+                raise ScenarioError(f"param {name!r}: choice needs 'values'")
+            if "weights" in spec:
+                self.cum_weights = list(itertools.accumulate(spec["weights"]))
+        elif self.kind == "zipf":
+            lo, hi = int(spec["min"]), int(spec["max"])
+            self.values = range(lo, min(hi, lo + ZIPF_MAX_VALUES - 1) + 1)
+            self.cum_weights = zipf_cum_weights(len(self.values), spec.get("s", ZIPF_EXPONENT))
+        elif self.kind in ("offset", "column") and "of" not in spec:
+            raise ScenarioError(f"param {name!r}: {self.kind} needs 'of'")
+
+    def load(self, client) -> None:
+        """generator = "sample": значения читаются из таблицы один раз при загрузке.
+
+        Без ORDER BY запрос вернул бы первые limit строк в порядке первичного
+        ключа, поэтому выборка берётся по хэшу строки - вразброс по всему
+        результату и одна и та же от прогона к прогону. Для distribution = "zipf"
+        порядок строк - ранг популярности, и берутся первые limit строк запроса.
+        """
+        if self.kind != "sample":
+            return
+        limit = int(self.spec.get("limit", SAMPLE_LIMIT))
+        order = "" if self.spec.get("distribution") == "zipf" else " ORDER BY cityHash64(*)"
+        rows = client.execute(f"SELECT * FROM ({self.spec['query']}){order} LIMIT {limit}")
+        if not rows:
+            raise ScenarioError(f"param {self.name!r}: sample query returned no rows")
+        # несколько столбцов - храним строку целиком, остальные столбцы берёт generator = "column"
+        self.values = [row if len(row) > 1 else row[0] for row in rows]
+        if self.spec.get("distribution") == "zipf":
+            self.cum_weights = zipf_cum_weights(len(self.values), self.spec.get("s", ZIPF_EXPONENT))
+
+    def generate(self, rng: random.Random, bound: dict, rows: dict):
+        spec = self.spec
+        if self.kind == "constant":
+            return spec["value"]
+        if self.kind == "column":
+            return rows[spec["of"]][spec.get("index", 1)]
+        if self.kind == "uniform":
+            lo, hi = spec["min"], spec["max"]
+            if isinstance(lo, float) or isinstance(hi, float):
+                return rng.uniform(lo, hi)
+            return rng.randint(lo, hi)
+        if self.kind == "offset":
+            return bound[spec["of"]] + rng.randint(spec.get("min", 0), spec["max"])
+        if self.kind == "sample" and not self.values:
+            raise ScenarioError(f"param {self.name!r}: sample values are not loaded")
+        if self.cum_weights is None:
+            return rng.choice(self.values)
+        i = bisect.bisect_left(self.cum_weights, rng.random() * self.cum_weights[-1])
+        return self.values[min(i, len(self.values) - 1)]
+
+
+class Scenario:
+    def __init__(self, name: str, sql: str, params: dict = None, settings: dict = None,
+                 weight: float = 1.0, fingerprint: str = None, source: str = "<builtin>"):
+        self.name = name
+        self.sql = sql
+        self.settings = dict(settings or {})
+        self.weight = float(weight)
+        self.fingerprint = fingerprint
+        self.source = source
+        self.params = {p: ParamGenerator(p, spec) for p, spec in (params or {}).items()}
+
+        used = {m.group(1) for m in PARAM_RE.finditer(sql)}
+        missing = used - set(self.params)
+        if missing:
+            raise ScenarioError(f"{source}: scenario {name!r} has no generator for {sorted(missing)}")
+        declared = []
+        for p, gen in self.params.items():
+            ref = gen.spec.get("of")
+            if gen.kind in ("offset", "column") and ref not in declared:
+                raise ScenarioError(f"{source}: scenario {name!r}: param {p!r} refers to {ref!r} "
+                                    f"which is not declared before it")
+            declared.append(p)
+        if self.weight < 0:
+            raise ScenarioError(f"{source}: scenario {name!r} has negative weight")
+
+    @property
+    def parameterized(self) -> bool:
+        return bool(self.params)
+
+    def load(self, client) -> None:
+        for gen in self.params.values():
+            gen.load(client)
+
+    def render(self, rng: random.Random = None) -> str:
+        """SQL с подставленными значениями параметров для одного выполнения."""
+        if not self.params:
+            return self.sql
+        rng = rng or random
+        bound = {}
+        rows = {}
+        for name, gen in self.params.items():   # в порядке объявления: offset/column ссылаются на предыдущие
+            value = gen.generate(rng, bound, rows)
+            if isinstance(value, tuple):
+                rows[name], value = value, value[0]
+            bound[name] = value
+        return PARAM_RE.sub(lambda m: f"CAST({sql_literal(bound[m.group(1)])} AS {m.group(2).strip()})", self.sql)
+
+
+def zipf_cum_weights(n: int, s: float) -> list:
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def sql_literal(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(sql_literal(v) for v in value) + "]"
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def result_fingerprint(rows) -> str:
+    """'<строк>:<sha1>' по отсортированным строкам - не зависит от порядка блоков."""
+    digest = hashlib.sha1()
+    for line in sorted(repr(tuple(row)) for row in rows):
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\n")
+    return f"{len(rows)}:{digest.hexdigest()[:16]}"
+
+
+def _read_file(path: str) -> list:
+    if path.endswith(".toml"):
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    else:
+        if yaml is None:
+            raise ScenarioError(f"{path}: PyYAML is required for YAML scenario files")
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+    entries = data.get("scenario", data.get("scenarios", []))
+    if not isinstance(entries, list):
+        raise ScenarioError(f"{path}: expected a list of scenarios")
+    return entries
+
+
+def load_scenarios(path: str) -> dict:
+    """Все сценарии из файла или каталога (*.toml, *.yaml, *.yml), имя -> Scenario."""
+    if os.path.isdir(path):
+        files = sorted(f for ext in ("toml", "yaml", "yml") for f in glob.glob(os.path.join(path, f"*.{ext}")))
+    else:
+        files = [path]
+    if not files:
+        raise ScenarioError(f"no scenario files in {path}")
+
+    scenarios = {}
+    for file in files:
+        for entry in _read_file(file):
+            try:
+                name, sql = entry["name"], entry["sql"]
+            except KeyError as e:
+                raise ScenarioError(f"{file}: scenario without {e.args[0]!r}") from None
+            if name in scenarios:
+                raise ScenarioError(f"{file}: duplicate scenario {name!r} (first in {scenarios[name].source})")
+            scenarios[name] = Scenario(
+                name, sql,
+                params=entry.get("params"),
+                settings=entry.get("settings"),
+                weight=entry.get("weight", 1.0),
+                fingerprint=entry.get("fingerprint"),
+                source=file,
+            )
+    return scenarios
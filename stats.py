@@ -0,0 +1,122 @@
+"""Statistics helpers for the benchmark harness.
+
+Без внешних зависимостей: доверительный интервал медианы по порядковым
+статистикам, отсечение прогрева по правилу MSER-5 и сравнение двух прогонов
+(критерий Манна-Уитни, бутстреп отношения квантилей).
+"""
+import math
+import random
+from statistics import NormalDist, mean
+
+MSER_BATCH = 5
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_MAX_SAMPLES = 10000   # больше - прореживаем, иначе бутстреп на чистом Python слишком долгий
+
+
+def median_ci(samples, confidence: float = 0.95) -> tuple:
+    """(low, median, high) - непараметрический интервал медианы.
+
+    Границы - порядковые статистики с номерами n/2 -+ z*sqrt(n)/2 (нормальное
+    приближение биномиального распределения), предположений о форме
+    распределения задержек нет.
+    """
+    ordered = sorted(samples)
+    n = len(ordered)
+    if n == 0:
+        return 0.0, 0.0, 0.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    half = z * math.sqrt(n) / 2
+    lo = max(0, int(math.floor(n / 2 - half)))
+    hi = min(n - 1, int(math.ceil(n / 2 + half)) - 1)
+    mid = ordered[n // 2] if n % 2 else (ordered[n // 2 - 1] + ordered[n // 2]) / 2
+    return ordered[lo], mid, ordered[max(hi, lo)]
+
+
+def mser_truncation(samples, batch: int = MSER_BATCH) -> int:
+    """Сколько первых замеров отбросить как прогрев (MSER-5, White 1997).
+
+    Ряд разбивается на средние по batch замеров; выбирается точка отсечения d
+    (не дальше половины ряда), минимизирующая дисперсию хвоста, делённую на его
+    длину в квадрате.
+    """
+    m = len(samples) // batch
+    if m < 2:
+        return 0
+    means = [mean(samples[i * batch:(i + 1) * batch]) for i in range(m)]
+    best_d, best_stat = 0, math.inf
+    for d in range(m // 2 + 1):
+        tail = means[d:]
+        tail_mean = mean(tail)
+        stat = sum((y - tail_mean) ** 2 for y in tail) / len(tail) ** 2
+        if stat < best_stat:
+            best_d, best_stat = d, stat
+    return best_d * batch
+
+
+def quantile(samples, q: float) -> float:
+    """Квантиль q (0..1) с линейной интерполяцией между порядковыми статистиками."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    pos = q * (len(ordered) - 1)
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def mann_whitney_greater(baseline, candidate) -> tuple:
+    """(U, p) односторонний: p-value гипотезы "candidate стохастически больше baseline".
+
+    Нормальное приближение с поправкой на совпадения и на непрерывность;
+    при десятках замеров в каждой выборке оно уже достаточно точное.
+    """
+    n1, n2 = len(baseline), len(candidate)
+    if n1 == 0 or n2 == 0:
+        return 0.0, 1.0
+    merged = sorted([(v, 0) for v in baseline] + [(v, 1) for v in candidate])
+    n = n1 + n2
+    rank_sum = 0.0   # сумма рангов candidate
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and merged[j + 1][0] == merged[i][0]:
+            j += 1
+        avg_rank = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        rank_sum += avg_rank * sum(1 for k in range(i, j + 1) if merged[k][1] == 1)
+        i = j + 1
+    u = rank_sum - n2 * (n2 + 1) / 2   # пары, где candidate > baseline (совпадения - по половине)
+    mu = n1 * n2 / 2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))) if n > 1 else 0.0
+    if sigma == 0:
+        return u, 0.5
+    z = (u - mu - 0.5) / sigma
+    return u, 1 - NormalDist().cdf(z)
+
+
+def bootstrap_ratio_ci(baseline, candidate, q: float = 0.5, confidence: float = 0.95,
+                       resamples: int = BOOTSTRAP_RESAMPLES, seed: int = 0) -> tuple:
+    """(low, ratio, high): отношение квантиля q candidate к baseline и его перцентильный интервал."""
+    if not baseline or not candidate:
+        return 0.0, 0.0, 0.0
+    rng = random.Random(seed)
+    a = _thin(baseline, rng)
+    b = _thin(candidate, rng)
+    base_q = quantile(a, q)
+    ratio = quantile(b, q) / base_q if base_q > 0 else math.inf
+    ratios = []
+    for _ in range(resamples):
+        qa = quantile(rng.choices(a, k=len(a)), q)
+        qb = quantile(rng.choices(b, k=len(b)), q)
+        ratios.append(qb / qa if qa > 0 else math.inf)
+    alpha = (1 - confidence) / 2
+    return quantile(ratios, alpha), ratio, quantile(ratios, 1 - alpha)
+
+
+def _thin(samples, rng: random.Random) -> list:
+    samples = list(samples)
+    if len(samples) <= BOOTSTRAP_MAX_SAMPLES:
+        return samples
+    return rng.sample(samples, BOOTSTRAP_MAX_SAMPLES)
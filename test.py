@@ -1,11 +1,66 @@
+import argparse
+import asyncio
+import csv
+import fnmatch
+import functools
+import itertools
+import json
+import multiprocessing as mp
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
 import time
-from statistics import mean
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 from clickhouse_driver import Client
 from docx import Document
 
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:  # графики необязательны, таблица и CSV пишутся всегда
+    plt = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:  # нужен только для --mode http
+    requests = None
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from bench_results import (compare_samples, git_revision, latest_baseline, load_samples, run_info,
+                           save_samples, server_version, settings_hash)
+from flamegraph import write_svg
+from histogram import LatencyHistogram, merge_into, read_json, write_hdr_log, write_json
+from ingest import (CATALOG_SIZES, EVENT_COLUMNS, EVENTS_TABLE, INGEST_BATCH, INGEST_EVENTS, INSERT_CODECS,
+                    INSERT_FORMATS, MV_VARIANTS, RAW_EVENTS_MVS, attach_live_mvs, compress_body, create_catalog,
+                    create_variant, drop_scratch, encode_rows, event_batches, ingest_state, mv_events)
+from metrics import METRICS, METRICS_PORT, collect_snapshots, forward_snapshots, split_label, start_server
+from profiler import (PROFILE_PERIOD_NS, TRACE_TYPES, fetch_stacks, phase_breakdown, profiler_settings,
+                      top_frames, write_folded)
+from query_log import fetch_query_costs, label_of, make_query_id, new_run_id, summarize_costs
+from scenarios import ScenarioError, load_scenarios, result_fingerprint
+from stats import MSER_BATCH, median_ci, mser_truncation
+from ttl_tiers import (DETAIL_DAYS, RETENTION_DAYS, TIERS, apply_tier, copy_storage, create_copy, daily_events,
+                       data_lag_days, drop_copy, tier_queries)
+
 LOG_TXT = None
 DOC = None
+HISTOGRAMS = {}   # ключ -> LatencyHistogram, выгружаются в конце прогона
+RUN_ID = new_run_id()   # префикс query_id всех запросов прогона
+RNG = random.Random()   # значения параметров сценариев, сид задаётся --seed
+METRICS_QUEUE = None    # снимки /metrics из процессов closed-loop, если включён --metrics-port
 
 def log(message: str = "") -> None:
     print(message)
@@ -16,161 +71,1609 @@ def log(message: str = "") -> None:
 
 CLICKHOUSE_HOST = "localhost"
 CLICKHOUSE_PORT = 9000       
+CLICKHOUSE_HTTP_PORT = 8123
 CLICKHOUSE_DB = "ecom"       
 ITERATIONS = 30              
+SCENARIOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios")
+
+# --adaptive: итерации до сужения доверительного интервала медианы
+CI_TARGET_WIDTH = 0.05       # полная ширина интервала относительно медианы
+CI_CONFIDENCE = 0.95
+QUERY_TIME_BUDGET = 60.0     # секунд на запрос
+MIN_STEADY_ITERATIONS = 10
+MAX_ITERATIONS = 1000
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32]
+SWEEP_DURATION = 30          # секунд на каждый уровень конкурентности
+OPEN_LOOP_CONNECTIONS = 64   # максимум одновременно выполняющихся запросов в open-loop
+BACKLOG_SAMPLE_INTERVAL = 1.0
+WORKER_POLL_INTERVAL = 1.0  # как часто closed-loop проверяет, живы ли процессы без результата
+
+# Состояния кэшей для --mode cache-matrix:
+#   cold        - сброшены mark cache, uncompressed cache, query cache и (если разрешено) page cache
+#   mark-cache  - марки прогреты, данные читаются заново (uncompressed + page cache сброшены)
+#   warm        - всё прогрето, query cache выключен
+#   query-cache - всё прогрето, ответ берётся из query cache (use_query_cache = 1)
+CACHE_STATES = ["cold", "mark-cache", "warm", "query-cache"]
+
+FETCH_VARIANTS = ["rows", "columnar", "numpy", "dataframe"]
+
+# --mode compression: кодеки нативного протокола и размеры блока сжатия
+# lz4 требует пакеты lz4 и clickhouse-cityhash, zstd - пакет zstd
+COMPRESSION_CODECS = ["none", "lz4", "zstd"]
+COMPRESS_BLOCK_SIZES = [65536, 1048576, 4194304]
+INSERT_ROWS = 100000        # строк raw_events в пачке вставки
 
-client = Client(
-    host="localhost",
-    port=9000,
-    database="ecom",
-    user="benchmark",
-    password=""
-)
-
-
-
-# Querys
-
-# Top-20 by number of products in categories
-RAW_TOP_CATEGORIES = """
-SELECT
-    category_id,
-    count() AS offers_cnt
-FROM ecom_offers
-GROUP BY category_id
-ORDER BY offers_cnt DESC
-LIMIT 20
-"""
-
-MV_TOP_CATEGORIES = """
-SELECT
-    category_id,
-    offers_cnt
-FROM catalog_by_category_mv
-ORDER BY offers_cnt DESC
-LIMIT 20
-"""
-
-
-# Top-30 by number of products in brands
-RAW_TOP_BRANDS = """
-SELECT
-    vendor,
-    count() AS offers_cnt
-FROM ecom_offers
-GROUP BY vendor
-ORDER BY offers_cnt DESC
-LIMIT 30
-"""
-
-MV_TOP_BRANDS = """
-SELECT
-    vendor,
-    sum(offers_cnt) AS offers_cnt
-FROM catalog_by_brand_mv
-GROUP BY vendor
-ORDER BY offers_cnt DESC
-LIMIT 30
-"""
-
-
-# Average number of products per brand in each category
-RAW_AVG_OFFERS_PER_BRAND = """
-SELECT
-    category_id,
-    avg(offers_per_brand) AS avg_offers_per_brand
-FROM
-(
-    SELECT
-        category_id,
-        vendor,
-        count() AS offers_per_brand
-    FROM ecom_offers
-    GROUP BY category_id, vendor
-)
-GROUP BY category_id
-ORDER BY avg_offers_per_brand DESC
-"""
-
-MV_AVG_OFFERS_PER_BRAND = """
-SELECT
-    category_id,
-    avg(offers_cnt) AS avg_offers_per_brand
-FROM catalog_by_brand_mv
-GROUP BY category_id
-ORDER BY avg_offers_per_brand DESC
-"""
-
-
-# Analysis of products without events through raw_events
-RAW_OFFERS_WITHOUT_EVENTS = """
-SELECT
-    o.offer_id,
-    o.category_id,
-    o.vendor,
-    o.price
-FROM ecom_offers AS o
-LEFT JOIN
-(
-    SELECT DISTINCT ContentUnitID AS offer_id
-    FROM raw_events
-) AS e
-    ON o.offer_id = e.offer_id
-WHERE e.offer_id IS NULL
-"""
-
-# Analysis of products without events through MV
-MV_OFFERS_WITHOUT_EVENTS = """
-SELECT
-    o.offer_id,
-    o.category_id,
-    o.vendor,
-    o.price
-FROM ecom_offers AS o
-LEFT JOIN offer_events_mv AS ev
-    ON o.offer_id = ev.offer_id
-WHERE ev.offer_id IS NULL
-"""
-
-
-QUERIES = {
-    "raw_top_categories": RAW_TOP_CATEGORIES,
-    "mv_top_categories": MV_TOP_CATEGORIES,
-
-    "raw_top_brands": RAW_TOP_BRANDS,
-    "mv_top_brands": MV_TOP_BRANDS,
-
-    "raw_avg_offers_per_brand": RAW_AVG_OFFERS_PER_BRAND,
-    "mv_avg_offers_per_brand": MV_AVG_OFFERS_PER_BRAND,
-
-    "raw_offers_without_events": RAW_OFFERS_WITHOUT_EVENTS,
-    "mv_offers_without_events": MV_OFFERS_WITHOUT_EVENTS,
+# Сравнение с базовым прогоном из bench_results
+COMPARE_ALPHA = 0.01          # уровень значимости
+REGRESSION_THRESHOLD = 0.05   # и замедление квантиля больше чем на 5%
+MAX_SAMPLES = 100000          # сырых замеров на ключ для bench_results и сравнений: последние, без прогрева
+
+# --mode http: форматы ответа HTTP-интерфейса
+HTTP_FORMATS = ["Native", "RowBinary", "ArrowStream", "Parquet", "JSONEachRow"]
+STREAM_BLOCK_SIZE = 65536   # max_block_size для потокового чтения
+RSS_SAMPLE_ROWS = 65536     # как часто замерять RSS при потоковом чтении
+
+# Оси для --mode settings-sweep по умолчанию; каждая ось прогоняется отдельно
+SETTINGS_SWEEPS = {
+    "max_threads": [1, 2, 4, 8, 16],
+    "join_algorithm": ["hash", "parallel_hash", "grace_hash", "full_sorting_merge"],
+    "max_block_size": [8192, 65536, 262144],
+    "optimize_aggregation_in_order": [0, 1],
+}
+
+
+# Оси для --mode insert-sweep: по умолчанию каждая ось меняется отдельно от INSERT_BASELINE.
+# async: off - синхронная вставка, wait - async_insert с wait_for_async_insert = 1, nowait - без ожидания;
+# mvs: none, all или MV над raw_events из init.sql через + (offer_events_mv+events_hourly_mv)
+INSERT_SWEEPS = {
+    "batch": [1, 100, 10000, 100000, 1000000],
+    "format": INSERT_FORMATS,
+    "compression": INSERT_CODECS,
+    "async": ["off", "wait", "nowait"],
+    "parallel_view_processing": [0, 1],
+    "mvs": ["none"] + RAW_EVENTS_MVS + ["all"],
 }
+INSERT_BASELINE = {"batch": 100000, "format": "Native", "compression": "none", "async": "off",
+                   "parallel_view_processing": 0, "mvs": "all"}
+MAX_INSERTS = 1000          # вставок на точку insert-sweep: мелкие пачки не вставляют все --ingest-events
+ASYNC_FLUSH_TIMEOUT = 60.0  # секунд ждать, пока строки async_insert станут видны
+
+
+class MeteredClient(Client):
+    """Client, который отдаёт задержку запросов бенчмарка (с query_id) в /metrics."""
+
+    def execute(self, query, *args, query_id=None, **kwargs):
+        if not METRICS.enabled or not query_id:
+            return super().execute(query, *args, query_id=query_id, **kwargs)
+        mode, name = split_label(label_of(query_id))
+        METRICS.begin(mode, name)
+        t0 = time.perf_counter()
+        try:
+            result = super().execute(query, *args, query_id=query_id, **kwargs)
+        except Exception:
+            METRICS.end(mode, name, time.perf_counter() - t0, error=True)
+            raise
+        METRICS.end(mode, name, time.perf_counter() - t0)
+        return result
+
+    def execute_iter(self, query, *args, query_id=None, **kwargs):
+        if not METRICS.enabled or not query_id:
+            yield from super().execute_iter(query, *args, query_id=query_id, **kwargs)
+            return
+        mode, name = split_label(label_of(query_id))
+        METRICS.begin(mode, name)
+        t0 = time.perf_counter()
+        try:
+            yield from super().execute_iter(query, *args, query_id=query_id, **kwargs)
+        except Exception:
+            METRICS.end(mode, name, time.perf_counter() - t0, error=True)
+            raise
+        METRICS.end(mode, name, time.perf_counter() - t0)
+
+
+def make_client(**options) -> Client:
+    # Отдельное соединение на процесс: Client не потокобезопасен и не переживает fork
+    return MeteredClient(
+        host=CLICKHOUSE_HOST,
+        port=CLICKHOUSE_PORT,
+        database=CLICKHOUSE_DB,
+        user="benchmark",
+        password="",
+        **options
+    )
+
+
+client = make_client()
+
+
+def query_settings(scenario, extra: dict = None) -> dict:
+    """Настройки сценария, поверх них - настройки режима (ось sweep, max_block_size и т.п.)."""
+    return {**scenario.settings, **(extra or {})}
+
+
+def check_fingerprint(scenario, rows) -> str:
+    """'ok' / 'MISMATCH' / '-' (ожидаемый результат не задан или параметры случайные)."""
+    if not scenario.fingerprint or scenario.parameterized:
+        return "-"
+    return "ok" if result_fingerprint(rows) == scenario.fingerprint else "MISMATCH"
 
 
-def run_benchmark(name: str, sql: str, iterations: int) -> None:
-    times = []
+def run_benchmark(name: str, scenario, iterations: int) -> None:
+    hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+    settings = query_settings(scenario)
 
     log(f"\n=== Query {name} ===")
-    client.execute(sql)
+    rows = client.execute(scenario.render(RNG), settings=settings)
+    if check_fingerprint(scenario, rows) == "MISMATCH":
+        log(f"  WARNING: result fingerprint {result_fingerprint(rows)} != expected {scenario.fingerprint}")
 
     for i in range(iterations):
+        sql = scenario.render(RNG)
         t0 = time.perf_counter()
-        client.execute(sql)
+        client.execute(sql, settings=settings, query_id=make_query_id(RUN_ID, name))
         dt = time.perf_counter() - t0
-        times.append(dt)
+        hist.record(dt)
         log(f"  iteration {i + 1:2d}/{iterations}: {dt:.4f} s")
 
     log(f"\nResults for {name}:")
-    log(f"  min   = {min(times):.4f} s")
-    log(f"  mean  = {mean(times):.4f} s")
-    log(f"  max   = {max(times):.4f} s")
+    log(f"  min   = {hist.min:.4f} s")
+    log(f"  mean  = {hist.mean:.4f} s")
+    log(f"  p50   = {hist.value_at_percentile(50):.4f} s")
+    log(f"  p90   = {hist.value_at_percentile(90):.4f} s")
+    log(f"  p99   = {hist.value_at_percentile(99):.4f} s")
+    log(f"  p99.9 = {hist.value_at_percentile(99.9):.4f} s")
+    log(f"  max   = {hist.max:.4f} s")
+    log("-" * 40)
+    merge_into(HISTOGRAMS, name, hist)
+
+
+def run_adaptive_benchmark(name: str, scenario, target_width: float, confidence: float,
+                           time_budget: float, min_iterations: int, max_iterations: int) -> None:
+    """Повторяет запрос, пока интервал медианы не станет уже target_width.
+
+    Прогрев не задаётся числом итераций: каждые MSER_BATCH замеров начало ряда
+    отсекается по MSER-5, интервал считается только по установившейся части.
+    """
+    log(f"\n=== Query {name} (adaptive) ===")
+    samples = []
+    warmup = 0
+    reason = "max iterations"
+    settings = query_settings(scenario)
+    started = time.perf_counter()
+
+    while len(samples) < max_iterations:
+        sql = scenario.render(RNG)
+        t0 = time.perf_counter()
+        client.execute(sql, settings=settings, query_id=make_query_id(RUN_ID, name))
+        samples.append(time.perf_counter() - t0)
+
+        if len(samples) % MSER_BATCH == 0:
+            warmup = mser_truncation(samples)
+            steady = samples[warmup:]
+            if len(steady) >= min_iterations:
+                lo, mid, hi = median_ci(steady, confidence)
+                if mid > 0 and (hi - lo) / mid <= target_width:
+                    reason = "converged"
+                    break
+        if time.perf_counter() - started >= time_budget:
+            reason = "time budget"
+            break
+
+    warmup = mser_truncation(samples)
+    steady = samples[warmup:]
+    hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+    for dt in steady:
+        hist.record(dt)
+    lo, mid, hi = median_ci(steady, confidence)
+
+    log(f"  iterations = {len(samples)} ({warmup} warm-up discarded), "
+        f"{time.perf_counter() - started:.1f} s, stop: {reason}")
+    log(f"  median = {mid:.4f} s, {confidence:.0%} CI [{lo:.4f}, {hi:.4f}], "
+        f"width = {(hi - lo) / mid if mid else 0:.1%} (target {target_width:.1%})")
+    log(f"  p90 = {hist.value_at_percentile(90):.4f} s, p99 = {hist.value_at_percentile(99):.4f} s, "
+        f"max = {hist.max:.4f} s")
+    if reason != "converged":
+        log("  WARNING: interval did not converge, treat the median as indicative only")
+    log("-" * 40)
+    merge_into(HISTOGRAMS, name, hist)
+
+
+LATENCY_HEADER = f"{'count':>7}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'p99.9':>9}{'max':>9}"
+
+
+def latency_row(hist: LatencyHistogram) -> str:
+    return (f"{hist.total_count:>7}{hist.mean:>9.4f}{hist.value_at_percentile(50):>9.4f}"
+            f"{hist.value_at_percentile(90):>9.4f}{hist.value_at_percentile(99):>9.4f}"
+            f"{hist.value_at_percentile(99.9):>9.4f}{hist.max:>9.4f}")
+
+
+def select_queries(scenarios: dict, patterns) -> dict:
+    if not patterns:
+        return dict(scenarios)
+    selected = {name: scenario for name, scenario in scenarios.items()
+                if any(fnmatch.fnmatch(name, p) for p in patterns)}
+    if not selected:
+        raise SystemExit(f"No queries match {patterns}; available: {', '.join(scenarios)}")
+    return selected
+
+
+def mix_weights(queries: dict) -> list:
+    """Накопленные веса сценариев для выбора запроса в смеси closed-loop / open-loop."""
+    cum_weights = list(itertools.accumulate(scenario.weight for scenario in queries.values()))
+    if not cum_weights or cum_weights[-1] <= 0:
+        raise SystemExit("All selected scenarios have weight 0, nothing to run in the mix")
+    return cum_weights
+
+
+def run_check(queries: dict) -> int:
+    """Один прогон каждого сценария: число строк и отпечаток результата; возвращает число расхождений."""
+    log(f"\n=== Scenario check ===")
+    log(f"  {'query':<28}{'rows':>10}{'time':>9}  {'fingerprint':<28}{'status'}")
+    mismatches = 0
+    for name, scenario in queries.items():
+        t0 = time.perf_counter()
+        try:
+            rows = client.execute(scenario.render(RNG), settings=query_settings(scenario),
+                                  query_id=make_query_id(RUN_ID, f"check/{name}"))
+        except Exception as e:
+            log(f"  {name:<28}  error: {str(e).splitlines()[0]}")
+            mismatches += 1
+            continue
+        dt = time.perf_counter() - t0
+        status = check_fingerprint(scenario, rows)
+        if status == "MISMATCH":
+            status += f" (expected {scenario.fingerprint})"
+            mismatches += 1
+        elif scenario.parameterized:
+            status = "parameterized, not compared"
+        log(f"  {name:<28}{len(rows):>10}{dt:>9.4f}  {result_fingerprint(rows):<28}{status}")
+    log("  fingerprint = '<строк>:<sha1>' по отсортированным строкам, копируется в поле fingerprint сценария")
+    log("-" * 40)
+    return mismatches
+
+
+def closed_loop_worker(worker_id: int, run_id: str, label: str, queries: dict, duration: float,
+                       seed: int, barrier, results, metrics_queue=None) -> None:
+    """Один процесс нагрузки: своё соединение, запросы из смеси по весам без пауз.
+
+    В results всегда кладётся ровно одно значение - замеры или None, если процесс
+    упал, - иначе родитель ждал бы его результата вечно.
+    """
+    stop_metrics = threading.Event()
+    forwarder = None
+    result = None
+    try:
+        if metrics_queue is not None:
+            forwarder = forward_snapshots(METRICS, metrics_queue, f"{label}/w{worker_id}", stop_metrics)
+        try:
+            worker_client = make_client()
+            worker_client.execute("SELECT 1")  # устанавливаем соединение до старта замера
+            barrier.wait()
+        except Exception:
+            # Не оставляем остальные процессы висеть на барьере
+            barrier.abort()
+            raise
+
+        names = list(queries)
+        cum_weights = mix_weights(queries)
+        settings = {name: query_settings(scenario) for name, scenario in queries.items()}
+        samples = {name: LatencyHistogram(max_samples=MAX_SAMPLES) for name in names}
+        errors = {name: 0 for name in names}
+        rng = random.Random(seed + worker_id)  # у каждого процесса своя последовательность запросов
+
+        started = time.perf_counter()
+        deadline = started + duration
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, cum_weights=cum_weights)[0]
+            sql = queries[name].render(rng)
+            t0 = time.perf_counter()
+            try:
+                worker_client.execute(sql, settings=settings[name],
+                                      query_id=make_query_id(run_id, f"{label}/{name}"))
+            except Exception:
+                errors[name] += 1
+                worker_client.disconnect()
+                continue
+            samples[name].record(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+
+        worker_client.disconnect()
+        result = {"samples": samples, "errors": errors, "elapsed": elapsed}
+    finally:
+        results.put(result)
+        if forwarder is not None:
+            stop_metrics.set()
+            forwarder.join()
+
+
+def run_closed_loop(queries: dict, concurrency: int, duration: float, label: str, seed: int) -> dict:
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(concurrency)
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=closed_loop_worker, args=(w, RUN_ID, label, queries, duration, seed, barrier, results,
+                                                          METRICS_QUEUE))
+        for w in range(concurrency)
+    ]
+    for p in workers:
+        p.start()
+    # Забираем результаты до join, иначе большая очередь может заблокировать процессы.
+    # Процесс, убитый без результата (OOM, сигнал), не должен подвесить прогон: когда
+    # живых не осталось, а очередь пуста, недостающих результатов уже не будет
+    collected = []
+    while len(collected) < len(workers):
+        try:
+            collected.append(results.get(timeout=WORKER_POLL_INTERVAL))
+        except queue.Empty:
+            if any(p.is_alive() for p in workers):
+                continue
+            try:  # результат мог прийти между таймаутом и проверкой
+                collected.append(results.get(timeout=WORKER_POLL_INTERVAL))
+            except queue.Empty:
+                break
+    for p in workers:
+        p.join()
+    failed = len(workers) - sum(r is not None for r in collected)
+    if failed:
+        raise SystemExit(f"Closed-loop run at concurrency {concurrency}: {failed} of {len(workers)} workers "
+                         f"failed, see worker errors above")
+
+    samples = {name: LatencyHistogram(max_samples=MAX_SAMPLES) for name in queries}
+    errors = {name: 0 for name in queries}
+    for r in collected:
+        for name in queries:
+            samples[name].merge(r["samples"][name])
+            errors[name] += r["errors"][name]
+    elapsed = max(r["elapsed"] for r in collected)
+    return {"samples": samples, "errors": errors, "elapsed": elapsed}
+
+
+def run_concurrency_sweep(queries: dict, levels, duration: float, seed: int) -> None:
+    log(f"\n=== Closed-loop sweep: {', '.join(f'{n} x{s.weight:g}' for n, s in queries.items())} ===")
+    summary = []
+
+    for concurrency in levels:
+        label = f"closed-loop/c{concurrency}"
+        res = run_closed_loop(queries, concurrency, duration, label, seed)
+        overall = LatencyHistogram()
+        for hist in res["samples"].values():
+            overall.merge(hist)
+        total_errors = sum(res["errors"].values())
+        qps = overall.total_count / res["elapsed"] if res["elapsed"] > 0 else 0.0
+
+        log(f"\n--- Concurrency {concurrency} ---")
+        log(f"  completed = {overall.total_count} in {res['elapsed']:.1f} s, "
+            f"QPS = {qps:.1f}, errors = {total_errors}")
+        log(f"  {'query':<28}{'QPS':>9}{LATENCY_HEADER}")
+        for name, hist in res["samples"].items():
+            merge_into(HISTOGRAMS, f"{label}/{name}", hist)
+            if not hist.total_count:
+                log(f"  {name:<28}{'-':>9}{0:>7}  errors = {res['errors'][name]}")
+                continue
+            log(f"  {name:<28}{hist.total_count / res['elapsed']:>9.1f}{latency_row(hist)}")
+
+        summary.append((concurrency, qps, overall, total_errors))
+
+    log("\nSweep summary:")
+    log(f"  {'conc':>5}{'QPS':>10}{LATENCY_HEADER}{'errors':>8}")
+    for concurrency, qps, hist, errs in summary:
+        log(f"  {concurrency:>5}{qps:>10.1f}{latency_row(hist)}{errs:>8}")
+    if summary:
+        peak = max(summary, key=lambda row: row[1])
+        log(f"  peak QPS = {peak[1]:.1f} at concurrency {peak[0]}")
+    log("-" * 40)
+
+
+async def open_loop(queries: dict, rate: float, duration: float, arrival: str,
+                    connections: int, seed: int, label: str) -> dict:
+    """Отправляет запросы по расписанию прихода, не дожидаясь ответов.
+
+    Задержка считается от запланированного момента отправки, поэтому ожидание
+    свободного соединения и очередь на сервере попадают в измерение
+    (без coordinated omission).
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=connections)
+    pool = asyncio.Queue()
+    for _ in range(connections):
+        pool.put_nowait(make_client())
+
+    names = list(queries)
+    cum_weights = mix_weights(queries)
+    settings = {name: query_settings(scenario) for name, scenario in queries.items()}
+    samples = {name: LatencyHistogram(max_samples=MAX_SAMPLES) for name in names}
+    errors = {name: 0 for name in names}
+    state = {"sent": 0, "completed": 0, "max_lag": 0.0}
+    backlog = []
+    rng = random.Random(seed)
+
+    async def fire(name: str, sql: str, scheduled: float) -> None:
+        conn = await pool.get()
+        try:
+            query_id = make_query_id(RUN_ID, f"{label}/{name}")
+            await loop.run_in_executor(executor, functools.partial(conn.execute, sql, settings=settings[name],
+                                                                   query_id=query_id))
+            samples[name].record(time.perf_counter() - scheduled)
+        except Exception:
+            errors[name] += 1
+            conn.disconnect()
+        finally:
+            state["completed"] += 1
+            pool.put_nowait(conn)
+
+    async def sample_backlog(start: float) -> None:
+        while True:
+            await asyncio.sleep(BACKLOG_SAMPLE_INTERVAL)
+            backlog.append((time.perf_counter() - start, state["sent"] - state["completed"]))
+
+    start = time.perf_counter()
+    sampler = asyncio.create_task(sample_backlog(start))
+    tasks = []
+    scheduled = start
+    while scheduled < start + duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        state["max_lag"] = max(state["max_lag"], time.perf_counter() - scheduled)
+        name = rng.choices(names, cum_weights=cum_weights)[0]
+        tasks.append(asyncio.create_task(fire(name, queries[name].render(rng), scheduled)))
+        state["sent"] += 1
+        scheduled += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+    send_window = time.perf_counter() - start
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    backlog.append((elapsed, 0))
+
+    while not pool.empty():
+        pool.get_nowait().disconnect()
+    executor.shutdown()
+
+    return {
+        "samples": samples, "errors": errors, "sent": state["sent"],
+        "send_window": send_window, "elapsed": elapsed,
+        "max_lag": state["max_lag"], "backlog": backlog,
+    }
+
+
+def run_open_loop(queries: dict, rate: float, duration: float, arrival: str,
+                  connections: int, seed: int) -> None:
+    log(f"\n=== Open-loop {arrival} arrivals at {rate:.1f} req/s: "
+        f"{', '.join(f'{n} x{s.weight:g}' for n, s in queries.items())} ===")
+    label = f"open-loop/{arrival}{rate:g}"
+    res = asyncio.run(open_loop(queries, rate, duration, arrival, connections, seed, label))
+
+    completed = sum(hist.total_count for hist in res["samples"].values())
+    offered = res["sent"] / res["send_window"] if res["send_window"] > 0 else 0.0
+    achieved = completed / res["elapsed"] if res["elapsed"] > 0 else 0.0
+    log(f"  target rate   = {rate:.1f} req/s")
+    log(f"  offered rate  = {offered:.1f} req/s ({res['sent']} sent, max dispatch lag {res['max_lag'] * 1000:.1f} ms)")
+    log(f"  achieved rate = {achieved:.1f} req/s ({completed} ok, "
+        f"{sum(res['errors'].values())} errors, drained in {res['elapsed']:.1f} s)")
+
+    log(f"  {'query':<28}{LATENCY_HEADER}")
+    for name, hist in res["samples"].items():
+        merge_into(HISTOGRAMS, f"{label}/{name}", hist)
+        if not hist.total_count:
+            log(f"  {name:<28}{0:>7}  errors = {res['errors'][name]}")
+            continue
+        log(f"  {name:<28}{latency_row(hist)}")
+
+    log("\n  Backlog (sent - completed) over time:")
+    for t, outstanding in res["backlog"]:
+        log(f"    t = {t:6.1f} s  backlog = {outstanding}")
+    log("-" * 40)
+
+
+def drop_page_cache(command: str) -> bool:
+    """Page cache сбрасывается на хосте сервера, поэтому команду задаёт пользователь."""
+    if not command:
+        return False
+    return subprocess.run(command, shell=True, capture_output=True).returncode == 0
+
+
+def prepare_cache_state(state: str, page_cache_cmd: str) -> bool:
+    """Готовит кэши перед итерацией; возвращает, удалось ли сбросить page cache."""
+    if state == "cold":
+        client.execute("SYSTEM DROP MARK CACHE")
+    if state in ("cold", "mark-cache"):
+        client.execute("SYSTEM DROP UNCOMPRESSED CACHE")
+        client.execute("SYSTEM DROP QUERY CACHE")
+        return drop_page_cache(page_cache_cmd)
+    return False
+
+
+def run_cache_matrix(queries: dict, iterations: int, states, page_cache_cmd: str) -> None:
+    log(f"\n=== Cache matrix: {', '.join(states)} ===")
+    if not page_cache_cmd:
+        log("  page cache is NOT dropped (no --drop-page-cache-cmd), cold reads may hit OS cache")
+    log(f"  {'query':<28}{'state':<13}{LATENCY_HEADER}")
+    results = {}
+
+    for name, scenario in queries.items():
+        for state in states:
+            settings = query_settings(scenario, {"use_query_cache": 1 if state == "query-cache" else 0})
+            if state == "query-cache":
+                client.execute("SYSTEM DROP QUERY CACHE")
+            if state != "cold":
+                # прогрев: для mark-cache нужны марки, для query-cache - сохранённый ответ
+                client.execute(scenario.render(RNG), settings=settings)
+
+            key = f"cache/{state}/{name}"
+            hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+            page_dropped = 0
+            for _ in range(iterations):
+                page_dropped += prepare_cache_state(state, page_cache_cmd)
+                sql = scenario.render(RNG)
+                t0 = time.perf_counter()
+                client.execute(sql, settings=settings, query_id=make_query_id(RUN_ID, key))
+                hist.record(time.perf_counter() - t0)
+            merge_into(HISTOGRAMS, key, hist)
+            results[(name, state)] = hist
+
+            note = f"  page cache dropped {page_dropped}/{iterations}" if state in ("cold", "mark-cache") else ""
+            log(f"  {name:<28}{state:<13}{latency_row(hist)}{note}")
+
+    log("\n  p50 by cache state (s), ratio to warm:")
+    log(f"  {'query':<28}" + "".join(f"{state:>13}" for state in states))
+    for name in queries:
+        warm = results.get((name, "warm"))
+        cells = []
+        for state in states:
+            p50 = results[(name, state)].value_at_percentile(50)
+            ratio = f" x{p50 / warm.value_at_percentile(50):.1f}" if warm and warm.total_count and state != "warm" else ""
+            cells.append(f"{p50:.4f}{ratio}".rjust(13))
+        log(f"  {name:<28}" + "".join(cells))
     log("-" * 40)
 
 
+def parse_sweep_axis(text: str) -> tuple:
+    """'max_threads=1,2,4' -> ('max_threads', [1, 2, 4])"""
+    name, sep, values = text.partition("=")
+    if not sep or not values:
+        raise argparse.ArgumentTypeError(f"expected setting=v1,v2,..., got {text!r}")
+    return name.strip(), [int(v) if v.strip().lstrip("-").isdigit() else v.strip() for v in values.split(",")]
+
+
+def sweep_points(axes: dict, product: bool) -> list:
+    """Список (подпись оси, значение по оси X, settings) для прогона."""
+    if product:
+        names = list(axes)
+        return [("+".join(names), ",".join(str(v) for v in combo), dict(zip(names, combo)))
+                for combo in itertools.product(*(axes[n] for n in names))]
+    return [(name, value, {name: value}) for name, values in axes.items() for value in values]
+
+
+def settings_label(settings: dict) -> str:
+    return " ".join(f"{k}={v}" for k, v in settings.items())
+
+
+def plot_sweep(axis: str, points: list, queries: dict, results: dict, path: str) -> bool:
+    if plt is None:
+        return False
+    fig, ax = plt.subplots(figsize=(10, 6))
+    xs = [str(x) for _, x, _ in points]
+    for name in queries:
+        hists = [results.get((name, settings_label(st))) for _, _, st in points]
+        p50 = [h.value_at_percentile(50) if h and h.total_count else float("nan") for h in hists]
+        p90 = [h.value_at_percentile(90) if h and h.total_count else float("nan") for h in hists]
+        line, = ax.plot(xs, p50, marker="o", label=name)
+        ax.fill_between(xs, p50, p90, color=line.get_color(), alpha=0.15)
+    ax.set_xlabel(axis)
+    ax.set_ylabel("latency, s (p50, shaded up to p90)")
+    ax.set_yscale("log")
+    ax.grid(True, which="both", alpha=0.3)
+    ax.legend(fontsize="small")
+    ax.set_title(f"Latency vs {axis}")
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+    return True
+
+
+def run_settings_sweep(queries: dict, iterations: int, axes: dict, product: bool, base_name: str) -> None:
+    points = sweep_points(axes, product)
+    log(f"\n=== Settings sweep: {len(points)} points x {len(queries)} queries, {iterations} iterations ===")
+    results = {}
+    rows = []
+
+    for axis, x, settings in points:
+        label = settings_label(settings)
+        log(f"\n--- {label} ---")
+        log(f"  {'query':<28}{LATENCY_HEADER}")
+        for name, scenario in queries.items():
+            key = f"sweep/{label.replace(' ', ',')}/{name}"
+            hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+            merged = query_settings(scenario, settings)
+            try:
+                client.execute(scenario.render(RNG), settings=merged)   # прогрев с теми же настройками
+                for _ in range(iterations):
+                    sql = scenario.render(RNG)
+                    t0 = time.perf_counter()
+                    client.execute(sql, settings=merged, query_id=make_query_id(RUN_ID, key))
+                    hist.record(time.perf_counter() - t0)
+            except Exception as e:
+                log(f"  {name:<28}  error: {str(e).splitlines()[0]}")
+                continue
+            merge_into(HISTOGRAMS, key, hist)
+            results[(name, label)] = hist
+            log(f"  {name:<28}{latency_row(hist)}")
+            rows.append({"axis": axis, "value": x, "settings": label, "query": name,
+                         **{k: round(v, 6) if isinstance(v, float) else v for k, v in hist.summary().items()}})
+
+    # Сводка: p50 по точкам, отдельная таблица и график на каждую ось
+    axis_groups = {}
+    for point in points:
+        axis_groups.setdefault(point[0], []).append(point)
+    for axis, group in axis_groups.items():
+        log(f"\n  p50 (s) vs {axis}:")
+        log(f"  {'query':<28}" + "".join(f"{str(x):>20}" for _, x, _ in group))
+        for name in queries:
+            cells = []
+            for _, _, settings in group:
+                hist = results.get((name, settings_label(settings)))
+                cells.append(f"{hist.value_at_percentile(50):>20.4f}" if hist else f"{'error':>20}")
+            log(f"  {name:<28}" + "".join(cells))
+        png = f"{base_name}_sweep_{axis}.png"
+        if plot_sweep(axis, group, queries, results, png):
+            log(f"  plot: {png}")
+            if DOC is not None:
+                DOC.add_picture(png)
+
+    csv_path = base_name + "_sweep.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["axis", "value", "settings", "query", "count", "min", "mean",
+                                               "p50", "p90", "p99", "p99.9", "max"])
+        writer.writeheader()
+        writer.writerows(rows)
+    log(f"\n  sweep table saved to: {csv_path}" + ("" if plt is not None else " (matplotlib not installed, no plots)"))
+    log("-" * 40)
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса; без psutil - пиковый RSS из getrusage (Linux, KiB)."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+
+def stream_query(sql: str, settings: dict, query_id: str) -> dict:
+    """execute_iter: строки считаются и сразу выбрасываются, память не растёт с результатом."""
+    base_rss = peak_rss = rss_bytes()
+    rows = 0
+    first_row = None
+    t0 = time.perf_counter()
+    for _ in client.execute_iter(sql, settings=settings, query_id=query_id):
+        if first_row is None:
+            first_row = time.perf_counter() - t0
+        rows += 1
+        if rows % RSS_SAMPLE_ROWS == 0:
+            peak_rss = max(peak_rss, rss_bytes())
+    total = time.perf_counter() - t0
+    peak_rss = max(peak_rss, rss_bytes())
+    return {"first_row": first_row if first_row is not None else total, "total": total,
+            "rows": rows, "rss_delta": peak_rss - base_rss}
+
+
+def materialize_query(sql: str, settings: dict, query_id: str) -> dict:
+    """Обычный execute: весь результат собирается в список кортежей."""
+    base_rss = rss_bytes()
+    t0 = time.perf_counter()
+    result = client.execute(sql, settings=settings, query_id=query_id)
+    total = time.perf_counter() - t0
+    rss_delta = rss_bytes() - base_rss
+    rows = len(result)
+    del result
+    return {"first_row": None, "total": total, "rows": rows, "rss_delta": rss_delta}
+
+
+def run_streaming(queries: dict, iterations: int, block_size: int) -> None:
+    log(f"\n=== Streaming vs materialized results (max_block_size = {block_size}) ===")
+    if psutil is None:
+        log("  psutil is not installed: RSS is the process peak from getrusage, deltas are only a lower bound")
+    log(f"  {'query':<28}{'mode':<14}{'rows':>10}{'first_row':>11}{'p50':>9}{'p99':>9}"
+        f"{'rows/s':>12}{'peak_RSS_MB':>13}")
+    for name, scenario in queries.items():
+        settings = query_settings(scenario, {"max_block_size": block_size})
+        client.execute(scenario.render(RNG), settings=settings)
+        for mode, run in (("materialized", materialize_query), ("streaming", stream_query)):
+            key = f"{mode}/{name}"
+            hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+            first_row = LatencyHistogram(max_samples=MAX_SAMPLES)
+            rows = rss = 0
+            for _ in range(iterations):
+                res = run(scenario.render(RNG), settings, make_query_id(RUN_ID, key))
+                hist.record(res["total"])
+                if res["first_row"] is not None:
+                    first_row.record(res["first_row"])
+                rows = res["rows"]
+                rss = max(rss, res["rss_delta"])
+            merge_into(HISTOGRAMS, key, hist)
+
+            p50 = hist.value_at_percentile(50)
+            ttfb = f"{first_row.value_at_percentile(50):>11.4f}" if first_row.total_count else f"{'-':>11}"
+            log(f"  {name:<28}{mode:<14}{rows:>10}{ttfb}{p50:>9.4f}{hist.value_at_percentile(99):>9.4f}"
+                f"{rows / p50 if p50 > 0 else 0:>12.0f}{rss / 2 ** 20:>13.1f}")
+    log("  first_row = время до первого блока (p50), p50/p99 = время до последней строки")
+    log("-" * 40)
+
+
+def fetch_result(variant: str, sql: str, settings: dict, query_id: str):
+    """Результат запроса в одном из клиентских представлений."""
+    if variant == "rows":
+        return client.execute(sql, settings=settings, query_id=query_id)
+    if variant == "columnar":
+        return client.execute(sql, columnar=True, settings=settings, query_id=query_id)
+    if variant == "numpy":
+        return client.execute(sql, columnar=True, settings={**settings, "use_numpy": True}, query_id=query_id)
+    if variant == "dataframe":
+        return client.query_dataframe(sql, settings={**settings, "use_numpy": True}, query_id=query_id)
+    raise ValueError(f"unknown fetch variant {variant!r}")
+
+
+def run_fetch_formats(queries: dict, iterations: int, variants) -> None:
+    """Сравнивает представления результата: задержка клиента минус query_duration_ms сервера.
+
+    Разница - это приём по сети и декодирование в Python, то есть цена, которую
+    платит клиент за выбранный формат результата.
+    """
+    log(f"\n=== Result decoding: {', '.join(variants)} ===")
+    since = datetime.datetime.now()
+    client_times = {}   # query_id -> (key, секунды на клиенте)
+    rss = {}
+
+    for name, scenario in queries.items():
+        settings = query_settings(scenario)
+        client.execute(scenario.render(RNG), settings=settings)
+        for variant in variants:
+            key = f"fetch/{variant}/{name}"
+            hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+            try:
+                fetch_result(variant, scenario.render(RNG), settings, None)
+                for _ in range(iterations):
+                    sql = scenario.render(RNG)
+                    query_id = make_query_id(RUN_ID, key)
+                    base_rss = rss_bytes()
+                    t0 = time.perf_counter()
+                    result = fetch_result(variant, sql, settings, query_id)
+                    dt = time.perf_counter() - t0
+                    rss[key] = max(rss.get(key, 0), rss_bytes() - base_rss)
+                    del result
+                    hist.record(dt)
+                    client_times[query_id] = (key, dt)
+            except ImportError as e:
+                log(f"  {name} / {variant}: skipped, {e}")
+                continue
+            merge_into(HISTOGRAMS, key, hist)
+
+    try:
+        rows = fetch_query_costs(client, RUN_ID, since, len(client_times))
+    except Exception as e:
+        log(f"  server time unavailable (system.query_log): {e}")
+        rows = []
+    server_times = {r["query_id"]: r["query_duration_ms"] / 1000.0 for r in rows if r["type"] == "QueryFinish"}
+
+    decode = {}
+    for query_id, (key, dt) in client_times.items():
+        if query_id in server_times:
+            decode.setdefault(key, LatencyHistogram(max_samples=MAX_SAMPLES)).record(max(dt - server_times[query_id], 0.0))
+
+    log(f"  {'query':<28}{'variant':<11}{'client_p50':>11}{'server_avg':>11}{'decode_p50':>11}"
+        f"{'decode_p99':>11}{'decode_%':>9}{'RSS_MB':>9}")
+    for name in queries:
+        for variant in variants:
+            key = f"fetch/{variant}/{name}"
+            hist = HISTOGRAMS.get(key)
+            if hist is None:
+                continue
+            matched = [server_times[q] for q, (k, _) in client_times.items() if k == key and q in server_times]
+            d = decode.get(key)
+            if not matched or d is None:
+                log(f"  {name:<28}{variant:<11}{hist.value_at_percentile(50):>11.4f}{'-':>11}")
+                continue
+            server = sum(matched) / len(matched)
+            log(f"  {name:<28}{variant:<11}{hist.value_at_percentile(50):>11.4f}{server:>11.4f}"
+                f"{d.value_at_percentile(50):>11.4f}{d.value_at_percentile(99):>11.4f}"
+                f"{100.0 * d.mean / hist.mean if hist.mean else 0:>9.1f}{rss.get(key, 0) / 2 ** 20:>9.1f}")
+    log("  decode = задержка клиента - query_duration_ms: сеть + десериализация в Python")
+    log("-" * 40)
+
+
+def compression_client(codec: str, block_size: int) -> Client:
+    if codec == "none":
+        return make_client(compression=False)
+    return make_client(compression=codec, compress_block_size=block_size)
+
+
+def run_compression(queries: dict, iterations: int, codecs, block_sizes, insert_rows: int) -> None:
+    """Одни и те же запросы и вставки через разные кодеки сжатия нативного протокола.
+
+    Байты на проводе берутся из ProfileEvents NetworkSendBytes/NetworkReceiveBytes
+    (сервер считает уже сжатые байты), CPU клиента - process_time вокруг execute.
+    """
+    log(f"\n=== Wire compression: {', '.join(codecs)}, block sizes {block_sizes} ===")
+    since = datetime.datetime.now()
+    cpu = {}
+
+    # Пачка для вставок читается один раз и отправляется во временную таблицу сессии
+    payload = client.execute(f"SELECT * FROM raw_events LIMIT {int(insert_rows)}") if insert_rows else []
+    workloads = dict(queries)
+    if payload:
+        workloads["insert_raw_events"] = None
+
+    points = [(codec, size) for codec in codecs for size in (block_sizes if codec != "none" else [0])]
+    for codec, size in points:
+        try:
+            conn = compression_client(codec, size)
+            conn.execute("SELECT 1")
+        except Exception as e:
+            log(f"  {codec}: skipped, {e}")
+            continue
+        if payload:
+            conn.execute("CREATE TEMPORARY TABLE IF NOT EXISTS bench_compression_insert AS raw_events ENGINE = Memory")
+
+        for name, scenario in workloads.items():
+            key = f"compression/{codec}" + (f"-{size // 1024}k" if size else "") + f"/{name}"
+            hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+            cpu_total = 0.0
+            for i in range(iterations + 1):
+                query_id = make_query_id(RUN_ID, key) if i else None   # первая итерация - прогрев
+                sql = scenario.render(RNG) if scenario is not None else None
+                c0 = time.process_time()
+                t0 = time.perf_counter()
+                if sql is None:
+                    conn.execute("INSERT INTO bench_compression_insert VALUES", payload, query_id=query_id)
+                else:
+                    conn.execute(sql, settings=query_settings(scenario), query_id=query_id)
+                dt, dc = time.perf_counter() - t0, time.process_time() - c0
+                if sql is None:
+                    conn.execute("TRUNCATE TABLE bench_compression_insert")
+                if i:
+                    hist.record(dt)
+                    cpu_total += dc
+            merge_into(HISTOGRAMS, key, hist)
+            cpu[key] = cpu_total / iterations if iterations else 0.0
+        conn.disconnect()
+
+    try:
+        costs = summarize_costs(fetch_query_costs(client, RUN_ID, since))
+    except Exception as e:
+        log(f"  wire bytes unavailable (system.query_log): {e}")
+        costs = {}
+
+    log(f"  {'workload':<28}{'codec':<12}{'p50':>9}{'p99':>9}{'client_cpu_ms':>15}"
+        f"{'sent_KB':>11}{'received_KB':>13}")
+    for name in workloads:
+        for codec, size in points:
+            key = f"compression/{codec}" + (f"-{size // 1024}k" if size else "") + f"/{name}"
+            hist = HISTOGRAMS.get(key)
+            if hist is None:
+                continue
+            c = costs.get(key, {})
+            sent = f"{c['network_send_bytes'] / 1024:>11.1f}" if c else f"{'-':>11}"
+            received = f"{c['network_receive_bytes'] / 1024:>13.1f}" if c else f"{'-':>13}"
+            log(f"  {name:<28}{key.split('/')[1]:<12}{hist.value_at_percentile(50):>9.4f}"
+                f"{hist.value_at_percentile(99):>9.4f}{cpu[key] * 1000:>15.2f}{sent}{received}")
+    log("  sent = сервер -> клиент (результаты), received = клиент -> сервер (вставки)")
+    log("-" * 40)
+
+
+def make_http_session(pool_size: int):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.headers.update({"X-ClickHouse-User": "benchmark", "X-ClickHouse-Key": ""})
+    return session
+
+
+def decode_http_body(fmt: str, body: bytes) -> int:
+    """Разбирает ответ в Python-объекты, возвращает число строк (-1, если декодера нет)."""
+    if fmt == "JSONEachRow":
+        return sum(1 for line in body.splitlines() if line and json.loads(line) is not None)
+    if fmt in ("ArrowStream", "Parquet"):
+        import pyarrow as pa
+        if fmt == "ArrowStream":
+            return pa.ipc.open_stream(body).read_all().num_rows
+        import pyarrow.parquet as pq
+        return pq.read_table(pa.BufferReader(body)).num_rows
+    return -1   # Native / RowBinary: в Python нет готового декодера, меряем только передачу
+
+
+def http_query(session, sql: str, fmt: str, query_id, decode: bool, settings: dict = None) -> tuple:
+    """Один запрос по HTTP (keep-alive соединение из пула сессии): (байт ответа, строк)."""
+    url = f"http://{CLICKHOUSE_HOST}:{CLICKHOUSE_HTTP_PORT}/"
+    params = {**(settings or {}), "database": CLICKHOUSE_DB}   # настройки передаются параметрами URL
+    if query_id:
+        params["query_id"] = query_id
+    body = sql.strip().rstrip(";") + f"\nFORMAT {fmt}"
+    mode, name = split_label(label_of(query_id)) if query_id else (None, None)
+    if query_id:
+        METRICS.begin(mode, name)
+    t0 = time.perf_counter()
+    try:
+        with session.post(url, params=params, data=body.encode("utf-8"), stream=not decode) as resp:
+            if resp.status_code != 200:
+                raise RuntimeError(resp.text.strip().splitlines()[0] if resp.text else f"HTTP {resp.status_code}")
+            if decode:
+                content = resp.content
+                result = len(content), decode_http_body(fmt, content)
+            else:
+                result = sum(len(chunk) for chunk in resp.iter_content(1 << 20)), -1
+    except Exception:
+        if query_id:
+            METRICS.end(mode, name, time.perf_counter() - t0, error=True)
+        raise
+    if query_id:
+        METRICS.end(mode, name, time.perf_counter() - t0)
+    return result
+
+
+def run_http(queries: dict, iterations: int, formats, concurrency: int, decode: bool) -> None:
+    """Нативный протокол против HTTP с keep-alive и разными форматами ответа."""
+    if requests is None:
+        raise SystemExit("--mode http requires the requests package: pip install requests")
+    log(f"\n=== Native vs HTTP ({', '.join(formats)}), concurrency {concurrency}"
+        + (", client-side decode" if decode else ", transfer only") + " ===")
+    session = make_http_session(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+    conns = [client] + [make_client() for _ in range(concurrency - 1)]
+    log(f"  {'query':<28}{'interface':<18}{'p50':>9}{'p99':>9}{'QPS':>9}{'MB/s':>9}{'resp_KB':>10}{'cpu_ms':>9}")
+
+    for name, scenario in queries.items():
+        settings = query_settings(scenario)
+        variants = [("native-tcp", None)] + [(f"http-{fmt}", fmt) for fmt in formats]
+        for variant, fmt in variants:
+            key = f"interface/{variant}/{name}"
+            hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+            sizes = []
+            lock = threading.Lock()
+
+            def one(i: int) -> None:
+                query_id = make_query_id(RUN_ID, key)
+                with lock:
+                    sql = scenario.render(RNG)   # Random общий для потоков
+                t0 = time.perf_counter()
+                if fmt is None:
+                    conns[i % concurrency].execute(sql, settings=settings, query_id=query_id)
+                else:
+                    sizes.append(http_query(session, sql, fmt, query_id, decode, settings)[0])
+                dt = time.perf_counter() - t0
+                with lock:
+                    hist.record(dt)
+
+            try:
+                if fmt is None:
+                    client.execute(scenario.render(RNG), settings=settings)
+                else:
+                    http_query(session, scenario.render(RNG), fmt, None, decode, settings)   # прогрев и открытие соединения
+                c0 = time.process_time()
+                w0 = time.perf_counter()
+                if executor is None:
+                    for i in range(iterations):
+                        one(i)
+                else:
+                    # нативный Client не потокобезопасен: по соединению на поток, остаток
+                    # iterations % concurrency - по одному первым потокам
+                    if fmt is None:
+                        list(executor.map(lambda c: [one(c) for _ in range(iterations // concurrency
+                                                                          + (c < iterations % concurrency))],
+                                          range(concurrency)))
+                    else:
+                        list(executor.map(one, range(iterations)))
+                wall = time.perf_counter() - w0
+                cpu = time.process_time() - c0
+            except Exception as e:
+                log(f"  {name:<28}{variant:<18}  error: {str(e).splitlines()[0]}")
+                continue
+
+            merge_into(HISTOGRAMS, key, hist)
+            qps = hist.total_count / wall if wall > 0 else 0.0
+            resp = sum(sizes) / len(sizes) if sizes else 0
+            mbps = f"{sum(sizes) / wall / 2 ** 20:>9.1f}" if sizes and wall > 0 else f"{'-':>9}"
+            resp_kb = f"{resp / 1024:>10.1f}" if sizes else f"{'-':>10}"
+            log(f"  {name:<28}{variant:<18}{hist.value_at_percentile(50):>9.4f}{hist.value_at_percentile(99):>9.4f}"
+                f"{qps:>9.1f}{mbps}{resp_kb}{cpu * 1000 / max(hist.total_count, 1):>9.2f}")
+
+    if executor is not None:
+        executor.shutdown()
+    for conn in conns[1:]:
+        conn.disconnect()
+    session.close()
+    log("  cpu_ms = CPU клиента на запрос; для native-tcp всегда с декодированием в кортежи")
+    log("-" * 40)
+
+
+def run_mv_ingest(catalog_sizes, variants, events: int, batch: int) -> None:
+    """Скорость вставки событий в зависимости от обогащения в offer_events_mv.
+
+    Для каждого размера каталога одни и те же пачки событий вставляются в копию
+    raw_events без MV, с MV на INNER JOIN и с MV на dictGet (см. ingest.py);
+    JOIN строит хэш-таблицу каталога на каждую пачку, словарь - один раз.
+    """
+    log(f"\n=== MV ingestion: {events} events in batches of {batch}, catalog sizes {catalog_sizes} ===")
+    insert_sql = f"INSERT INTO {EVENTS_TABLE} ({', '.join(EVENT_COLUMNS)}) VALUES"
+    results = []
+    try:
+        for size in catalog_sizes:
+            create_catalog(client, size)
+            batches = event_batches(RNG, events, batch, size)
+            for variant in variants:
+                try:
+                    info = create_variant(client, variant, CLICKHOUSE_DB, "benchmark", "")
+                except Exception as e:
+                    log(f"  {variant}, catalog {size}: skipped, {e}")
+                    continue
+                key = f"mv-ingest/{variant}-{size}/insert_raw_events"
+                hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+                elapsed = 0.0
+                for columns in batches:
+                    t0 = time.perf_counter()
+                    client.execute(insert_sql, columns, columnar=True, query_id=make_query_id(RUN_ID, key))
+                    dt = time.perf_counter() - t0
+                    hist.record(dt)
+                    elapsed += dt
+                merge_into(HISTOGRAMS, key, hist)
+                results.append({
+                    "size": size, "variant": variant, "hist": hist,
+                    "rate": events / elapsed if elapsed else 0.0,
+                    "mv_events": mv_events(client) if variant != "none" else None,
+                    "dict_mb": info["bytes"] / 2 ** 20 if info else None,
+                })
+    finally:
+        drop_scratch(client)
+
+    log(f"  {'catalog':>9}  {'variant':<8}{'events/s':>12}{'vs none':>9}{'batch_p50':>11}{'batch_p99':>11}"
+        f"{'mv_events':>11}{'dict_MB':>9}")
+    for r in results:
+        base = next((x["rate"] for x in results if x["size"] == r["size"] and x["variant"] == "none"), None)
+        ratio = f"{r['rate'] / base:>8.2f}x" if base else f"{'-':>9}"
+        mv = f"{r['mv_events']:>11}" if r["mv_events"] is not None else f"{'-':>11}"
+        dict_mb = f"{r['dict_mb']:>9.1f}" if r["dict_mb"] is not None else f"{'-':>9}"
+        log(f"  {r['size']:>9}  {r['variant']:<8}{r['rate']:>12,.0f}{ratio}"
+            f"{r['hist'].value_at_percentile(50) * 1000:>11.2f}{r['hist'].value_at_percentile(99) * 1000:>11.2f}"
+            f"{mv}{dict_mb}")
+    log("  batch_p50/p99 - мс на пачку; mv_events у join и dict должны совпадать")
+    log("-" * 40)
+
+
+def insert_point_label(point: dict) -> str:
+    return (f"{point['format']}-b{point['batch']}-{point['compression']}-{point['async']}"
+            f"-pvp{point['parallel_view_processing']}-mv_{point['mvs']}")
+
+
+def insert_point_settings(point: dict) -> dict:
+    settings = {"parallel_view_processing": int(point["parallel_view_processing"])}
+    if point["async"] != "off":
+        settings.update(async_insert=1, wait_for_async_insert=int(point["async"] == "wait"))
+    return settings
+
+
+def point_mvs(value: str) -> list:
+    if value == "none":
+        return []
+    if value == "all":
+        return list(RAW_EVENTS_MVS)
+    return value.split("+")
+
+
+def http_insert(session, fmt: str, body: bytes, encoding, settings: dict, query_id: str) -> None:
+    """INSERT INTO bench_ingest_events FORMAT fmt по HTTP; тело уже закодировано и сжато."""
+    params = {**settings, "database": CLICKHOUSE_DB, "query_id": query_id,
+              "query": f"INSERT INTO {EVENTS_TABLE} ({', '.join(EVENT_COLUMNS)}) FORMAT {fmt}"}
+    headers = {"Content-Encoding": encoding} if encoding else {}
+    resp = session.post(f"http://{CLICKHOUSE_HOST}:{CLICKHOUSE_HTTP_PORT}/", params=params, data=body, headers=headers)
+    if resp.status_code != 200:
+        raise RuntimeError(resp.text.strip().splitlines()[0] if resp.text else f"HTTP {resp.status_code}")
+
+
+def wait_async_inserts(expected: int) -> None:
+    """Ждёт, пока буфер async_insert сбросится и в таблице будет expected строк."""
+    try:
+        client.execute("SYSTEM FLUSH ASYNC INSERT QUEUE")
+    except Exception:
+        pass   # старый сервер или нет права - ждём по count()
+    deadline = time.monotonic() + ASYNC_FLUSH_TIMEOUT
+    while client.execute(f"SELECT count() FROM {EVENTS_TABLE}")[0][0] < expected:
+        if time.monotonic() >= deadline:
+            log(f"  WARNING: async inserts not visible after {ASYNC_FLUSH_TIMEOUT:.0f} s")
+            return
+        time.sleep(0.05)
+
+
+def run_insert_sweep(axes: dict, product: bool, events: int, max_inserts: int) -> None:
+    """Скорость вставки событий по формату, размеру пачки, сжатию, async_insert,
+    parallel_view_processing и набору MV.
+
+    Точки - как в settings-sweep: каждая ось отдельно от INSERT_BASELINE или
+    (--sweep-product) все сочетания. Для каждой точки заново создаются копия
+    raw_events и выбранные MV (см. ingest.py), вставляются одни и те же
+    сгенерированные события, после прогона снимаются парты и слияния копий.
+    Скорость - от первой вставки до момента, когда строки видны в таблице
+    (для async_insert без ожидания - после сброса буфера).
+    """
+    if product:
+        points = [dict(INSERT_BASELINE, **combo) for _, _, combo in sweep_points(axes, True)]
+    else:
+        points = [dict(INSERT_BASELINE, **{name: value}) for name, values in axes.items() for value in values]
+    unique = list({insert_point_label(p): p for p in points}.values())
+    sizes = [min(max(events, p["batch"]), p["batch"] * max_inserts) for p in unique]
+    log(f"\n=== Insert sweep: {len(unique)} points, up to {max(sizes)} events per point ===")
+    pool = event_batches(RNG, max(sizes), max(sizes), CATALOG_SIZES[1])[0]
+    session = make_http_session(1) if requests is not None else None
+    results = {}
+    try:
+        for point, size in zip(unique, sizes):
+            label = insert_point_label(point)
+            fmt, batch, codec = point["format"], point["batch"], point["compression"]
+            if fmt != "Native" and session is None:
+                log(f"  {label}: skipped, HTTP formats require the requests package")
+                continue
+            try:
+                attach_live_mvs(client, CLICKHOUSE_DB, point_mvs(point["mvs"]))
+                conn = compression_client(codec, COMPRESS_BLOCK_SIZES[1]) if fmt == "Native" else None
+                slices = [[col[start:start + batch] for col in pool] for start in range(0, size, batch)]
+                if fmt != "Native":
+                    slices = [compress_body(encode_rows(fmt, columns), codec) for columns in slices]
+            except Exception as e:
+                log(f"  {label}: skipped, {str(e).splitlines()[0]}")
+                continue
+            settings = insert_point_settings(point)
+            key = f"insert-sweep/{label}/insert_raw_events"
+            insert_sql = f"INSERT INTO {EVENTS_TABLE} ({', '.join(EVENT_COLUMNS)}) VALUES"
+            hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+            t_start = time.perf_counter()
+            try:
+                for payload in slices:
+                    query_id = make_query_id(RUN_ID, key)
+                    t0 = time.perf_counter()
+                    if conn is not None:
+                        conn.execute(insert_sql, payload, columnar=True, settings=settings, query_id=query_id)
+                    else:
+                        http_insert(session, fmt, payload[0], payload[1], settings, query_id)
+                    hist.record(time.perf_counter() - t0)
+                if point["async"] != "off":
+                    wait_async_inserts(size)
+            except Exception as e:
+                log(f"  {label}: failed, {str(e).splitlines()[0]}")
+                continue
+            finally:
+                if conn is not None:
+                    conn.disconnect()
+            elapsed = time.perf_counter() - t_start
+            merge_into(HISTOGRAMS, key, hist)
+            results[label] = {"point": point, "rows": size, "inserts": len(slices), "hist": hist,
+                              "rate": size / elapsed if elapsed else 0.0, "state": ingest_state(client)}
+    finally:
+        drop_scratch(client)
+
+    log(f"  {'point':<52}{'rows':>9}{'inserts':>8}{'rows/s':>12}{'p50_ms':>9}{'p99_ms':>9}"
+        f"{'parts':>7}{'all_parts':>10}{'active':>8}{'merges':>8}")
+    groups = [("+".join(axes), points)] if product else \
+        [(name, [dict(INSERT_BASELINE, **{name: v}) for v in values]) for name, values in axes.items()]
+    for name, group in groups:
+        log(f"  -- {name}")
+        for point in group:
+            r = results.get(insert_point_label(point))
+            if r is None:
+                continue
+            st = r["state"]
+            log(f"  {insert_point_label(point):<52}{r['rows']:>9}{r['inserts']:>8}{r['rate']:>12,.0f}"
+                f"{r['hist'].value_at_percentile(50) * 1000:>9.2f}{r['hist'].value_at_percentile(99) * 1000:>9.2f}"
+                f"{st['events_parts']:>7}{st['all_parts']:>10}{st['all_active']:>8}{st['merges']:>8}")
+    log("  parts - вставленные парты bench_ingest_events, all_parts - вместе с таблицами MV, "
+        "active/merges - активные парты и слияния сразу после прогона")
+
+    # Цена MV: лишнее время на строку относительно вставки без MV при прочих равных
+    base = results.get(insert_point_label(dict(INSERT_BASELINE, mvs="none")))
+    if base and base["rate"]:
+        log("\n  MV cost per row vs mvs=none:")
+        for value in axes.get("mvs", []):
+            r = results.get(insert_point_label(dict(INSERT_BASELINE, mvs=value)))
+            if value == "none" or r is None or not r["rate"]:
+                continue
+            extra_us = 1e6 / r["rate"] - 1e6 / base["rate"]
+            log(f"  {value:<40}{extra_us:>+10.2f} us/row{base['rate'] / r['rate'] - 1:>+9.0%}")
+    log("-" * 40)
+
+
+def run_ttl_tiers(tiers, detail_days: int, retention_days: int, source_days: int, iterations: int) -> None:
+    """Размер событий и задержки агрегатных запросов по ступеням хранения.
+
+    Ступени TTL включаются по очереди на таблице bench_ttl_events (см. ttl_tiers.py);
+    после каждой - байты на диске из system.parts и p50 запросов, которые
+    читают старые события только агрегатами. Суммы событий по сохранившимся
+    дням сверяются с первой ступенью: свёртка не должна терять события.
+    """
+    log(f"\n=== TTL tiers: detail {detail_days} d, retention {retention_days} d, {iterations} runs per query ===")
+    results = []
+    try:
+        rows, last_hour = create_copy(client, source_days)
+        lag = data_lag_days(last_hour)
+        log(f"  {rows} events copied, last hour {last_hour}; TTL intervals shifted by {lag} d")
+        queries = tier_queries(detail_days)
+        baseline = None
+        for tier in tiers:
+            t0 = time.perf_counter()
+            apply_tier(client, tier, detail_days + lag, retention_days + lag)
+            applied = time.perf_counter() - t0
+            daily = daily_events(client)
+            if baseline is None:
+                baseline = daily
+            mismatched = sum(1 for day, cnt in daily.items() if baseline.get(day) != cnt)
+            p50 = {}
+            for name, sql in queries.items():
+                key = f"ttl-tiers/{tier}/{name}"
+                client.execute(sql)
+                hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+                for _ in range(iterations):
+                    t0 = time.perf_counter()
+                    client.execute(sql, query_id=make_query_id(RUN_ID, key))
+                    hist.record(time.perf_counter() - t0)
+                merge_into(HISTOGRAMS, key, hist)
+                p50[name] = hist.value_at_percentile(50)
+            results.append({"tier": tier, "storage": copy_storage(client), "days": len(daily),
+                            "events": sum(daily.values()), "mismatched": mismatched, "applied": applied, "p50": p50})
+    finally:
+        drop_copy(client)
+
+    if not results:
+        return
+    base = results[0]
+    log(f"  {'tier':<8}{'days':>6}{'rows':>12}{'parts':>7}{'disk_MB':>10}{'vs ' + base['tier']:>11}"
+        f"{'events':>12}{'apply_s':>9}")
+    for r in results:
+        st = r["storage"]
+        ratio = st["bytes_on_disk"] / base["storage"]["bytes_on_disk"] if base["storage"]["bytes_on_disk"] else 0.0
+        log(f"  {r['tier']:<8}{r['days']:>6}{st['rows']:>12}{st['parts']:>7}{st['bytes_on_disk'] / 2 ** 20:>10.1f}"
+            f"{ratio:>10.2f}x{r['events']:>12}{r['applied']:>9.1f}")
+    log("\n  p50, ms:")
+    log(f"  {'query':<18}" + "".join(f"{r['tier']:>10}" for r in results))
+    for name in base["p50"]:
+        log(f"  {name:<18}" + "".join(f"{r['p50'][name] * 1000:>10.2f}" for r in results))
+    for r in results[1:]:
+        if r["mismatched"]:
+            log(f"  WARNING: {r['tier']}: sum(EventCount) changed for {r['mismatched']} kept days")
+    log("  events - sum(EventCount); у rollup совпадает с detail, delete теряет только удалённые дни")
+    log("-" * 40)
+
+
+def run_profile(queries: dict, iterations: int, trace_types, period_ns: int, base_name: str) -> None:
+    """Запросы под query profiler, по каждому - collapsed stacks и SVG flame graph.
+
+    Задержки этого режима включают накладные расходы профайлера и не
+    сравниваются с обычными прогонами.
+    """
+    log(f"\n=== Query profiler: {', '.join(trace_types)} every {period_ns / 1e6:g} ms, "
+        f"{iterations} runs per query ===")
+    since = datetime.datetime.now()
+    out_dir = base_name + "_profile"
+    os.makedirs(out_dir, exist_ok=True)
+
+    for name, scenario in queries.items():
+        key = f"profile/{name}"
+        settings = query_settings(scenario, profiler_settings(trace_types, period_ns))
+        client.execute(scenario.render(RNG), settings=query_settings(scenario))   # прогрев без профайлера
+        hist = LatencyHistogram(max_samples=MAX_SAMPLES)
+        for _ in range(iterations):
+            sql = scenario.render(RNG)
+            t0 = time.perf_counter()
+            client.execute(sql, settings=settings, query_id=make_query_id(RUN_ID, key))
+            hist.record(time.perf_counter() - t0)
+        merge_into(HISTOGRAMS, key, hist)
+
+    try:
+        stacks = fetch_stacks(client, RUN_ID, since, trace_types)
+    except Exception as e:
+        log(f"  stack samples unavailable (system.trace_log, INTROSPECTION grant): {str(e).splitlines()[0]}")
+        return
+
+    for name in queries:
+        hist = HISTOGRAMS[f"profile/{name}"]
+        for trace_type in trace_types:
+            samples = stacks.get((f"profile/{name}", trace_type))
+            if not samples:
+                log(f"\n  {name} [{trace_type}]: no samples (p50 {hist.value_at_percentile(50):.4f} s "
+                    f"is close to the sampling period?)")
+                continue
+            path = os.path.join(out_dir, f"{name}_{trace_type}")
+            write_folded(path + ".folded", samples)
+            total = sum(samples.values())
+            write_svg(path + ".svg", samples, f"{name}: {trace_type} time, {total} samples, "
+                                              f"{iterations} runs, p50 {hist.value_at_percentile(50):.4f} s")
+            log(f"\n  {name} [{trace_type}]: {total} samples, {len(samples)} unique stacks -> {path}.svg")
+            log("    by phase: " + ", ".join(f"{phase} {share:.0%}" for phase, share in phase_breakdown(samples)))
+            log("    top self time:")
+            for frame, share in top_frames(samples, 8):
+                log(f"    {share:>7.1%}  {frame[:110]}")
+    log(f"\n  collapsed stacks and flame graphs saved to: {out_dir}/")
+    log("-" * 40)
+
+
+def report_server_costs(since: datetime.datetime, path: str) -> None:
+    """Клиентская задержка рядом с серверной стоимостью из system.query_log."""
+    expected = sum(hist.total_count for hist in HISTOGRAMS.values())
+    try:
+        rows = fetch_query_costs(client, RUN_ID, since, expected)
+    except Exception as e:
+        log(f"\nServer-side costs unavailable (system.query_log): {e}")
+        return
+    costs = summarize_costs(rows)
+
+    log(f"\n=== Server-side cost per query (system.query_log, mean per execution) ===")
+    log(f"  run id: {RUN_ID}, {len(rows)} of {expected} executions found")
+    log(f"  {'key':<40}{'client':>9}{'server':>9}{'overhead':>9}{'read_rows':>12}{'read_MB':>9}"
+        f"{'marks':>8}{'mem_MB':>8}{'res_rows':>10}{'cpu_ms':>8}{'sent_KB':>9}")
+    for key, hist in HISTOGRAMS.items():
+        c = costs.get(key)
+        if c is None or not c["count"]:
+            log(f"  {key:<40}{hist.mean:>9.4f}{'-':>9}")
+            continue
+        server = c["query_duration_ms"] / 1000.0
+        cpu_ms = (c["user_time_us"] + c["system_time_us"]) / 1000.0
+        log(f"  {key:<40}{hist.mean:>9.4f}{server:>9.4f}{hist.mean - server:>9.4f}"
+            f"{c['read_rows']:>12.0f}{c['read_bytes'] / 2 ** 20:>9.1f}{c['selected_marks']:>8.0f}"
+            f"{c['memory_usage'] / 2 ** 20:>8.1f}{c['result_rows']:>10.0f}{cpu_ms:>8.1f}"
+            f"{c['network_send_bytes'] / 1024:>9.1f}")
+    log("  overhead = client latency - query_duration_ms: сеть, (де)сериализация и Python")
+    log("-" * 40)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"run_id": RUN_ID, "summary": costs, "executions": rows}, f, indent=2, default=str)
+    log(f"Query log rows saved to: {path}")
+
+
+def store_results(mode: str, started_at: float, queries: dict, options: dict) -> None:
+    """Сырые замеры прогона в bench_results."""
+    try:
+        run = {
+            "run_id": RUN_ID,
+            "run_time": datetime.datetime.fromtimestamp(int(started_at)),
+            "git_revision": git_revision(),
+            "server_version": server_version(client),
+            "settings_hash": settings_hash(client, queries, options),
+            "mode": mode,
+        }
+        written = save_samples(client, run, HISTOGRAMS)
+    except Exception as e:
+        log(f"\nResults not stored in bench_results: {str(e).splitlines()[0]}")
+        return
+    log(f"\nStored {written} samples in bench_results (run {RUN_ID}, git {run['git_revision']}, "
+        f"server {run['server_version']}, settings {run['settings_hash']})")
+    dropped = {key: hist.samples_dropped for key, hist in HISTOGRAMS.items() if hist.samples_dropped}
+    if dropped:
+        log(f"  {sum(dropped.values())} earlier samples of {len(dropped)} keys not stored: "
+            f"only the last {MAX_SAMPLES} per key are kept")
+
+
+def run_compare(baseline: str, candidate: str, method: str, alpha: float, threshold: float,
+                q: float, mode: str = None, started_at: float = None) -> int:
+    """Сравнивает прогон с базовым по каждому ключу; возвращает число регрессий.
+
+    candidate = None - текущий прогон, замеры берутся из памяти.
+    baseline = "latest" - последний сохранённый прогон того же режима.
+    """
+    current = candidate is None
+    candidate = candidate or RUN_ID
+    if baseline == "latest":
+        if mode is None:
+            info = run_info(client, [candidate]).get(candidate)
+            if info is None:
+                raise SystemExit(f"Run {candidate} not found in bench_results")
+            mode, before = info["mode"], info["run_time"]
+        else:
+            before = datetime.datetime.fromtimestamp(int(started_at))
+        baseline = latest_baseline(client, candidate, mode, before)
+        if baseline is None:
+            log(f"\nNo earlier {mode} run in bench_results, nothing to compare with")
+            return 0
+
+    log(f"\n=== Comparison: {candidate} vs baseline {baseline} "
+        f"({method}, alpha = {alpha}, threshold {threshold:.0%}, q = {q}) ===")
+    info = run_info(client, [baseline] + ([] if current else [candidate]))
+    if baseline not in info:
+        raise SystemExit(f"Baseline run {baseline} not found in bench_results")
+    if not current and candidate not in info:
+        raise SystemExit(f"Run {candidate} not found in bench_results")
+    for run_id, label in ((baseline, "baseline"), (candidate, "candidate")):
+        meta = info.get(run_id)
+        if meta:
+            log(f"  {label:<10} {run_id}  {meta['run_time']}  git {meta['git_revision']}  "
+                f"server {meta['server_version']}  settings {meta['settings_hash']}  {meta['samples']} samples")
+        else:
+            log(f"  {label:<10} {run_id}  (this run)")
+    if not current:
+        differs = [f for f in ("server_version", "settings_hash") if info[baseline][f] != info[candidate][f]]
+        if differs:
+            log(f"  WARNING: runs differ in {', '.join(differs)}, the difference may not come from the schema")
+
+    base_samples = load_samples(client, baseline)
+    if current:
+        cand_samples = {key: [v / 1e6 for v in hist.samples] for key, hist in HISTOGRAMS.items()}
+    else:
+        cand_samples = load_samples(client, candidate)
+    rows = compare_samples(base_samples, cand_samples, method, alpha, threshold, q)
+
+    log(f"  {'key':<44}{'n_base':>7}{'n_cand':>7}{'base':>9}{'cand':>9}{'change':>9}  {'evidence':<24}verdict")
+    for row in rows:
+        if "base" not in row:
+            log(f"  {row['key']:<44}{row['n_base']:>7}{row['n_cand']:>7}{'':>27}  {'':<24}{row['verdict']}")
+            continue
+        log(f"  {row['key']:<44}{row['n_base']:>7}{row['n_cand']:>7}{row['base']:>9.4f}{row['cand']:>9.4f}"
+            f"{row['change']:>+9.1%}  {row['evidence']:<24}{row['verdict']}")
+    regressions = sum(1 for row in rows if row["verdict"] == "REGRESSION")
+    log(f"  {regressions} regression(s), {sum(1 for row in rows if row['verdict'] == 'improved')} improvement(s)")
+    log("-" * 40)
+    return regressions
+
+
+def report_merged_histograms(paths) -> None:
+    """Складывает JSON-гистограммы нескольких прогонов/машин по одинаковым ключам."""
+    log(f"\n=== Merged histograms from {len(paths)} file(s) ===")
+    for path in paths:
+        for key, hist in read_json(path).items():
+            merge_into(HISTOGRAMS, key, hist)
+    log(f"  {'key':<44}{LATENCY_HEADER}")
+    for key, hist in HISTOGRAMS.items():
+        log(f"  {key:<44}{latency_row(hist)}")
+    log("-" * 40)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="ClickHouse load test")
+    ap.add_argument("--mode", choices=["sequential", "closed-loop", "open-loop", "cache-matrix",
+                                       "settings-sweep", "streaming", "fetch-formats", "compression", "http",
+                                       "profile", "mv-ingest", "insert-sweep", "ttl-tiers", "check", "compare", "merge"],
+                    default="sequential",
+                    help="sequential: каждый запрос по очереди; closed-loop: N процессов без пауз; "
+                         "open-loop: запросы с заданной частотой прихода; "
+                         "cache-matrix: каждый запрос в холодном/тёплом состоянии кэшей; "
+                         "settings-sweep: задержка в зависимости от настроек ClickHouse; "
+                         "streaming: execute_iter против execute, время до первой строки и память клиента; "
+                         "fetch-formats: строки / columnar / numpy / DataFrame, время декодирования на клиенте; "
+                         "compression: запросы и вставки без сжатия, с lz4 и zstd; "
+                         "http: нативный протокол против HTTP с разными форматами ответа; "
+                         "profile: query profiler, collapsed stacks и flame graph по каждому запросу; "
+                         "mv-ingest: скорость вставки событий без MV, с MV на JOIN и на словаре; "
+                         "insert-sweep: скорость вставки по формату, пачке, сжатию, async_insert и набору MV; "
+                         "ttl-tiers: размер событий и задержки по ступеням TTL (детали, свёртка, удаление); "
+                         "check: выполнить каждый сценарий один раз и сверить отпечаток результата; "
+                         "compare: сравнить --candidate с --baseline из bench_results; "
+                         "merge: сложить гистограммы из --histograms")
+    ap.add_argument("--iterations", type=int, default=ITERATIONS)
+    ap.add_argument("--adaptive", action="store_true",
+                    help="sequential: повторять запрос до сужения CI медианы вместо фиксированного --iterations")
+    ap.add_argument("--ci-width", type=float, default=CI_TARGET_WIDTH,
+                    help="целевая относительная ширина доверительного интервала медианы")
+    ap.add_argument("--confidence", type=float, default=CI_CONFIDENCE)
+    ap.add_argument("--time-budget", type=float, default=QUERY_TIME_BUDGET, help="секунд на один запрос")
+    ap.add_argument("--min-iterations", type=int, default=MIN_STEADY_ITERATIONS,
+                    help="минимум замеров после прогрева")
+    ap.add_argument("--max-iterations", type=int, default=MAX_ITERATIONS)
+    ap.add_argument("--scenarios", default=SCENARIOS_DIR,
+                    help="каталог или файл сценариев (*.toml, *.yaml)")
+    ap.add_argument("--queries", nargs="*", default=None,
+                    help="имена или шаблоны сценариев, например 'raw_*'")
+    ap.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")],
+                    default=CONCURRENCY_LEVELS, help="уровни конкурентности, например 1,2,4,8")
+    ap.add_argument("--duration", type=float, default=SWEEP_DURATION,
+                    help="длительность каждого уровня closed-loop / прогона open-loop, секунд")
+    ap.add_argument("--rate", type=float, default=100.0, help="целевая частота open-loop, запросов в секунду")
+    ap.add_argument("--arrival", choices=["fixed", "poisson"], default="poisson")
+    ap.add_argument("--connections", type=int, default=OPEN_LOOP_CONNECTIONS,
+                    help="размер пула соединений open-loop")
+    ap.add_argument("--seed", type=int, default=42,
+                    help="сид для расписания open-loop, выбора запросов из смеси и значений параметров")
+    ap.add_argument("--cache-states", type=lambda s: s.split(","), default=CACHE_STATES,
+                    help=f"состояния кэшей для cache-matrix, из {','.join(CACHE_STATES)}")
+    ap.add_argument("--drop-page-cache-cmd", default="",
+                    help="команда сброса page cache на хосте сервера, например "
+                         "\"docker exec --privileged clickhouse sh -c 'sync; echo 3 > /proc/sys/vm/drop_caches'\"")
+    ap.add_argument("--sweep", type=parse_sweep_axis, action="append", default=[],
+                    help="ось settings-sweep, например max_threads=1,2,4,8 (можно несколько); "
+                         f"по умолчанию {', '.join(SETTINGS_SWEEPS)}; для insert-sweep - оси "
+                         f"{', '.join(INSERT_SWEEPS)}, например batch=1,1000,1000000")
+    ap.add_argument("--sweep-product", action="store_true",
+                    help="прогонять декартово произведение осей вместо каждой оси по отдельности")
+    ap.add_argument("--stream-block-size", type=int, default=STREAM_BLOCK_SIZE,
+                    help="max_block_size для --mode streaming")
+    ap.add_argument("--fetch-variants", type=lambda s: s.split(","), default=FETCH_VARIANTS,
+                    help=f"представления результата для fetch-formats, из {','.join(FETCH_VARIANTS)}")
+    ap.add_argument("--codecs", type=lambda s: s.split(","), default=COMPRESSION_CODECS,
+                    help=f"кодеки для --mode compression, из {','.join(COMPRESSION_CODECS)}")
+    ap.add_argument("--compress-block-sizes", type=lambda s: [int(x) for x in s.split(",")],
+                    default=COMPRESS_BLOCK_SIZES, help="compress_block_size для lz4/zstd, байт")
+    ap.add_argument("--insert-rows", type=int, default=INSERT_ROWS,
+                    help="строк raw_events в пачке вставки для --mode compression (0 - без вставок)")
+    ap.add_argument("--http-formats", type=lambda s: s.split(","), default=HTTP_FORMATS,
+                    help="форматы ответа для --mode http")
+    ap.add_argument("--http-concurrency", type=int, default=1,
+                    help="параллельных запросов (и keep-alive соединений в пуле) для --mode http")
+    ap.add_argument("--http-decode", action="store_true",
+                    help="разбирать ответ на клиенте (JSONEachRow - json, ArrowStream/Parquet - pyarrow)")
+    ap.add_argument("--profile-types", type=lambda s: s.split(","), default=list(TRACE_TYPES),
+                    help=f"профайлеры для --mode profile, из {','.join(TRACE_TYPES)}")
+    ap.add_argument("--profile-period-ns", type=int, default=PROFILE_PERIOD_NS,
+                    help="период сэмплирования стеков, наносекунд")
+    ap.add_argument("--catalog-sizes", type=lambda s: [int(x) for x in s.split(",")], default=CATALOG_SIZES,
+                    help="размеры каталога для --mode mv-ingest")
+    ap.add_argument("--mv-variants", type=lambda s: s.split(","), default=MV_VARIANTS,
+                    help=f"варианты offer_events_mv для --mode mv-ingest, из {','.join(MV_VARIANTS)}")
+    ap.add_argument("--ingest-events", type=int, default=INGEST_EVENTS,
+                    help="событий на каждый вариант --mode mv-ingest и точку --mode insert-sweep")
+    ap.add_argument("--max-inserts", type=int, default=MAX_INSERTS,
+                    help="не больше вставок на точку insert-sweep (пачки по 1 строке)")
+    ap.add_argument("--ingest-batch", type=int, default=INGEST_BATCH, help="строк в пачке вставки")
+    ap.add_argument("--ttl-tiers", type=lambda s: s.split(","), default=TIERS,
+                    help=f"ступени для --mode ttl-tiers по порядку, из {','.join(TIERS)}")
+    ap.add_argument("--detail-days", type=int, default=DETAIL_DAYS,
+                    help="сколько дней от последнего часа данных хранить все строки")
+    ap.add_argument("--retention-days", type=int, default=RETENTION_DAYS,
+                    help="через сколько дней удалять свёрнутые строки")
+    ap.add_argument("--ttl-source-days", type=int, default=0,
+                    help="копировать в bench_ttl_events события за последние N дней (0 - все)")
+    ap.add_argument("--no-query-log", action="store_true",
+                    help="не собирать серверную стоимость запросов из system.query_log")
+    ap.add_argument("--histograms", nargs="+", default=[],
+                    help="JSON-файлы гистограмм предыдущих прогонов для --mode merge")
+    ap.add_argument("--metrics-port", type=int, nargs="?", const=METRICS_PORT, default=None,
+                    help=f"отдавать клиентские задержки в формате Prometheus на :PORT/metrics "
+                         f"(по умолчанию {METRICS_PORT})")
+    ap.add_argument("--metrics-linger", type=float, default=0.0,
+                    help="секунд держать /metrics после окончания прогона, чтобы Prometheus снял итог")
+    ap.add_argument("--no-store", action="store_true",
+                    help="не записывать замеры в таблицу bench_results")
+    ap.add_argument("--baseline", default=None,
+                    help="run id базового прогона (или latest): после прогона сравнить с ним и "
+                         "завершиться с кодом 1 при регрессии; для --mode compare обязателен")
+    ap.add_argument("--candidate", default=None, help="run id сравниваемого прогона для --mode compare")
+    ap.add_argument("--compare-method", choices=["mannwhitney", "bootstrap"], default="mannwhitney",
+                    help="mannwhitney: односторонний критерий Манна-Уитни; "
+                         "bootstrap: интервал отношения квантиля --compare-quantile")
+    ap.add_argument("--alpha", type=float, default=COMPARE_ALPHA, help="уровень значимости сравнения")
+    ap.add_argument("--regression-threshold", type=float, default=REGRESSION_THRESHOLD,
+                    help="минимальное относительное замедление, считающееся регрессией")
+    ap.add_argument("--compare-quantile", type=float, default=0.5,
+                    help="сравниваемый квантиль (0.5 - медиана, 0.99 - p99)")
+    args = ap.parse_args()
+    if args.mode == "merge" and not args.histograms:
+        ap.error("--mode merge requires --histograms")
+    if args.mode == "compare" and not (args.baseline and args.candidate):
+        ap.error("--mode compare requires --baseline and --candidate")
+    unknown = set(args.cache_states) - set(CACHE_STATES)
+    if unknown:
+        ap.error(f"unknown cache states: {', '.join(sorted(unknown))}")
+    unknown = set(args.fetch_variants) - set(FETCH_VARIANTS)
+    if unknown:
+        ap.error(f"unknown fetch variants: {', '.join(sorted(unknown))}")
+    unknown = set(args.profile_types) - set(TRACE_TYPES)
+    if unknown:
+        ap.error(f"unknown profile types: {', '.join(sorted(unknown))}")
+    unknown = set(args.codecs) - set(COMPRESSION_CODECS)
+    if unknown:
+        ap.error(f"unknown codecs: {', '.join(sorted(unknown))}")
+    unknown = set(args.mv_variants) - set(MV_VARIANTS)
+    if unknown:
+        ap.error(f"unknown MV variants: {', '.join(sorted(unknown))}")
+    return args
+
 
 def main():
-    global LOG_TXT, DOC
+    global LOG_TXT, DOC, METRICS_QUEUE
+
+    args = parse_args()
+    RNG.seed(args.seed)
+    queries = {}
+    if args.mode not in ("merge", "compare"):
+        try:
+            queries = select_queries(load_scenarios(args.scenarios), args.queries)
+            for scenario in queries.values():
+                scenario.load(client)   # значения generator = "sample" читаются один раз
+        except ScenarioError as e:
+            raise SystemExit(f"Scenario error: {e}")
+    failed = 0
 
     # Имя файлов со штампом времени, чтобы не перезатирать результаты
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -188,20 +1691,110 @@ def main():
 
     log("Starting ClickHouse load test\n")
     log(f"Host: {CLICKHOUSE_HOST}:{CLICKHOUSE_PORT}, database: {CLICKHOUSE_DB}")
-    log(f"Number of iterations per query: {ITERATIONS}\n")
+    log(f"Run id: {RUN_ID}")
+    if args.metrics_port and args.mode not in ("merge", "compare"):
+        start_server(args.metrics_port)
+        METRICS.run_info = {"run_id": RUN_ID, "mode": args.mode}
+        METRICS_QUEUE = mp.get_context("spawn").Queue()
+        collect_snapshots(METRICS, METRICS_QUEUE)
+        log(f"Metrics: http://localhost:{args.metrics_port}/metrics")
+    if queries:
+        log(f"Scenarios: {args.scenarios} ({len(queries)} selected)")
+    started_at = time.time()
+    if args.mode == "sequential" and args.adaptive:
+        log(f"Adaptive iterations: until the {args.confidence:.0%} CI of the median is within "
+            f"{args.ci_width:.1%}, at most {args.time_budget:.0f} s per query\n")
+        for name, scenario in queries.items():
+            run_adaptive_benchmark(name, scenario, args.ci_width, args.confidence, args.time_budget,
+                                   args.min_iterations, args.max_iterations)
+    elif args.mode == "sequential":
+        log(f"Number of iterations per query: {args.iterations}\n")
+
+        # Гоним все запросы
+        for name, scenario in queries.items():
+            run_benchmark(name, scenario, args.iterations)
+    elif args.mode == "closed-loop":
+        log(f"Concurrency levels: {args.concurrency}, {args.duration:.0f} s per level\n")
+        run_concurrency_sweep(queries, args.concurrency, args.duration, args.seed)
+    elif args.mode == "open-loop":
+        log(f"Open-loop: {args.arrival} arrivals, {args.rate:.1f} req/s for {args.duration:.0f} s, "
+            f"{args.connections} connections\n")
+        run_open_loop(queries, args.rate, args.duration, args.arrival, args.connections, args.seed)
+    elif args.mode == "cache-matrix":
+        log(f"Cache matrix: {args.iterations} iterations per query and state\n")
+        run_cache_matrix(queries, args.iterations, args.cache_states, args.drop_page_cache_cmd)
+    elif args.mode == "settings-sweep":
+        axes = dict(args.sweep) if args.sweep else SETTINGS_SWEEPS
+        log(f"Settings sweep: {axes}\n")
+        run_settings_sweep(queries, args.iterations, axes, args.sweep_product, base_name)
+    elif args.mode == "streaming":
+        log(f"Streaming: {args.iterations} iterations per query and fetch mode\n")
+        run_streaming(queries, args.iterations, args.stream_block_size)
+    elif args.mode == "fetch-formats":
+        log(f"Fetch formats: {args.iterations} iterations per query and variant\n")
+        run_fetch_formats(queries, args.iterations, args.fetch_variants)
+    elif args.mode == "compression":
+        log(f"Compression: {args.iterations} iterations per codec and workload\n")
+        run_compression(queries, args.iterations, args.codecs, args.compress_block_sizes, args.insert_rows)
+    elif args.mode == "http":
+        log(f"HTTP: {args.iterations} iterations per query and interface\n")
+        run_http(queries, args.iterations, args.http_formats, args.http_concurrency, args.http_decode)
+    elif args.mode == "profile":
+        log(f"Profile: {args.iterations} runs per query\n")
+        run_profile(queries, args.iterations, args.profile_types, args.profile_period_ns, base_name)
+    elif args.mode == "mv-ingest":
+        log(f"MV ingestion: variants {', '.join(args.mv_variants)}\n")
+        run_mv_ingest(args.catalog_sizes, args.mv_variants, args.ingest_events, args.ingest_batch)
+    elif args.mode == "insert-sweep":
+        axes = dict(args.sweep) if args.sweep else INSERT_SWEEPS
+        unknown = set(axes) - set(INSERT_SWEEPS)
+        if unknown:
+            raise SystemExit(f"Unknown insert-sweep axes: {', '.join(sorted(unknown))}; expected {', '.join(INSERT_SWEEPS)}")
+        log(f"Insert sweep: {axes}\n")
+        run_insert_sweep(axes, args.sweep_product, args.ingest_events, args.max_inserts)
+    elif args.mode == "ttl-tiers":
+        log(f"TTL tiers: {', '.join(args.ttl_tiers)}\n")
+        run_ttl_tiers(args.ttl_tiers, args.detail_days, args.retention_days, args.ttl_source_days, args.iterations)
+    elif args.mode == "check":
+        failed = run_check(queries)
+    elif args.mode == "compare":
+        failed = run_compare(args.baseline, args.candidate, args.compare_method, args.alpha,
+                             args.regression_threshold, args.compare_quantile)
+    elif args.mode == "merge":
+        report_merged_histograms(args.histograms)
+
+    measured = args.mode not in ("merge", "compare")
+    if measured and not args.no_query_log:
+        report_server_costs(datetime.datetime.fromtimestamp(started_at), base_name + "_query_log.json")
+    if measured and not args.no_store and HISTOGRAMS:
+        options = {k: v for k, v in vars(args).items()
+                   if k not in ("baseline", "candidate", "no_store", "no_query_log", "histograms")}
+        store_results(args.mode, started_at, queries, options)
+    if measured and args.baseline:
+        failed += run_compare(args.baseline, None, args.compare_method, args.alpha,
+                              args.regression_threshold, args.compare_quantile, args.mode, started_at)
+
+    # Гистограммы: JSON для слияния и HdrHistogram log для внешних инструментов
+    if HISTOGRAMS:
+        write_json(base_name + "_hist.json", HISTOGRAMS)
+        write_hdr_log(base_name + ".hlog", HISTOGRAMS, started_at, time.time())
+        log(f"\nHistograms saved to: {base_name}_hist.json and {base_name}.hlog")
 
-    # Гоним все запросы
-    for name, sql in QUERIES.items():
-        run_benchmark(name, sql, ITERATIONS)
+    if METRICS.enabled and args.metrics_linger > 0:
+        log(f"\nServing /metrics for another {args.metrics_linger:.0f} s")
+        time.sleep(args.metrics_linger)
 
     # Закрываем txt
     LOG_TXT.close()
+    LOG_TXT = None
 
     # Сохраняем Word, если делали
     if DOC is not None:
         DOC.save(base_name + ".docx")
 
     log(f"\nResults saved to: {base_name}.txt" + (" and .docx" if DOC is not None else ""))
+    if failed:
+        sys.exit(f"{failed} check(s) failed: result mismatch or performance regression")
 
 
 
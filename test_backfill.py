@@ -0,0 +1,162 @@
+"""Offline tests of backfill.py against an in-memory imitation of ClickHouse.
+
+Строки таблиц моделируются множеством исходных партиций, из которых они
+получены: так видно, чьи строки стёр бы REPLACE PARTITION.
+"""
+import argparse
+import re
+import threading
+
+import pytest
+
+import backfill
+
+MV = {
+    "name": "events_monthly_mv",
+    "uuid": "00000000-0000-0000-0000-000000000000",
+    "create_table_query": "CREATE MATERIALIZED VIEW ecom.events_monthly_mv TO ecom.events_monthly AS SELECT ...",
+    "as_select": "SELECT toYYYYMM(Hour) AS month, count() AS events FROM ecom.raw_events GROUP BY month",
+}
+
+
+def table_name(name: str) -> str:
+    return name.split(".")[-1].strip("`")
+
+
+class FakeClickHouse:
+    """raw_events партиционирована по дням, events_monthly - по месяцам: MV не выровнено."""
+
+    def __init__(self, days):
+        self.lock = threading.Lock()
+        self.tables = {"raw_events": {day: {day} for day in days}, "events_monthly": {}}
+        self.checkpoints = []
+
+    def add_day(self, day: str) -> None:
+        self.tables["raw_events"][day] = {day}
+
+    def execute(self, query, params=None, settings=None):
+        with self.lock:
+            return self._execute(query.strip(), params)
+
+    def _execute(self, query, params):
+        if "dependencies_table" in query:
+            return [("ecom", "raw_events")]
+        if query.startswith("DESCRIBE"):
+            return [("month",), ("events",)]
+        if "FROM system.parts" in query:
+            return [(p, p, len(rows)) for p, rows in sorted(self.tables[params["table"]].items())]
+        if f"FROM {backfill.CHECKPOINT_TABLE} FINAL" in query:
+            latest = {p: (p, state, rows, targets) for _, p, state, rows, targets in self.checkpoints}
+            return list(latest.values())
+        if query.startswith(f"INSERT INTO {backfill.CHECKPOINT_TABLE}"):
+            self.checkpoints += params
+            return []
+        if query.startswith(f"ALTER TABLE {backfill.CHECKPOINT_TABLE} DELETE"):
+            self.checkpoints = [c for c in self.checkpoints if c[0] != params["mv"]]
+            return []
+        m = re.match(r"EXISTS TABLE (\S+)", query)
+        if m:
+            return [(int(table_name(m.group(1)) in self.tables),)]
+        m = re.match(r"DROP TABLE IF EXISTS (\S+)", query)
+        if m:
+            self.tables.pop(table_name(m.group(1)), None)
+            return []
+        m = re.match(r"CREATE TABLE (\S+) AS (\S+)", query)
+        if m:
+            self.tables[table_name(m.group(1))] = {}
+            return []
+        m = re.match(r"INSERT INTO (\S+) .* WHERE _partition_id = '(\w+)'", query, re.S)
+        if m:
+            day = m.group(2)
+            self.tables[table_name(m.group(1))].setdefault(day[:6], set()).update(self.tables["raw_events"][day])
+            return []
+        m = re.match(r"SELECT count\(\) FROM (\S+)", query)
+        if m:
+            return [(sum(len(rows) for rows in self.tables[table_name(m.group(1))].values()),)]
+        m = re.match(r"ALTER TABLE (\S+) (ATTACH|REPLACE) PARTITION ID '(\w+)' FROM (\S+)", query)
+        if m:
+            target, source = self.tables[table_name(m.group(1))], self.tables[table_name(m.group(4))]
+            if m.group(2) == "REPLACE":
+                target[m.group(3)] = set()
+            target.setdefault(m.group(3), set()).update(source[m.group(3)])
+            return []
+        raise AssertionError(f"unexpected query: {query}")
+
+
+def run(server, **overrides):
+    args = argparse.Namespace(restart=False, partitions=None, workers=2, threads=1, max_memory=0,
+                              split_by=None, splits=1)
+    vars(args).update(overrides)
+    backfill.Backfill(lambda: server, "ecom", MV, args).run()
+
+
+def states(server) -> dict:
+    return {p: state for _, p, state, _, _ in server.checkpoints}
+
+
+def test_rerun_with_new_partition_restages_done_partitions_of_its_month():
+    server = FakeClickHouse(["20250901", "20250902"])
+    run(server)
+    assert server.tables["events_monthly"] == {"202509": {"20250901", "20250902"}}
+
+    server.add_day("20250903")
+    run(server)
+    assert server.tables["events_monthly"] == {"202509": {"20250901", "20250902", "20250903"}}
+    assert states(server) == {"20250901": "done", "20250902": "done", "20250903": "done"}
+
+
+def test_rerun_after_crash_in_finish_loop_keeps_all_rows(monkeypatch):
+    server = FakeClickHouse(["20250901", "20250902", "20250903"])
+    finish = backfill.Backfill.finish
+    calls = []
+
+    def crash_after_first(self, partition_id):
+        if calls:
+            raise KeyboardInterrupt
+        calls.append(partition_id)
+        finish(self, partition_id)
+
+    monkeypatch.setattr(backfill.Backfill, "finish", crash_after_first)
+    with pytest.raises(KeyboardInterrupt):
+        run(server)
+    monkeypatch.setattr(backfill.Backfill, "finish", finish)
+
+    run(server)
+    assert server.tables["events_monthly"] == {"202509": {"20250901", "20250902", "20250903"}}
+    assert set(states(server).values()) == {"done"}
+
+
+def test_partitions_subset_of_non_aligned_view_is_refused():
+    server = FakeClickHouse(["20250901", "20250902", "20250903"])
+    with pytest.raises(backfill.BackfillError):
+        run(server, partitions=["20250901", "20250902"])
+    assert server.tables["events_monthly"] == {}
+
+
+@pytest.mark.parametrize("as_select", [
+    "SELECT a FROM raw_events WHERE b",
+    "SELECT a FROM ecom.raw_events WHERE b",
+    "SELECT a FROM `ecom`.`raw_events` WHERE b",
+    "SELECT a\nFROM\n    raw_events\nWHERE b",
+])
+def test_replace_source_handles_qualified_and_quoted_names(as_select):
+    assert backfill.replace_source(as_select, "ecom", "raw_events", "(SELECT 1)", "mv").split() == \
+        ["SELECT", "a", "FROM", "(SELECT", "1)", "WHERE", "b"]
+
+
+def test_replace_source_skips_longer_names_and_replaces_only_the_first():
+    sql = "SELECT * FROM raw_events_old JOIN (SELECT * FROM raw_events) USING id FROM raw_events"
+    assert backfill.replace_source(sql, "ecom", "raw_events", "src", "mv") == \
+        "SELECT * FROM raw_events_old JOIN (SELECT * FROM src) USING id FROM raw_events"
+
+
+def test_replace_source_requires_the_source():
+    with pytest.raises(backfill.BackfillError, match="raw_events not found"):
+        backfill.replace_source("SELECT * FROM other.raw_events", "ecom", "raw_events", "src", "mv")
+
+
+def test_mv_target():
+    assert backfill.mv_target(MV) == "events_monthly"
+    inner = {"name": "v", "uuid": "1234-abcd", "create_table_query": "CREATE MATERIALIZED VIEW ecom.v (x UInt8) AS"}
+    assert backfill.mv_target(inner) == ".inner_id.1234-abcd"
+    assert backfill.mv_target({**inner, "uuid": MV["uuid"]}) == ".inner.v"
@@ -0,0 +1,42 @@
+"""Offline tests of bench_results.compare_samples verdicts."""
+import random
+
+import pytest
+
+import bench_results
+from bench_results import compare_samples
+
+
+def runs(shift: float, n: int = 200, seed: int = 1) -> tuple:
+    rng = random.Random(seed)
+    base = [rng.lognormvariate(0, 0.05) for _ in range(n)]
+    cand = [rng.lognormvariate(0, 0.05) * shift for _ in range(n)]
+    return {"q": base}, {"q": cand}
+
+
+@pytest.mark.parametrize("method", ["mannwhitney", "bootstrap"])
+def test_verdicts(method):
+    assert compare_samples(*runs(1.3), method, 0.01, 0.05)[0]["verdict"] == "REGRESSION"
+    assert compare_samples(*runs(0.7), method, 0.01, 0.05)[0]["verdict"] == "improved"
+    assert compare_samples(*runs(1.0), method, 0.01, 0.05)[0]["verdict"] == "ok"
+    # значимо, но меньше порога
+    assert compare_samples(*runs(1.02, n=2000), method, 0.01, 0.05)[0]["verdict"] == "ok"
+
+
+def test_bootstrap_is_a_one_sided_test_at_alpha(monkeypatch):
+    """Как и Манна-Уитни: нижняя граница - alpha-квантиль, т.е. двусторонний интервал 1 - 2 * alpha."""
+    calls = []
+
+    def fake_ci(a, b, q, confidence):
+        calls.append(confidence)
+        return 1.01, 1.2, 1.4
+
+    monkeypatch.setattr(bench_results, "bootstrap_ratio_ci", fake_ci)
+    row = compare_samples({"q": [1.0] * 10}, {"q": [1.2] * 10}, "bootstrap", 0.05, 0.05)[0]
+    assert calls == [pytest.approx(0.90)]
+    assert row["verdict"] == "REGRESSION"
+
+
+def test_missing_keys_are_reported():
+    rows = compare_samples({"a": [1.0]}, {"b": [1.0]}, "mannwhitney", 0.01, 0.05)
+    assert [(r["key"], r["verdict"]) for r in rows] == [("a", "missing in candidate"), ("b", "missing in baseline")]
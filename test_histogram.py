@@ -0,0 +1,139 @@
+"""Offline tests of histogram.py: V2 encoding, percentiles, merging, raw samples."""
+import base64
+import struct
+import zlib
+
+import pytest
+
+from histogram import (V2_COMPRESSED_ENCODING_COOKIE, V2_ENCODING_COOKIE, LatencyHistogram, merge_into,
+                       read_json, write_hdr_log, write_json)
+
+
+def _get_zigzag(buf: bytes, pos: int) -> tuple:
+    # обратное к _put_zigzag: 8 байт по 7 бит, девятый байт целиком
+    value = 0
+    for shift in range(0, 56, 7):
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+    else:
+        value |= buf[pos] << 56
+        pos += 1
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def decode(encoded: str) -> dict:
+    """Разбор base64 V2 compressed, как HistogramLogReader."""
+    blob = base64.b64decode(encoded)
+    cookie, length = struct.unpack(">ii", blob[:8])
+    assert cookie == V2_COMPRESSED_ENCODING_COOKIE
+    assert length == len(blob) - 8
+    raw = zlib.decompress(blob[8:])
+    header_size = struct.calcsize(">iiiiqqd")
+    cookie, payload_len, offset, digits, lowest, highest, ratio = struct.unpack(">iiiiqqd", raw[:header_size])
+    assert cookie == V2_ENCODING_COOKIE
+    payload = raw[header_size:]
+    assert payload_len == len(payload)
+    counts = {}
+    index = pos = 0
+    while pos < len(payload):
+        value, pos = _get_zigzag(payload, pos)
+        if value < 0:
+            index += -value   # серия нулевых корзин
+        else:
+            if value:
+                counts[index] = value
+            index += 1
+    return {"digits": digits, "lowest": lowest, "highest": highest, "ratio": ratio, "counts": counts,
+            "offset": offset}
+
+
+def nonzero(hist: LatencyHistogram) -> dict:
+    return {i: c for i, c in enumerate(hist.counts) if c}
+
+
+def test_v2_round_trip_restores_counts_and_header():
+    hist = LatencyHistogram()
+    for value in [1, 2, 3, 1000, 1000, 2047, 2048, 123456, 10 ** 7, hist.highest_value]:
+        hist.record_us(value)
+    hist.record_us(500, 300)
+
+    decoded = decode(hist.encode())
+    assert decoded["counts"] == nonzero(hist)
+    assert (decoded["digits"], decoded["lowest"], decoded["highest"]) == (3, 1, hist.highest_value)
+    assert decoded["ratio"] == 1.0
+
+
+def test_v2_encodes_counts_that_need_the_ninth_byte():
+    hist = LatencyHistogram()
+    hist.record_us(42, 2 ** 60)
+    hist.record_us(43)
+    assert decode(hist.encode())["counts"] == nonzero(hist)
+
+
+def test_v2_empty_histogram_has_empty_payload():
+    assert decode(LatencyHistogram().encode())["counts"] == {}
+
+
+def test_percentiles_stay_within_precision():
+    hist = LatencyHistogram()
+    for us in range(1, 100001):
+        hist.record_us(us)
+    assert hist.value_at_percentile(50) == pytest.approx(0.05, rel=1e-3)
+    assert hist.value_at_percentile(99.9) == pytest.approx(0.0999, rel=1e-3)
+    assert hist.value_at_percentile(100) == hist.max == 0.1
+    assert hist.min == 1e-6
+
+
+def test_merge_and_json_round_trip(tmp_path):
+    a, b = LatencyHistogram(), LatencyHistogram()
+    for us in (10, 20, 30):
+        a.record_us(us)
+    b.record_us(5000, 2)
+    merged = {}
+    merge_into(merged, "k", a)
+    merge_into(merged, "k", b)
+    assert merged["k"].total_count == 5
+    assert (merged["k"].min_value, merged["k"].max_value) == (10, 5000)
+
+    path = str(tmp_path / "hist.json")
+    write_json(path, merged)
+    restored = read_json(path)["k"]
+    assert nonzero(restored) == nonzero(merged["k"])
+    assert restored.encode() == merged["k"].encode()
+
+
+def test_raw_samples_are_opt_in_bounded_and_not_multiplied():
+    assert not LatencyHistogram().samples
+
+    hist = LatencyHistogram(max_samples=3)
+    for us in range(10):
+        hist.record_us(us)
+    hist.record_us(7, 1000)   # свёрнутые значения не попадают в сырые замеры
+    assert list(hist.samples) == [7, 8, 9]
+    assert hist.samples_dropped == 7
+    assert hist.total_count == 1010
+
+    merged = {}
+    merge_into(merged, "k", hist)
+    merge_into(merged, "k", hist)
+    assert list(merged["k"].samples) == [7, 8, 9]
+    assert merged["k"].samples_dropped == 17
+
+
+def test_hdr_log_interval_max_is_in_the_histogram_unit(tmp_path):
+    hist = LatencyHistogram()
+    for us in [150, 2500, 987654]:
+        hist.record_us(us)
+    path = str(tmp_path / "run.hlog")
+    write_hdr_log(path, {"q 1": hist}, 1700000000.0, 1700000060.0)
+    with open(path, encoding="utf-8") as f:
+        line = f.read().splitlines()[-1]
+    tag, start, length, interval_max, encoded = line.split(",")
+    assert (tag, start, length) == ("Tag=q_1", "1700000000.000", "60.000")
+    decoded = decode(encoded)
+    assert decoded["ratio"] == 1.0
+    top = hist._value_from_index(max(decoded["counts"]))
+    assert top <= float(interval_max) <= hist._highest_equivalent(top)
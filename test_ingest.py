@@ -0,0 +1,119 @@
+"""Offline tests of ingest.py encoders: encode_rows formats and compress_body codecs."""
+import datetime
+import gzip
+import io
+import json
+import random
+import struct
+
+import pytest
+
+from ingest import EVENT_COLUMNS, OFFER_ID_BASE, PROVINCES, compress_body, encode_rows, event_batches
+
+HOURS = [datetime.datetime(2025, 9, 1, 0), datetime.datetime(2025, 9, 7, 23)]
+COLUMNS = [
+    HOURS,
+    ["Smartphone", "TV"],
+    ["Ozon App", "x" * 200],   # длина 200 - два байта LEB128
+    ["Android", "iOS"],
+    ["Москва", "Республика Татарстан"],
+    [OFFER_ID_BASE, 2 ** 64 - 1],
+]
+ROWS = [list(row) for row in zip(*COLUMNS)]
+
+
+def read_row_binary(body: bytes) -> list:
+    rows = []
+    pos = 0
+
+    def string():
+        nonlocal pos
+        n = shift = 0
+        while True:
+            byte = body[pos]
+            pos += 1
+            n |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        pos += n
+        return body[pos - n:pos].decode("utf-8")
+
+    while pos < len(body):
+        (ts,) = struct.unpack_from("<I", body, pos)
+        pos += 4
+        row = [datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None)]
+        row += [string() for _ in range(4)]
+        row.append(struct.unpack_from("<Q", body, pos)[0])
+        pos += 8
+        rows.append(row)
+    return rows
+
+
+def test_row_binary_round_trip():
+    assert read_row_binary(encode_rows("RowBinary", COLUMNS)) == ROWS
+
+
+def test_json_each_row_round_trip():
+    lines = encode_rows("JSONEachRow", COLUMNS).decode("utf-8").splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert [list(r) for r in rows] == [EVENT_COLUMNS] * 2
+    assert rows[0]["Hour"] == "2025-09-01 00:00:00"
+    assert rows[1]["ProvinceName"] == "Республика Татарстан"   # без \u-экранирования
+    assert "Татарстан".encode("utf-8") in encode_rows("JSONEachRow", COLUMNS)
+    assert [[r["DeviceTypeName"], r["ContentUnitID"]] for r in rows] == [["Smartphone", OFFER_ID_BASE],
+                                                                         ["TV", 2 ** 64 - 1]]
+
+
+@pytest.mark.parametrize("fmt", ["Parquet", "Arrow"])
+def test_arrow_formats_round_trip(fmt):
+    pa = pytest.importorskip("pyarrow")
+    body = encode_rows(fmt, COLUMNS)
+    if fmt == "Parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(io.BytesIO(body))
+    else:
+        table = pa.ipc.open_file(pa.BufferReader(body)).read_all()
+    assert table.column_names == EVENT_COLUMNS
+    assert [table.column(c).to_pylist() for c in EVENT_COLUMNS] == COLUMNS
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        encode_rows("CSV", COLUMNS)
+
+
+def test_compress_body():
+    body = encode_rows("JSONEachRow", COLUMNS) * 100
+    assert compress_body(body, "none") == (body, None)
+    compressed, encoding = compress_body(body, "gzip")
+    assert encoding == "gzip"
+    assert gzip.decompress(compressed) == body
+    assert len(compressed) < len(body)
+    with pytest.raises(ValueError):
+        compress_body(body, "brotli")
+
+
+def test_compress_body_lz4():
+    lz4_frame = pytest.importorskip("lz4.frame")
+    compressed, encoding = compress_body(b"abc" * 1000, "lz4")
+    assert encoding == "lz4"
+    assert lz4_frame.decompress(compressed) == b"abc" * 1000
+
+
+def test_compress_body_zstd():
+    zstd = pytest.importorskip("zstd")
+    compressed, encoding = compress_body(b"abc" * 1000, "zstd")
+    assert encoding == "zstd"
+    assert zstd.decompress(compressed) == b"abc" * 1000
+
+
+def test_event_batches_shape_and_catalog_ids():
+    batches = event_batches(random.Random(1), 2500, 1000, 100)
+    assert [len(b[0]) for b in batches] == [1000, 1000, 500]
+    ids = [i for b in batches for i in b[5]]
+    missing = sum(1 for i in ids if i >= OFFER_ID_BASE + 100)
+    assert all(OFFER_ID_BASE <= i < OFFER_ID_BASE + 200 for i in ids)
+    assert 0 < missing < len(ids) * 0.05
+    assert set(batches[0][4]) <= set(PROVINCES)
+    assert event_batches(random.Random(1), 2500, 1000, 100) == batches
@@ -0,0 +1,138 @@
+"""Offline tests of scenarios.py: loading the scenario files and rendering parameters."""
+import hashlib
+import os
+import random
+
+import pytest
+
+from scenarios import PARAM_RE, Scenario, ScenarioError, load_scenarios, result_fingerprint, sql_literal
+
+SCENARIOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios")
+
+
+class SampleClient:
+    """Отвечает на запросы generator = "sample" строками из трёх чисел."""
+
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+        return [(i, 1000 + i, 2000 + i) for i in range(1, 11)]
+
+
+def test_repository_scenarios_load_and_render():
+    scenarios = load_scenarios(SCENARIOS_DIR)
+    assert scenarios
+    client = SampleClient()
+    rng = random.Random(1)
+    for scenario in scenarios.values():
+        assert scenario.weight >= 0
+        scenario.load(client)
+        sql = scenario.render(rng)
+        assert not PARAM_RE.search(sql), scenario.name
+        if scenario.parameterized:
+            assert "CAST(" in sql
+    assert all(" LIMIT " in q for q in client.queries)
+
+
+def test_render_binds_params_in_declaration_order():
+    scenario = Scenario("s", "SELECT {cat:UInt32}, {offer:UInt64}, {day:Date}, {lo:UInt32}, {hi:UInt32}", params={
+        "cat": {"generator": "sample", "query": "SELECT category_id, offer_id FROM ecom_offers"},
+        "offer": {"generator": "column", "of": "cat", "index": 1},
+        "day": {"generator": "constant", "value": "2025-09-01"},
+        "lo": {"generator": "uniform", "min": 10, "max": 10},
+        "hi": {"generator": "offset", "of": "lo", "min": 5, "max": 5},
+    })
+    with pytest.raises(ScenarioError, match="not loaded"):
+        scenario.render(random.Random(0))
+    scenario.load(SampleClient())
+    for seed in range(20):
+        sql = scenario.render(random.Random(seed))
+        cat = int(sql.split("CAST(")[1].split(" ")[0])
+        assert sql == (f"SELECT CAST({cat} AS UInt32), CAST({1000 + cat} AS UInt64), CAST('2025-09-01' AS Date), "
+                       f"CAST(10 AS UInt32), CAST(15 AS UInt32)")
+
+
+class TableClient:
+    """offer_id 1..10000 в порядке первичного ключа; ORDER BY cityHash64(*) перемешивает строки."""
+
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+        rows = [(i,) for i in range(1, 10001)]
+        if "ORDER BY cityHash64(*)" in query:
+            rows.sort(key=lambda row: hashlib.md5(repr(row).encode()).digest())
+        return rows[:int(query.rsplit("LIMIT", 1)[1])]
+
+
+def test_sample_draws_from_across_the_source_set():
+    scenario = Scenario("s", "SELECT {offer:UInt64}", params={
+        "offer": {"generator": "sample", "query": "SELECT offer_id FROM ecom_offers", "limit": 100},
+    })
+    scenario.load(TableClient())
+    rng = random.Random(1)
+    drawn = [int(scenario.render(rng).split("CAST(")[1].split(" ")[0]) for _ in range(500)]
+    assert min(drawn) < 1000 and max(drawn) > 9000          # не первые 100 по ключу
+    assert sum(v > 5000 for v in drawn) > len(drawn) // 4
+
+
+def test_zipf_sample_keeps_the_query_order():
+    client = TableClient()
+    scenario = Scenario("s", "SELECT {offer:UInt64}", params={
+        "offer": {"generator": "sample", "query": "SELECT offer_id FROM ecom_offers", "limit": 100,
+                  "distribution": "zipf"},
+    })
+    scenario.load(client)
+    assert "cityHash64" not in client.queries[0]
+    rng = random.Random(1)
+    assert {int(scenario.render(rng).split("CAST(")[1].split(" ")[0]) for _ in range(500)} <= set(range(1, 101))
+
+
+def test_render_is_reproducible_with_a_seed():
+    scenario = Scenario("s", "SELECT {x:UInt32}", params={"x": {"generator": "zipf", "min": 1, "max": 1000}})
+    first = [scenario.render(random.Random(42)) for _ in range(3)]
+    assert len(set(first)) == 1
+    rng = random.Random(42)
+    assert len({scenario.render(rng) for _ in range(50)}) > 1
+
+
+def test_unparameterized_sql_is_returned_as_is():
+    assert Scenario("s", "SELECT 1").render() == "SELECT 1"
+
+
+def test_sql_literal_escapes_strings():
+    assert sql_literal("it's \\ ok") == "'it\\'s \\\\ ok'"
+    assert sql_literal(True) == "1"
+    assert sql_literal([1, "a"]) == "[1, 'a']"
+
+
+@pytest.mark.parametrize("sql, params, message", [
+    ("SELECT {x:UInt32}", {}, "no generator"),
+    ("SELECT {x:UInt32}", {"x": {"generator": "normal"}}, "unknown generator"),
+    ("SELECT {x:UInt32}", {"x": {"generator": "choice"}}, "needs 'values'"),
+    ("SELECT {x:UInt32}, {y:UInt32}", {"x": {"generator": "offset", "of": "y", "max": 1},
+                                       "y": {"generator": "constant", "value": 1}}, "not declared before"),
+])
+def test_invalid_scenarios_are_rejected(sql, params, message):
+    with pytest.raises(ScenarioError, match=message):
+        Scenario("s", sql, params=params)
+
+
+def test_load_rejects_duplicates_across_files(tmp_path):
+    entry = '[[scenario]]\nname = "dup"\nsql = "SELECT 1"\n'
+    (tmp_path / "a.toml").write_text(entry, encoding="utf-8")
+    (tmp_path / "b.toml").write_text(entry, encoding="utf-8")
+    with pytest.raises(ScenarioError, match="duplicate scenario 'dup'"):
+        load_scenarios(str(tmp_path))
+    (tmp_path / "b.toml").write_text('[[scenario]]\nsql = "SELECT 1"\n', encoding="utf-8")
+    with pytest.raises(ScenarioError, match="without 'name'"):
+        load_scenarios(str(tmp_path))
+
+
+def test_result_fingerprint_ignores_row_order():
+    assert result_fingerprint([(1, "a"), (2, "b")]) == result_fingerprint([[2, "b"], [1, "a"]])
+    assert result_fingerprint([(1, "a")]).startswith("1:")
+    assert result_fingerprint([(1, "a")]) != result_fingerprint([(1, "b")])
@@ -0,0 +1,84 @@
+"""Offline tests of stats.py: median CI, MSER-5, Mann-Whitney and the bootstrap ratio CI."""
+import random
+
+import pytest
+
+from stats import MSER_BATCH, bootstrap_ratio_ci, mann_whitney_greater, median_ci, mser_truncation, quantile
+
+
+def test_quantile_interpolates_between_order_statistics():
+    assert quantile([4, 1, 3, 2], 0.5) == 2.5
+    assert quantile([1, 2, 3, 4], 0.0) == 1
+    assert quantile([1, 2, 3, 4], 1.0) == 4
+    assert quantile([], 0.5) == 0.0
+
+
+def test_median_ci_brackets_the_median():
+    lo, mid, hi = median_ci(range(1, 102))
+    assert mid == 51
+    assert lo < mid < hi
+    assert (lo, hi) == (41, 61)   # n/2 -+ 1.96 * sqrt(101) / 2
+
+
+def test_median_ci_narrows_with_confidence_and_handles_small_samples():
+    samples = [random.Random(1).lognormvariate(0, 0.3) for _ in range(200)]
+    lo95, _, hi95 = median_ci(samples, 0.95)
+    lo80, _, hi80 = median_ci(samples, 0.80)
+    assert lo95 <= lo80 and hi80 <= hi95
+    assert median_ci([]) == (0.0, 0.0, 0.0)
+    assert median_ci([7.0]) == (7.0, 7.0, 7.0)
+
+
+def test_mser_cuts_the_warm_up_and_keeps_a_stationary_series():
+    rng = random.Random(2)
+    warm_up = [1.0 + rng.random() * 0.01 for _ in range(20)]
+    steady = [0.1 + rng.random() * 0.01 for _ in range(200)]
+    cut = mser_truncation(warm_up + steady)
+    assert cut % MSER_BATCH == 0
+    assert 20 <= cut <= 25
+
+    assert mser_truncation(steady) <= len(steady) // 10
+    assert mser_truncation([1.0] * (MSER_BATCH + 1)) == 0
+
+
+def test_mann_whitney_is_one_sided():
+    rng = random.Random(3)
+    base = [rng.gauss(1.0, 0.05) for _ in range(50)]
+    slower = [rng.gauss(1.2, 0.05) for _ in range(50)]
+    u, p = mann_whitney_greater(base, slower)
+    assert u > 50 * 50 / 2
+    assert p < 1e-6
+    assert mann_whitney_greater(slower, base)[1] > 1 - 1e-6
+    assert 0.2 < mann_whitney_greater(base, base)[1] < 0.8   # одинаковые выборки: все пары - совпадения
+
+
+def test_mann_whitney_edge_cases():
+    assert mann_whitney_greater([], [1.0]) == (0.0, 1.0)
+    assert mann_whitney_greater([1.0], [1.0])[1] == 0.5
+
+
+def test_bootstrap_ratio_ci_covers_the_true_ratio():
+    rng = random.Random(4)
+    base = [rng.lognormvariate(0, 0.1) for _ in range(300)]
+    cand = [2 * v for v in base]
+    lo, ratio, hi = bootstrap_ratio_ci(base, cand, 0.5, 0.9)
+    assert ratio == pytest.approx(2.0)
+    assert 1.0 < lo <= ratio <= hi
+    assert bootstrap_ratio_ci([], cand) == (0.0, 0.0, 0.0)
+
+
+def test_bootstrap_ratio_ci_is_two_sided():
+    """Интервал confidence - по (1 - confidence) / 2 в каждом хвосте распределения отношений."""
+    rng = random.Random(5)
+    base = [rng.expovariate(1.0) for _ in range(200)]
+    cand = [rng.expovariate(0.9) for _ in range(200)]
+    lo, _, hi = bootstrap_ratio_ci(base, cand, 0.5, 0.90, resamples=500, seed=7)
+
+    replay = random.Random(7)   # те же ресэмплы, что внутри bootstrap_ratio_ci
+    ratios = []
+    for _ in range(500):
+        qa = quantile(replay.choices(base, k=len(base)), 0.5)
+        qb = quantile(replay.choices(cand, k=len(cand)), 0.5)
+        ratios.append(qb / qa)
+    assert lo == quantile(ratios, 0.05)
+    assert hi == quantile(ratios, 0.95)
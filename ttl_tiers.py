@@ -0,0 +1,157 @@
+"""Storage tiers of events: full detail, daily rollup by TTL GROUP BY, deletion.
+
+raw_events остаётся без TTL - её читают остальные замеры. Ступени проверяются
+на отдельной таблице bench_ttl_events: в ней есть EventCount (число исходных
+событий в строке), а ключ начинается с дня, товара и измерений, как требует
+TTL GROUP BY. События переливаются из raw_events, затем ступени включаются по
+очереди (ALTER TABLE ... MODIFY TTL с материализацией и OPTIMIZE FINAL), и после
+каждой снимаются размер на диске и задержки агрегатных запросов. Ступени
+накопительные:
+    detail - без TTL, все строки;
+    rollup - строки старше detail_days свёрнуты до дня на товар и сочетание измерений;
+    delete - вдобавок удалены строки старше retention_days.
+
+Сроки в TTL считаются от now(), а загруженные данные могут быть старыми, поэтому
+к обоим срокам прибавляется отставание последнего часа данных от текущего дня -
+граница ступени ложится на max(Hour) - N дней, как было бы на свежих данных.
+
+Пользователю benchmark нужны права на bench_ttl_events:
+    GRANT CREATE TABLE, DROP TABLE, INSERT, SELECT, OPTIMIZE,
+          ALTER MODIFY TTL, ALTER MATERIALIZE TTL ON ecom.* TO benchmark;
+"""
+import datetime
+
+SCRATCH_TABLE = "bench_ttl_events"
+
+TIERS = ["detail", "rollup", "delete"]
+DETAIL_DAYS = 14
+RETENTION_DAYS = 365
+
+ROLLUP_KEY = "toDate(Hour), ContentUnitID, DeviceTypeName, ApplicationName, OSName, ProvinceName"
+ROLLUP_TTL = (f"Hour + INTERVAL {{detail}} DAY GROUP BY {ROLLUP_KEY} "
+              "SET EventCount = sum(EventCount), Hour = min(Hour)")
+DELETE_TTL = "Hour + INTERVAL {retention} DAY DELETE"
+
+EVENT_COLUMNS = "Hour, DeviceTypeName, ApplicationName, OSName, ProvinceName, ContentUnitID"
+
+# Ключ TTL GROUP BY должен быть префиксом первичного ключа; Hour в конце ключа
+# сортировки - порядок внутри дня
+CREATE_SQL = f"""
+CREATE TABLE {SCRATCH_TABLE}
+(
+    Hour            DateTime,
+    DeviceTypeName  LowCardinality(String),
+    ApplicationName LowCardinality(String),
+    OSName          LowCardinality(String),
+    ProvinceName    LowCardinality(String),
+    ContentUnitID   UInt64,
+    EventCount      UInt32 DEFAULT 1
+)
+ENGINE = MergeTree
+PARTITION BY toDate(Hour)
+PRIMARY KEY ({ROLLUP_KEY})
+ORDER BY ({ROLLUP_KEY}, Hour)
+"""
+
+# Запросы, которые читают свёрнутый период только агрегатами; recent_hourly -
+# окно внутри срока детализации, его ступени не должны замедлять
+TIER_QUERIES = {
+    "events_by_day": """
+SELECT toDate(Hour) AS day, sum(EventCount) AS events_cnt
+FROM {table}
+GROUP BY day
+ORDER BY day
+""",
+    "device_all": """
+SELECT DeviceTypeName, sum(EventCount) AS events_cnt
+FROM {table}
+GROUP BY DeviceTypeName
+ORDER BY events_cnt DESC
+""",
+    "province_offers": """
+SELECT ProvinceName, sum(EventCount) AS events_cnt, uniq(ContentUnitID) AS offers_cnt
+FROM {table}
+GROUP BY ProvinceName
+ORDER BY events_cnt DESC
+""",
+    "top_offers_old": """
+SELECT ContentUnitID, sum(EventCount) AS events_cnt
+FROM {table}
+WHERE Hour < (SELECT max(Hour) FROM {table}) - INTERVAL {detail} DAY
+GROUP BY ContentUnitID
+ORDER BY events_cnt DESC
+LIMIT 100
+""",
+    "recent_hourly": """
+SELECT Hour, sum(EventCount) AS events_cnt
+FROM {table}
+WHERE Hour >= (SELECT max(Hour) FROM {table}) - INTERVAL 1 DAY
+GROUP BY Hour
+ORDER BY Hour
+""",
+}
+
+STORAGE_SQL = """
+SELECT count(), sum(rows), sum(bytes_on_disk), sum(data_compressed_bytes), sum(data_uncompressed_bytes)
+FROM system.parts
+WHERE database = currentDatabase() AND table = %(table)s AND active
+"""
+
+
+def drop_copy(client) -> None:
+    client.execute(f"DROP TABLE IF EXISTS {SCRATCH_TABLE}")
+
+
+def create_copy(client, days: int = 0) -> tuple:
+    """bench_ttl_events без TTL с событиями raw_events за последние days дней (0 - все),
+    по строке на событие (EventCount = 1). Возвращает (строк, последний час данных)."""
+    drop_copy(client)
+    client.execute(CREATE_SQL)
+    where = f"WHERE Hour >= (SELECT max(Hour) FROM raw_events) - INTERVAL {int(days)} DAY" if days else ""
+    client.execute(f"INSERT INTO {SCRATCH_TABLE} ({EVENT_COLUMNS}) SELECT {EVENT_COLUMNS} FROM raw_events {where}")
+    rows, last_hour = client.execute(f"SELECT count(), max(Hour) FROM {SCRATCH_TABLE}")[0]
+    return rows, last_hour
+
+
+def data_lag_days(last_hour, now=None) -> int:
+    """Полных дней между последним часом данных и текущим моментом (не меньше 0)."""
+    if not last_hour:
+        return 0
+    return max(0, ((now or datetime.datetime.now()) - last_hour).days)
+
+
+def apply_tier(client, tier: str, detail_days: int, retention_days: int) -> None:
+    """Включает правила TTL ступени и дожидается их применения ко всем партам.
+
+    OPTIMIZE FINAL выполняется и для detail: у всех ступеней одинаковое число
+    партов на партицию, и размер сравнивается без влияния незавершённых слияний.
+    """
+    if tier == "rollup":
+        ttl = ROLLUP_TTL.format(detail=int(detail_days))
+    elif tier == "delete":
+        ttl = ", ".join([ROLLUP_TTL.format(detail=int(detail_days)),
+                         DELETE_TTL.format(retention=int(retention_days))])
+    elif tier == "detail":
+        ttl = None
+    else:
+        raise ValueError(f"unknown tier {tier!r}, expected one of {TIERS}")
+    if ttl:
+        client.execute(f"ALTER TABLE {SCRATCH_TABLE} MODIFY TTL {ttl}",
+                       settings={"materialize_ttl_after_modify": 1, "mutations_sync": 2})
+    client.execute(f"OPTIMIZE TABLE {SCRATCH_TABLE} FINAL")
+
+
+def copy_storage(client) -> dict:
+    """Активные парты bench_ttl_events: число, строки и байты."""
+    row = client.execute(STORAGE_SQL, {"table": SCRATCH_TABLE})[0]
+    return dict(zip(["parts", "rows", "bytes_on_disk", "compressed", "uncompressed"], (v or 0 for v in row)))
+
+
+def daily_events(client) -> dict:
+    """sum(EventCount) по дням: ступени не должны менять суммы сохранившихся дней."""
+    return dict(client.execute(TIER_QUERIES["events_by_day"].format(table=SCRATCH_TABLE)))
+
+
+def tier_queries(detail_days: int) -> dict:
+    return {name: sql.format(table=SCRATCH_TABLE, detail=int(detail_days)).strip()
+            for name, sql in TIER_QUERIES.items()}